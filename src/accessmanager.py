@@ -3,6 +3,8 @@ import errno
 import logging
 import shutil
 import os
+import datetime
+import threading
 
 import exceptions
 
@@ -22,6 +24,22 @@ class Group:
         return self.accessm.groups[self.name]['members']
 
 
+class _AclIndex:
+    """
+    Precomputed permissions of an acl
+    """
+
+    __slots__ = ("members", "groups", "everyone")
+
+    def __init__(self, members, groups):
+        self.members = set(members)
+        """ :type: set(str)"""
+        self.groups = set(groups)           # Allowed groups, expanded with the groups above them
+        """ :type: set(str)"""
+        self.everyone = "%all%" in self.groups
+        """ :type: bool"""
+
+
 class AccessManager:
     bot = None
 
@@ -33,9 +51,36 @@ class AccessManager:
     groups = {}
     acls = {}
 
+    # Group: the groups directly above it. Members of the groups above get all permissions of the group
+    default_hierarchy = {"%operators": ["%owner"], "%moderators": ["%operators"], "%all": ["%moderators"]}
+
+    # Twitch role: the group its holders are treated as members of
+    role_groups = {"broadcaster": "%owner", "moderator": "%moderators", "vip": "%vip", "subscriber": "%subscribers"}
+
+    flush_delay = datetime.timedelta(seconds=5)     # How long changes are collected before writing them to the file
+
     def __init__(self):
         self.acls = dict()
         self.groups = dict()
+        self.hierarchy = self.copy_hierarchy(self.default_hierarchy)
+
+        self.closure = None                 # group: frozenset of all groups above it
+        """ :type: dict(str: frozenset(str))"""
+        self.closure_source = None          # hierarchy the closure was computed from
+
+        # Index for permission checks, built from groups and acls when needed and kept up to date on changes
+        self.user_groups = None             # user: set of groups the user is a member of
+        """ :type: dict(str: set(str))"""
+        self.acl_index = None               # acl: _AclIndex
+        """ :type: dict(str: _AclIndex)"""
+        self.indexed = None                 # groups and acls the index was built from
+
+        self.dirty = False                  # Are there changes not yet written to the file
+        self.flush_scheduled = False
+
+        # Modules register their acls from several threads while they are initialized, and blocking handlers
+        # check permissions from the worker pool
+        self.lock = threading.RLock()
 
     def init(self, bot):
         """
@@ -69,8 +114,8 @@ class AccessManager:
                     self.acls[acl]['members'].append(member.lower())
                     changed = True
 
-        if changed:
-            self.write_JSON()
+        if changed or self.dirty:
+            self.save()
 
         self.log.info("Init complete")
 
@@ -79,11 +124,41 @@ class AccessManager:
             self.add_group("%operators")
             self.add_group("%moderators")
             self.add_group("%all%")
-            self.write_JSON()
+            self.save()
 
     def dispose(self):
+        if self.flush_scheduled:
+            self.bot.timemanager.unregister(self.flush)
+        self.flush()
         self.log.info("Disposed")
 
+    def save(self):
+        """
+        Mark the access-data changed. The changes are collected for :attr:flush_delay and then written to the file
+        at once, so that a burst of edits does not rewrite the whole file for every one of them. Without a
+        timemanager to schedule the write, the data is written immediately
+        """
+        with self.lock:
+            self.dirty = True
+            if self.flush_scheduled:
+                return
+
+            timemanager = getattr(self.bot, "timemanager", None)
+            if timemanager is None:
+                self.flush()
+            else:
+                timemanager.register_once(self.flush, self.flush_delay)
+                self.flush_scheduled = True
+
+    def flush(self):
+        """
+        Write the access-data to the file if it has changed
+        """
+        with self.lock:
+            self.flush_scheduled = False
+            if self.dirty:
+                self.write_JSON()
+
     # noinspection PyPep8Naming
     def read_JSON(self):
         """
@@ -109,6 +184,11 @@ class AccessManager:
             data = json.loads(jsondata)
             self.groups = data['groups']
             self.acls = data['acls']
+            if 'hierarchy' in data:
+                self.hierarchy = data['hierarchy']
+            else:
+                self.hierarchy = self.copy_hierarchy(self.default_hierarchy)
+                self.dirty = True                                   # Add the hierarchy to the file
         except ValueError:
             self.log.error("acls-file malformed")
             shutil.copyfile(self.jsonpath, self.jsonpath + ".bak")
@@ -116,13 +196,19 @@ class AccessManager:
     # noinspection PyPep8Naming
     def write_JSON(self):
         """
-        Write the access-data to a JSON file
+        Write the access-data to a JSON file. The data is written to a temporary file first and then moved over the
+        old one, so that the file is never left half-written
         """
-        jsondata = {"groups": self.groups, "acls": self.acls}
-        file = open(self.jsonpath, "w")
+        jsondata = {"groups": self.groups, "acls": self.acls, "hierarchy": self.hierarchy}
         data = json.dumps(jsondata, sort_keys=True, indent=4, separators=(',', ': '))
+        temppath = self.jsonpath + ".tmp"
+        file = open(temppath, "w")
         file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
         file.close()
+        os.replace(temppath, self.jsonpath)
+        self.dirty = False
 
     def add_group(self, group, members=None):
         """
@@ -131,7 +217,7 @@ class AccessManager:
         :param members: Optional list of members to initialize the group with
         :type members: list(str)
 
-        Create a new group and optionally add members to it
+        Create a new group and optionally add members to it. An existing group is replaced
         """
         group = group.lower()
         if members is None:
@@ -143,8 +229,14 @@ class AccessManager:
             members = list()
             members.append(tmp)
         members = [member.lower() for member in members]
+        if self.index_current() and group in self.groups:
+            for member in self.groups[group]['members']:
+                self.unindex_member(group, member)
         self.groups[group] = {"members": members}
-        self.write_JSON()
+        if self.index_current():
+            for member in members:
+                self.user_groups.setdefault(member, set()).add(group)
+        self.save()
 
     def remove_group(self, group):
         """
@@ -154,8 +246,11 @@ class AccessManager:
         Remove a group if it exists
         """
         group = group.lower()
-        self.groups.pop(group, None)
-        self.write_JSON()
+        removed = self.groups.pop(group, None)
+        if removed is not None and self.index_current():
+            for member in removed['members']:
+                self.unindex_member(group, member)
+        self.save()
 
     def exists_group(self, group):
         """
@@ -196,14 +291,18 @@ class AccessManager:
         :param name: Name of the person
         :type name: str
 
-        Add a person to a group
+        Add a person to a group. Raises an exception if the group does not exist
         """
         group = group.lower()
         name = name.lower()
+        if not self.exists_group(group):
+            raise Exception("Group does not exist")
         members = self.get_group(group).get_members()
         if name not in members:
             members.append(name)
-            self.write_JSON()
+            if self.index_current():
+                self.user_groups.setdefault(name, set()).add(group)
+            self.save()
 
     def remove_from_group(self, group, name):
         """
@@ -212,13 +311,96 @@ class AccessManager:
         :param name: Name of the person
         :type name: str
 
-        Remove a person from a group
+        Remove a person from a group. Raises an exception if the group does not exist, and ValueError if the person
+        is not in it
         """
         group = group.lower()
         name = name.lower()
+        if not self.exists_group(group):
+            raise Exception("Group does not exist")
 
         self.get_group(group).get_members().remove(name)
-        self.write_JSON()
+        if self.index_current():
+            self.unindex_member(group, name)
+        self.save()
+
+    def add_many_to_group(self, group, names):
+        """
+        :param group: Name of the group
+        :type group: str
+        :param names: Names of the people, e.g. the lines of a file. Empty names are skipped
+        :type names: iterable(str)
+
+        :return: how many names were added and how many were already in the group
+        :rtype: (int, int)
+
+        Add many people to a group at once, with a single write of the access-data
+        """
+        group = group.lower()
+        if not self.exists_group(group):
+            raise Exception("Group does not exist")
+
+        members = self.groups[group]['members']
+        existing = set(members)
+        index = self.index_current()
+
+        added = 0
+        present = 0
+        for name in names:
+            name = name.strip().lower()
+            if len(name) == 0:
+                continue
+            if name in existing:
+                present += 1
+                continue
+            existing.add(name)
+            members.append(name)
+            if index:
+                self.user_groups.setdefault(name, set()).add(group)
+            added += 1
+
+        if added > 0:
+            self.save()
+        return added, present
+
+    def import_group(self, group, path):
+        """
+        :param group: Name of the group
+        :type group: str
+        :param path: path of a text file with one name on each line
+        :type path: str
+
+        :return: how many names were added and how many were already in the group
+        :rtype: (int, int)
+
+        Add the people listed in a file to a group. The file is read line by line
+        """
+        with open(path, "r") as file:
+            return self.add_many_to_group(group, file)
+
+    def export_group(self, group, path):
+        """
+        :param group: Name of the group
+        :type group: str
+        :param path: path of the file to write, one name on each line
+        :type path: str
+
+        :return: how many names were written
+        :rtype: int
+
+        Write the members of a group to a file
+        """
+        if not self.exists_group(group):
+            raise Exception("Group does not exist")
+
+        count = 0
+        temppath = path + ".tmp"
+        with open(temppath, "w") as file:
+            for member in self.get_group(group).get_members():
+                file.write(member + "\n")
+                count += 1
+        os.replace(temppath, path)
+        return count
 
     def create_acl(self, acl):
         """
@@ -228,10 +410,14 @@ class AccessManager:
         Create a new acl
         """
         self.acls[acl] = {"groups": [], "members": []}
-        self.write_JSON()
+        self.index_acl(acl)
+        self.save()
 
     def remove_acl(self, acl):
         self.acls.pop(acl, None)
+        if self.index_current():
+            self.acl_index.pop(acl, None)
+        self.save()
         self.log.info("Removed acl: " + acl)
 
     def exists_acl(self, acl):
@@ -260,24 +446,25 @@ class AccessManager:
 
         Register an acl. Create a new one with the defaults if it does not exist
         """
-        if not self.exists_acl(acl):
-            self.create_acl(acl)
-            if default_groups is None and default_members is None:
-                #self.add_group_to_acl(acl, "%owner")
-                #self.add_group_to_acl(acl, "%operators")
-                self.add_group_to_acl(acl, "%moderators")
-            else:
-                if default_groups:
-                    if type(default_groups) != type(list()) and type(default_groups) != type(tuple()):
-                        default_groups = [default_groups]
-                    for group in default_groups:
-                        self.add_group_to_acl(acl, group)
-                if default_members:
-                    if type(default_members) != type(list()) and type(default_members) != type(tuple()):
-                        default_members = [default_members]
-                    for member in default_members:
-                        self.add_user_to_acl(acl, member)
-            self.write_JSON()
+        with self.lock:
+            if not self.exists_acl(acl):
+                self.create_acl(acl)
+                if default_groups is None and default_members is None:
+                    #self.add_group_to_acl(acl, "%owner")
+                    #self.add_group_to_acl(acl, "%operators")
+                    self.add_group_to_acl(acl, "%moderators")
+                else:
+                    if default_groups:
+                        if type(default_groups) != type(list()) and type(default_groups) != type(tuple()):
+                            default_groups = [default_groups]
+                        for group in default_groups:
+                            self.add_group_to_acl(acl, group)
+                    if default_members:
+                        if type(default_members) != type(list()) and type(default_members) != type(tuple()):
+                            default_members = [default_members]
+                        for member in default_members:
+                            self.add_user_to_acl(acl, member)
+                self.save()
 
     def add_group_to_acl(self, acl, group):
         """
@@ -295,9 +482,10 @@ class AccessManager:
             return
         if not group in self.acls[acl]['groups']:
             self.acls[acl]['groups'].append(group)
+            self.index_acl(acl)
         else:
             self.log.warning("Called group is already in acl")
-        self.write_JSON()
+        self.save()
 
     def remove_group_from_acl(self, acl, group):
         """
@@ -310,6 +498,8 @@ class AccessManager:
         """
         group = group.lower()
         self.acls[acl]['groups'].remove(group)
+        self.index_acl(acl)
+        self.save()
 
     def add_user_to_acl(self, acl, user):
         """
@@ -323,7 +513,8 @@ class AccessManager:
         user = user.lower()
         if not user in self.acls[acl]['members']:
             self.acls[acl]['members'].append(user)
-            self.write_JSON()
+            self.index_acl(acl)
+            self.save()
 
     def remove_user_from_acl(self, acl, user):
         """
@@ -336,6 +527,134 @@ class AccessManager:
         """
         user = user.lower()
         self.acls[acl]['members'].remove(user)
+        self.index_acl(acl)
+        self.save()
+
+    def copy_hierarchy(self, hierarchy):
+        """
+        :param hierarchy: group hierarchy
+        :type hierarchy: dict(str: list(str))
+
+        :return: a copy of the hierarchy that can be modified
+        :rtype: dict(str: list(str))
+        """
+        return {group: list(above) for group, above in hierarchy.items()}
+
+    def compute_closure(self, hierarchy):
+        """
+        :param hierarchy: group hierarchy
+        :type hierarchy: dict(str: list(str))
+
+        :return: all groups above each group, directly or through other groups
+        :rtype: dict(str: frozenset(str))
+
+        Compute the transitive closure of the group hierarchy. Raises an exception if the hierarchy has a cycle
+        """
+        closure = dict()
+        visiting = set()
+
+        def visit(group):
+            if group in closure:
+                return closure[group]
+            if group in visiting:
+                raise Exception("Group hierarchy has a cycle through " + group)
+
+            visiting.add(group)
+            above = set()
+            for parent in hierarchy.get(group, ()):
+                above.add(parent)
+                above |= visit(parent)
+            visiting.discard(group)
+
+            closure[group] = frozenset(above)
+            return closure[group]
+
+        for group in hierarchy:
+            visit(group)
+        return closure
+
+    def get_closure(self):
+        """
+        :return: all groups above each group
+        :rtype: dict(str: frozenset(str))
+
+        Return the transitive closure of the group hierarchy, computing it again if the hierarchy has been replaced.
+        A hierarchy with a cycle is replaced with the default one
+        """
+        if self.closure_source is not self.hierarchy:
+            try:
+                self.closure = self.compute_closure(self.hierarchy)
+            except Exception as e:
+                self.log.error(str(e) + ", using the default hierarchy")
+                self.hierarchy = self.copy_hierarchy(self.default_hierarchy)
+                self.closure = self.compute_closure(self.hierarchy)
+            self.closure_source = self.hierarchy
+        return self.closure
+
+    def get_groups_above(self, group):
+        """
+        :param group: name of the group
+        :type group: str
+
+        :return: the groups directly above the group
+        :rtype: list(str)
+        """
+        return list(self.hierarchy.get(group.lower(), []))
+
+    def set_groups_above(self, group, above):
+        """
+        :param group: name of the group
+        :type group: str
+        :param above: groups directly above the group. Their members get all permissions of the group
+        :type above: list(str)
+
+        Change the place of a group in the hierarchy. Raises an exception if the change would create a cycle, in
+        which case the hierarchy is not changed
+        """
+        group = group.lower()
+        above = [parent.lower() for parent in above]
+
+        hierarchy = self.copy_hierarchy(self.hierarchy)
+        if len(above) > 0:
+            hierarchy[group] = above
+        else:
+            hierarchy.pop(group, None)
+        closure = self.compute_closure(hierarchy)   # Raises on a cycle before anything is changed
+
+        reindex = self.index_current()
+        self.hierarchy = hierarchy
+        self.closure = closure
+        self.closure_source = hierarchy
+        if reindex:
+            self.build_index()
+        self.save()
+
+    def add_group_above(self, group, parent):
+        """
+        :param group: name of the group
+        :type group: str
+        :param parent: name of the group to put directly above it
+        :type parent: str
+
+        Give the members of a group all permissions of another group
+        """
+        above = self.get_groups_above(group)
+        if parent.lower() not in above:
+            self.set_groups_above(group, above + [parent])
+
+    def remove_group_above(self, group, parent):
+        """
+        :param group: name of the group
+        :type group: str
+        :param parent: name of the group directly above it
+        :type parent: str
+
+        Remove a group from directly above another group in the hierarchy
+        """
+        above = self.get_groups_above(group)
+        if parent.lower() in above:
+            above.remove(parent.lower())
+            self.set_groups_above(group, above)
 
     def expand_groups(self, groups):
         """
@@ -346,47 +665,95 @@ class AccessManager:
         :rtype: list(str)
 
         Expand a list of groups, so that all groups with higher level of privileges get permissions,
-        if a lower group has them
+        if a lower group has them. The levels come from the group hierarchy
         """
 
         if type(groups) != type(list()) and type(groups) != type(tuple()):
             groups = [groups]
 
+        closure = self.get_closure()
+
         expanded = []
         expanded += groups
 
         for group in groups:
-            if group == "%operators":
-                if "%owner" not in expanded:
-                    expanded.append("%owner")
-            elif group == "%moderators":
-                if "%owner" not in expanded:
-                    expanded.append("%owner")
-                if "%operators" not in expanded:
-                    expanded.append("%operators")
-            elif group == "%all":
-                if "%owner" not in expanded:
-                    expanded.append("%owner")
-                if "%operators" not in expanded:
-                    expanded.append("%operators")
-                if "%moderators" not in expanded:
-                    expanded.append("%moderators")
+            for parent in sorted(closure.get(group, ())):
+                if parent not in expanded:
+                    expanded.append(parent)
 
         return expanded
 
-    def is_in_acl(self, user, acl):
+    def index_current(self):
+        """
+        :return: is the permission index built from the current groups and acls
+        :rtype: bool
+        """
+        return self.indexed is not None and self.indexed[0] is self.groups and self.indexed[1] is self.acls and \
+            self.indexed[2] is self.hierarchy
+
+    def build_index(self):
+        """
+        Build the permission index from scratch. Done on the first permission check and whenever groups or acls
+        have been replaced as a whole, e.g. by reading them from the file
+        """
+        self.user_groups = dict()
+        for group in self.groups:
+            for member in self.groups[group]['members']:
+                self.user_groups.setdefault(member, set()).add(group)
+
+        self.get_closure()
+        self.indexed = (self.groups, self.acls, self.hierarchy)
+        self.acl_index = dict()
+        for acl in self.acls:
+            self.index_acl(acl)
+
+    def index_acl(self, acl):
+        """
+        :param acl: name of the acl
+        :type acl: str
+
+        Update the permissions of a changed acl in the index
+        """
+        if self.index_current():
+            data = self.acls[acl]
+            self.acl_index[acl] = _AclIndex(data['members'], self.expand_groups(data['groups']))
+
+    def unindex_member(self, group, user):
+        """
+        :param group: name of the group
+        :type group: str
+        :param user: name of the user removed from the group
+        :type user: str
+
+        Update the index after a user has been removed from a group
+        """
+        groups = self.user_groups.get(user)
+        if groups is not None:
+            groups.discard(group)
+            if len(groups) == 0:
+                del self.user_groups[user]
+
+    def is_in_acl(self, user, acl, roles=None):
         """
         :param user: name of the user
         :type user: str
         :param acl: name of the acl
         :type acl: str
+        :param roles: Twitch roles of the user, e.g. :attr:message.Message.roles. The user is treated as a member of
+                      the groups of the roles in :attr:role_groups
+        :type roles: frozenset(str)
 
         :return: has the user permissions
         :rtype: bool
 
-        Check if a user is in an acl, either directly or through a group
+        Check if a user is in an acl, either directly or through a group. Uses the permission index, so the check
+        takes a few set lookups regardless of the size of the groups
         """
-        if not acl in self.acls.keys():
+        if not self.index_current():
+            self.build_index()
+
+        index = self.acl_index.get(acl)
+        if index is None:
             raise Exception("ACL does not exist")
 
         user = user.lower()
@@ -394,18 +761,20 @@ class AccessManager:
         if user == 'cli':
             return True                                             # Give local users all permissions
 
-        if user in self.get_group("%owner").get_members():          # Always allow owner
-            return True
+        groups = self.user_groups.get(user, ())
+        if roles:
+            groups = set(groups)
+            for role in roles:
+                if role in self.role_groups:
+                    groups.add(self.role_groups[role])
 
-        if "%all%" in self.acls[acl]["groups"]:                     # Acl allows everyone
+        if "%owner" in groups:                                      # Always allow owner
             return True
 
-        if user in self.acls[acl]['members']:                       # User is allowed
+        if index.everyone:                                          # Acl allows everyone
             return True
 
-        groups = self.expand_groups(self.acls[acl]['groups'])
-        for group in groups:
-            if user.lower() in self.groups[group]['members']:       # User is member of allowed group
-                return True
+        if user in index.members:                                   # User is allowed
+            return True
 
-        return False
+        return not index.groups.isdisjoint(groups)                  # User is member of allowed group
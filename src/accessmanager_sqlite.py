@@ -0,0 +1,502 @@
+#
+# SQLite storage for the access manager, for groups too large to be kept in a JSON file
+#
+# Author: Esa Varemo
+#
+
+import json
+import os
+import sqlite3
+
+from accessmanager import AccessManager, Group, _AclIndex
+
+
+class SqliteGroup(Group):
+    """
+    A group stored in the database
+    """
+
+    def __init__(self, name, accessm):
+        self.name = name
+        self.accessm = accessm
+
+    def get_members(self):
+        return self.accessm.get_members(self.name)
+
+
+class SqliteAccessManager(AccessManager):
+    """
+    An access manager that keeps groups and acls in an SQLite database instead of acls.json. Members are stored in
+    indexed tables, so a permission check is a couple of index lookups and a change writes only the changed rows.
+    Changes are collected into a transaction that is committed after :attr:flush_delay, like the writes of the JSON
+    file. Only the acls and the group hierarchy, which are small, are kept in memory
+    """
+
+    dbname = "acls.sqlite"
+    dbpath = None
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS groups (name TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS group_members (grp TEXT NOT NULL, user TEXT NOT NULL, UNIQUE (grp, user));
+        CREATE INDEX IF NOT EXISTS group_members_user ON group_members (user);
+        CREATE TABLE IF NOT EXISTS acls (name TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS acl_groups (acl TEXT NOT NULL, grp TEXT NOT NULL, UNIQUE (acl, grp));
+        CREATE TABLE IF NOT EXISTS acl_members (acl TEXT NOT NULL, user TEXT NOT NULL, UNIQUE (acl, user));
+        CREATE TABLE IF NOT EXISTS hierarchy (grp TEXT NOT NULL, parent TEXT NOT NULL, UNIQUE (grp, parent));
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.db = None
+        """ :type: sqlite3.Connection"""
+
+        self.acl_index = dict()             # acl: _AclIndex with the expanded groups of the acl
+
+    @property
+    def groups(self):
+        """
+        :return: the groups and their members read from the database, in the same form as in acls.json. Changing
+                 the returned dict does not change the groups
+        :rtype: dict(str: dict)
+        """
+        if getattr(self, "db", None) is None:
+            return dict()
+        with self.lock:
+            groups = dict((row[0], {"members": []}) for row in self.db.execute("SELECT name FROM groups"))
+            for group, user in self.db.execute("SELECT grp, user FROM group_members ORDER BY rowid"):
+                if group in groups:
+                    groups[group]["members"].append(user)
+        return groups
+
+    @groups.setter
+    def groups(self, groups):
+        if len(groups) > 0:     # AccessManager.__init__ sets it empty, anything else would be lost
+            raise AttributeError("The groups are stored in the database, change them with add_group()")
+
+    def init(self, bot):
+        """
+        :param bot: Reference to the main bot instance
+        :type bot: Bot
+
+        Open the database and create the tables. If the database is empty and there is an acls.json, its contents
+        are migrated into the database
+        """
+        self.bot = bot
+
+        self.jsonpath = os.path.join(self.bot.datadir, self.jsonname)
+        self.dbpath = os.path.join(self.bot.datadir, self.dbname)
+
+        self.db = sqlite3.connect(self.dbpath, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.schema)
+
+        empty = self.db.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 0
+        if empty and os.path.isfile(self.jsonpath):
+            self.migrate_json(self.jsonpath)
+
+        if self.db.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 0:
+            self.add_group("%owner")
+            self.add_group("%operators")
+            self.add_group("%moderators")
+            self.add_group("%all%")
+            for group, above in self.default_hierarchy.items():
+                for parent in above:
+                    self.db.execute("INSERT INTO hierarchy VALUES (?, ?)", (group, parent))
+            self.flush()
+
+        self.hierarchy = dict()
+        for group, parent in self.db.execute("SELECT grp, parent FROM hierarchy ORDER BY rowid"):
+            self.hierarchy.setdefault(group, []).append(parent)
+
+        self.build_index()
+
+        self.log.info("Init complete")
+
+    def dispose(self):
+        super().dispose()
+        with self.lock:
+            self.db.close()
+
+    def flush(self):
+        """
+        Commit the changes made since the last flush
+        """
+        self.flush_scheduled = False
+        if self.dirty:
+            with self.lock:
+                self.db.commit()
+            self.dirty = False
+
+    def migrate_json(self, jsonpath):
+        """
+        :param jsonpath: path of the acls.json to migrate
+        :type jsonpath: str
+
+        Copy the groups, acls and hierarchy of a JSON datafile into the database in one transaction. The file is
+        renamed afterwards, so that the migration is done only once
+        """
+        with open(jsonpath, "r") as file:
+            data = json.load(file)
+
+        with self.lock:
+            for group, content in data['groups'].items():
+                self.db.execute("INSERT OR IGNORE INTO groups VALUES (?)", (group.lower(),))
+                self.db.executemany("INSERT OR IGNORE INTO group_members VALUES (?, ?)",
+                                    ((group.lower(), member.lower()) for member in content['members']))
+            for acl, content in data['acls'].items():
+                self.db.execute("INSERT OR IGNORE INTO acls VALUES (?)", (acl,))
+                self.db.executemany("INSERT OR IGNORE INTO acl_groups VALUES (?, ?)",
+                                    ((acl, group.lower()) for group in content['groups']))
+                self.db.executemany("INSERT OR IGNORE INTO acl_members VALUES (?, ?)",
+                                    ((acl, member.lower()) for member in content['members']))
+            for group, above in data.get('hierarchy', self.default_hierarchy).items():
+                self.db.executemany("INSERT OR IGNORE INTO hierarchy VALUES (?, ?)",
+                                    ((group, parent) for parent in above))
+            self.db.commit()
+
+        os.replace(jsonpath, jsonpath + ".migrated")
+        self.log.info("Migrated %d groups and %d acls from %s to the database" %
+                      (len(data['groups']), len(data['acls']), jsonpath))
+
+    def add_group(self, group, members=None):
+        """
+        :param group: Name of the group to be created
+        :type group: str
+        :param members: Optional list of members to initialize the group with
+        :type members: list(str)
+
+        Create a new group and optionally add members to it. An existing group is replaced
+        """
+        group = group.lower()
+        if members is None:
+            members = []
+        elif not isinstance(members, (list, tuple)):
+            members = [members]
+
+        with self.lock:
+            self.db.execute("INSERT OR IGNORE INTO groups VALUES (?)", (group,))
+            self.db.execute("DELETE FROM group_members WHERE grp = ?", (group,))
+            self.db.executemany("INSERT OR IGNORE INTO group_members VALUES (?, ?)",
+                                ((group, member.lower()) for member in members))
+        self.save()
+
+    def remove_group(self, group):
+        """
+        :param group: Name of the group to be removed
+        :type group: str
+
+        Remove a group if it exists
+        """
+        group = group.lower()
+        with self.lock:
+            self.db.execute("DELETE FROM groups WHERE name = ?", (group,))
+            self.db.execute("DELETE FROM group_members WHERE grp = ?", (group,))
+        self.save()
+
+    def exists_group(self, group):
+        """
+        :param group: Name of the group to check
+        :type group: str
+
+        :return: Does the group exists
+        :rtype: bool
+        """
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM groups WHERE name = ?", (group.lower(),)).fetchone() is not None
+
+    def get_group(self, group):
+        """
+        :param group: Name of the group
+        :type group: str
+
+        :return: An instance of the group specified
+        :rtype: SqliteGroup
+        """
+        group = group.lower()
+        if self.exists_group(group):
+            return SqliteGroup(group, self)
+        else:
+            return None
+
+    def get_members(self, group):
+        """
+        :param group: Name of the group
+        :type group: str
+
+        :return: the members of the group in the order they were added
+        :rtype: list(str)
+        """
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT user FROM group_members WHERE grp = ? ORDER BY rowid",
+                                                      (group.lower(),))]
+
+    def add_to_group(self, group, name):
+        """
+        :param group: Name of the group
+        :type group: str
+        :param name: Name of the person
+        :type name: str
+
+        Add a person to a group. Raises an exception if the group does not exist
+        """
+        if not self.exists_group(group):
+            raise Exception("Group does not exist")
+        with self.lock:
+            added = self.db.execute("INSERT OR IGNORE INTO group_members VALUES (?, ?)",
+                                    (group.lower(), name.lower())).rowcount
+        if added > 0:
+            self.save()
+
+    def remove_from_group(self, group, name):
+        """
+        :param group: Name of the group
+        :type group: str
+        :param name: Name of the person
+        :type name: str
+
+        Remove a person from a group. Raises an exception if the group does not exist, and ValueError if the person
+        is not in it
+        """
+        if not self.exists_group(group):
+            raise Exception("Group does not exist")
+        with self.lock:
+            removed = self.db.execute("DELETE FROM group_members WHERE grp = ? AND user = ?",
+                                      (group.lower(), name.lower())).rowcount
+        if removed == 0:
+            raise ValueError(name + " is not a member of " + group)
+        self.save()
+
+    def add_many_to_group(self, group, names):
+        """
+        :param group: Name of the group
+        :type group: str
+        :param names: Names of the people, e.g. the lines of a file. Empty names are skipped
+        :type names: iterable(str)
+
+        :return: how many names were added and how many were already in the group
+        :rtype: (int, int)
+
+        Add many people to a group at once, in a single transaction
+        """
+        group = group.lower()
+        if not self.exists_group(group):
+            raise Exception("Group does not exist")
+
+        total = 0
+
+        def rows():
+            nonlocal total
+            for name in names:
+                name = name.strip().lower()
+                if len(name) > 0:
+                    total += 1
+                    yield group, name
+
+        with self.lock:
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO group_members VALUES (?, ?)", rows())
+            added = self.db.total_changes - before
+
+        if added > 0:
+            self.save()
+        return added, total - added
+
+    def create_acl(self, acl):
+        """
+        :param acl: Name of the acl
+        :type acl: str
+
+        Create a new acl
+        """
+        with self.lock:
+            self.db.execute("INSERT OR IGNORE INTO acls VALUES (?)", (acl,))
+            self.db.execute("DELETE FROM acl_groups WHERE acl = ?", (acl,))
+            self.db.execute("DELETE FROM acl_members WHERE acl = ?", (acl,))
+        self.index_acl(acl)
+        self.save()
+
+    def remove_acl(self, acl):
+        with self.lock:
+            self.db.execute("DELETE FROM acls WHERE name = ?", (acl,))
+            self.db.execute("DELETE FROM acl_groups WHERE acl = ?", (acl,))
+            self.db.execute("DELETE FROM acl_members WHERE acl = ?", (acl,))
+        self.acl_index.pop(acl, None)
+        self.save()
+        self.log.info("Removed acl: " + acl)
+
+    def exists_acl(self, acl):
+        """
+        :param acl: Name of the ACL
+        :type acl: str
+
+        :return: does the acl exist?
+        :rtype: bool
+        """
+        return acl in self.acl_index
+
+    def add_group_to_acl(self, acl, group):
+        """
+        :param acl: name of the acl
+        :type acl: str
+        :param group: name of the group
+        :type group: str
+
+        Add a group to the acl
+        """
+        group = group.lower()
+
+        if not self.exists_group(group):
+            self.log.warning("Called group does not exist")
+            return
+        with self.lock:
+            added = self.db.execute("INSERT OR IGNORE INTO acl_groups VALUES (?, ?)", (acl, group)).rowcount
+        if added:
+            self.index_acl(acl)
+            self.save()
+        else:
+            self.log.warning("Called group is already in acl")
+
+    def remove_group_from_acl(self, acl, group):
+        """
+        :param acl: name of the acl
+        :type acl: str
+        :param group: name of the group
+        :type group: str
+
+        Remove a group from an acl if possible
+        """
+        with self.lock:
+            self.db.execute("DELETE FROM acl_groups WHERE acl = ? AND grp = ?", (acl, group.lower()))
+        self.index_acl(acl)
+        self.save()
+
+    def add_user_to_acl(self, acl, user):
+        """
+        :param acl: name of the acl
+        :type acl: str
+        :param user: name of the user
+        :type user: str
+
+        Add a user to the acl
+        """
+        with self.lock:
+            self.db.execute("INSERT OR IGNORE INTO acl_members VALUES (?, ?)", (acl, user.lower()))
+        self.save()
+
+    def remove_user_from_acl(self, acl, user):
+        """
+        :param acl: name of the acl
+        :type acl: str
+        :param user: name of the user
+        :type user: str
+
+        Remove a user from an acl if possible
+        """
+        with self.lock:
+            self.db.execute("DELETE FROM acl_members WHERE acl = ? AND user = ?", (acl, user.lower()))
+        self.save()
+
+    def set_groups_above(self, group, above):
+        """
+        :param group: name of the group
+        :type group: str
+        :param above: groups directly above the group. Their members get all permissions of the group
+        :type above: list(str)
+
+        Change the place of a group in the hierarchy. Raises an exception if the change would create a cycle, in
+        which case the hierarchy is not changed
+        """
+        group = group.lower()
+        above = [parent.lower() for parent in above]
+
+        hierarchy = self.copy_hierarchy(self.hierarchy)
+        if len(above) > 0:
+            hierarchy[group] = above
+        else:
+            hierarchy.pop(group, None)
+        closure = self.compute_closure(hierarchy)   # Raises on a cycle before anything is changed
+
+        with self.lock:
+            self.db.execute("DELETE FROM hierarchy WHERE grp = ?", (group,))
+            self.db.executemany("INSERT INTO hierarchy VALUES (?, ?)", ((group, parent) for parent in above))
+
+        self.hierarchy = hierarchy
+        self.closure = closure
+        self.closure_source = hierarchy
+        self.build_index()
+        self.save()
+
+    def index_current(self):
+        """
+        :return: is the index up to date, which it always is as it is updated on every change
+        :rtype: bool
+        """
+        return True
+
+    def build_index(self):
+        """
+        Build the index of the expanded groups of each acl
+        """
+        self.get_closure()
+        with self.lock:
+            acls = [row[0] for row in self.db.execute("SELECT name FROM acls")]
+        self.acl_index = dict()
+        for acl in acls:
+            self.index_acl(acl)
+
+    def index_acl(self, acl):
+        """
+        :param acl: name of the acl
+        :type acl: str
+
+        Update the expanded groups of a changed acl in the index. The members of the acl stay in the database
+        """
+        with self.lock:
+            groups = [row[0] for row in self.db.execute("SELECT grp FROM acl_groups WHERE acl = ? ORDER BY rowid",
+                                                        (acl,))]
+        self.acl_index[acl] = _AclIndex((), self.expand_groups(groups))
+
+    def is_in_acl(self, user, acl, roles=None):
+        """
+        :param user: name of the user
+        :type user: str
+        :param acl: name of the acl
+        :type acl: str
+        :param roles: Twitch roles of the user, e.g. :attr:message.Message.roles
+        :type roles: frozenset(str)
+
+        :return: has the user permissions
+        :rtype: bool
+
+        Check if a user is in an acl, either directly or through a group
+        """
+        index = self.acl_index.get(acl)
+        if index is None:
+            raise Exception("ACL does not exist")
+
+        user = user.lower()
+
+        if user == 'cli':
+            return True                                             # Give local users all permissions
+
+        with self.lock:
+            groups = set(row[0] for row in self.db.execute("SELECT grp FROM group_members WHERE user = ?", (user,)))
+        if roles:
+            for role in roles:
+                if role in self.role_groups:
+                    groups.add(self.role_groups[role])
+
+        if "%owner" in groups:                                      # Always allow owner
+            return True
+
+        if index.everyone:                                          # Acl allows everyone
+            return True
+
+        if not index.groups.isdisjoint(groups):                     # User is member of allowed group
+            return True
+
+        with self.lock:                                             # User is allowed
+            return self.db.execute("SELECT 1 FROM acl_members WHERE acl = ? AND user = ?",
+                                   (acl, user)).fetchone() is not None
@@ -0,0 +1,241 @@
+#
+# asyncio based main class for twitch/irc bot MustikkaBot
+#
+# Author: Esa Varemo
+#
+
+import asyncio
+import platform
+import signal
+import sys
+import threading
+
+from main import Bot
+
+
+class AsyncBot(Bot):
+    """
+    A version of the bot that runs on an asyncio event loop. The IRC connection uses asyncio streams and modules can
+    implement their handlers as coroutines, so that slow I/O in one module does not delay the others
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.loop = None
+        """ :type: asyncio.AbstractEventLoop"""
+        self.loop_thread = None
+
+        self.reader = None
+        """ :type: asyncio.StreamReader"""
+        self.writer = None
+        """ :type: asyncio.StreamWriter"""
+
+        self.send_ready = None
+        """ :type: asyncio.Event"""
+        self.stopped = None
+        """ :type: asyncio.Event"""
+
+    def send_data(self, data, dontLog=False):
+        """
+        :param data: String to be sent
+        :type data: str
+        :param dontLog: Will the string be logged?
+        :type dontLog: bool
+
+        Send data appended with a newline. Wakes up the writer task
+        """
+        super().send_data(data, dontLog)
+        if self.send_ready is not None and not self.workerpool.in_worker():
+            self.send_ready.set()
+
+    def send_message(self, msg, *args, **kwargs):
+        """
+        :param msg: Message to be sent
+        :type msg: str
+
+        Queue a message to be sent to the channel. Wakes up the writer task
+        """
+        super().send_message(msg, *args, **kwargs)
+        if self.send_ready is not None and not self.workerpool.in_worker():
+            self.send_ready.set()
+
+    def stop(self, reason="^C"):
+        """
+        :param reason: what stopped the bot, for logging
+        :type reason: str
+
+        Signal handler to stop the bot
+        """
+        self.log.info(reason + " received, stopping")
+        self.run = False
+        self.stopped.set()
+
+    async def connect_async(self, params):
+        """
+        :param params: A list of the params to be used to connect
+        :type params: list(string, string, string, string)
+
+        Open the connection to the IRC server and log in
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(params[0], 6667), 30)
+
+        self.linereader.clear()
+        self.outbuf.clear()
+        self.login(params)
+
+    async def reconnect_async(self):
+        """
+        Drop the current connection and connect to the IRC server again. Retry until it succeeds
+        """
+        while self.run:
+            try:
+                await self.connect_async(self.settings)
+                self.lastReceived = self.clock.now()
+                return
+            except (OSError, asyncio.TimeoutError) as e:
+                self.log.error("Error connecting to IRC: %s" % e)
+                await asyncio.sleep(3)
+
+    async def receive(self):
+        """
+        Task reading lines from the server and delivering them to the eventmanager. Reconnects if the connection is
+        lost or nothing is received within the watchdog timeout
+        """
+        while self.run:
+            try:
+                data = await asyncio.wait_for(self.reader.read(len(self.linereader.buffer)),
+                                              self.watchdog_timeout.total_seconds())
+            except asyncio.TimeoutError:
+                self.log.warning("No messages received within 15 minutes, trying to reconnect")
+                await self.reconnect_async()
+                continue
+            except OSError as e:
+                self.log.warning("Error receiving data: %s, trying to reconnect" % e)
+                await self.reconnect_async()
+                continue
+
+            if len(data) == 0:
+                self.log.warning("Connection closed by the server, trying to reconnect")
+                await self.reconnect_async()
+                continue
+
+            lines = self.linereader.feed(data)
+            for line in lines:
+                self.log.debug("RECV: <>" + line + "<>")
+            self.handle_lines(lines)
+
+    async def transmit(self):
+        """
+        Task writing the output buffer and the messages allowed by the rate limit to the server
+        """
+        while self.run:
+            self.send_ready.clear()
+
+            now = self.clock.monotonic()
+            line = self.sendqueue.pop(now)
+            while line is not None:
+                self.send_data(line)
+                line = self.sendqueue.pop(now)
+
+            if len(self.outbuf) > 0 and self.writer is not None:
+                self.writer.write(bytes(self.outbuf))
+                self.outbuf.clear()
+                try:
+                    await self.writer.drain()
+                except OSError as e:
+                    self.log.error("Error sending data: %s" % e)   # The receive task will reconnect
+
+            try:
+                await asyncio.wait_for(self.send_ready.wait(), self.sendqueue.delay(self.clock.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    def add_reader(self, fileobj, callback):
+        """
+        :param fileobj: socket or file to watch
+        :type fileobj: socket.socket
+        :param callback: function called when there is data to read
+        :type callback: function
+
+        Watch a socket for incoming data on the event loop. May be called from other threads, e.g. while the
+        modules are being initialized
+        """
+        if threading.get_ident() == self.loop_thread:
+            self.loop.add_reader(fileobj, callback)
+        else:
+            self.loop.call_soon_threadsafe(self.loop.add_reader, fileobj, callback)
+
+    def remove_reader(self, fileobj):
+        """
+        :param fileobj: socket or file watched with :meth:add_reader
+        :type fileobj: socket.socket
+
+        Stop watching a socket
+        """
+        self.loop.remove_reader(fileobj)
+
+    def handle_cli(self, events=None):
+        """
+        Event loop callback, called when a line has been typed to the command line
+        """
+        data = sys.stdin.readline()
+        if len(data) == 0:
+            self.log.info("Command line closed")
+            self.loop.remove_reader(sys.stdin)
+            return
+
+        self.handle_cli_line(data)
+
+    async def main_async(self):
+        """
+        Run the bot until it is stopped
+        """
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.send_ready = asyncio.Event()
+        self.stopped = asyncio.Event()
+
+        self.eventmanager.attach_loop(self.loop)
+        self.timemanager.attach_loop(self.loop)
+        self.workerpool.attach_loop(self.loop)
+
+        self.startup()
+
+        await self.reconnect_async()
+
+        self.loop.add_signal_handler(signal.SIGINT, self.stop)
+        if platform.system() != "Windows":
+            self.loop.add_signal_handler(signal.SIGTERM, self.stop, "SIGTERM")
+
+        if platform.system() != "Windows":
+            self.loop.add_reader(sys.stdin, self.handle_cli)
+
+        tasks = [self.loop.create_task(self.receive()), self.loop.create_task(self.transmit())]
+
+        await self.stopped.wait()
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if platform.system() != "Windows":
+            self.loop.remove_reader(sys.stdin)
+
+        self.shutdown()
+
+        if self.writer is not None:
+            if len(self.outbuf) > 0:
+                self.writer.write(bytes(self.outbuf))
+                self.outbuf.clear()
+            self.writer.close()
+
+    def main(self):
+        """
+        The startpoint of the bot
+        """
+        asyncio.run(self.main_async())
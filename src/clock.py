@@ -0,0 +1,75 @@
+#
+# Clocks used for timekeeping in the bot and modules
+#
+# Author: Esa Varemo
+#
+
+import datetime
+import time
+
+
+class Clock:
+    """
+    The real clock. Everything that depends on time asks it from :attr:Bot.clock, so that it can be replaced with a
+    :class:SimulatedClock
+    """
+
+    def monotonic(self):
+        """
+        :return: seconds from an arbitrary point, not affected by changes to the wall clock
+        :rtype: float
+        """
+        return time.monotonic()
+
+    def now(self):
+        """
+        :return: current local date and time
+        :rtype: datetime.datetime
+        """
+        return datetime.datetime.now()
+
+
+class SimulatedClock(Clock):
+    """
+    A clock that only moves when it is advanced. Used to run time-dependent logic, like timed events, faster than
+    real time in tests and benchmarks
+    """
+
+    def __init__(self, start=None):
+        """
+        :param start: date and time the clock starts at, defaults to the current time
+        :type start: datetime.datetime
+        """
+        if start is None:
+            start = datetime.datetime.now()
+        self.start = start
+        self.elapsed = 0.0
+
+    def monotonic(self):
+        """
+        :return: seconds the clock has been advanced
+        :rtype: float
+        """
+        return self.elapsed
+
+    def now(self):
+        """
+        :return: the start time of the clock plus the time it has been advanced
+        :rtype: datetime.datetime
+        """
+        return self.start + datetime.timedelta(seconds=self.elapsed)
+
+    def advance(self, delta):
+        """
+        :param delta: time to move the clock forward
+        :type delta: datetime.timedelta
+        """
+        self.advance_to(self.elapsed + delta.total_seconds())
+
+    def advance_to(self, monotonic):
+        """
+        :param monotonic: monotonic() time to move the clock to. The clock never moves backwards
+        :type monotonic: float
+        """
+        if monotonic > self.elapsed:
+            self.elapsed = monotonic
@@ -1,5 +1,4 @@
 import logging
-import tools
 
 class About:
     """
@@ -17,24 +16,17 @@ class About:
         Initialize the about-module. Called by the modulemanager when the module gets enabled
         """
         self.bot = bot
-        bot.eventmanager.register_message(self)
+        bot.eventmanager.register_message(self, ["!about", "!bot"])
         self.log.info("Init complete")
 
-    def handle_message(self, data, user, msg):
+    def handle_message(self, message):
         """
-        :param data: Full IRC command
-        :type data: str
-        :param user: name of the user that sent the message
-        :type user: str
-        :param msg: the message itself
-        :type msg: str
+        :param message: the chat message
+        :type message: Message
 
         Handle incoming chat-messages. Check if it contains either !about or !bot commmands
         """
-        msg = tools.strip_name(msg)
-        args = msg.split()
-
-        if args[0] == "!about" or args[0] == "!bot":
+        if message.command == "!about" or message.command == "!bot":
             self.log.info("Printing \"about\"")
             self.bot.send_message("MustikkaBot is a IRC/Twitch chatbot created in python " +
                                   "for the awesome youtuber/streamer HerraMustikka. Author: Esa Varemo")
@@ -0,0 +1,93 @@
+import logging
+import os
+import time
+
+
+class Access:
+    """
+    Access is a core-module for managing the members of groups in bulk, from files in the data directory
+    """
+
+    log = logging.getLogger("mustikkabot.access")
+    bot = None
+    acl = "!access"
+
+    def init(self, bot):
+        """
+        :param bot: Reference to the main bot instance
+        :type bot: Bot
+
+        Initialize the access-module. Register callback to the message received event.
+        Called by the modulemanager when loading the module
+        """
+        self.bot = bot
+        bot.accessmanager.register_acl(self.acl, default_groups=["%operators"])
+        bot.eventmanager.register_message(self, ["!access"])
+        self.log.info("Init complete")
+
+    def dispose(self):
+        """
+        Uninitialize the module when called by the eventmanager. Unregisters the messagelisteners
+        when the module gets disabled.
+        """
+        self.bot.eventmanager.unregister_message(self)
+        self.log.info("Disposed")
+
+    def get_path(self, name):
+        """
+        :param name: name of a file given in a command
+        :type name: str
+
+        :return: path of the file in the data directory, None if the name is not allowed
+        :rtype: str
+
+        Only plain .txt file names are allowed, so that the commands can't touch other files
+        """
+        if os.path.basename(name) != name or not name.endswith(".txt") or name.startswith("."):
+            return None
+        return os.path.join(self.bot.datadir, name)
+
+    def handle_message(self, message):
+        """
+        :param message: the chat message
+        :type message: Message
+
+        Handle the !access commands. Called by the eventmanager/dispatcher when a message is received
+        """
+        user = message.nick
+        args = message.args
+
+        if not self.bot.accessmanager.is_in_acl(user, self.acl, message.roles):
+            self.log.warning("User " + user + " tried to issue an access management command without permissions")
+            return
+
+        if len(args) < 4 or args[1].lower() not in ("import", "export"):
+            self.bot.send_message("Usage: !access import <group> <file.txt> | export <group> <file.txt>")
+            return
+
+        group = args[2]
+        path = self.get_path(args[3])
+        if path is None:
+            self.bot.send_message("The file must be a .txt file in the data directory")
+            return
+        if not self.bot.accessmanager.exists_group(group):
+            self.bot.send_message("Group " + group + " does not exist")
+            return
+
+        start = time.perf_counter()
+        try:
+            if args[1].lower() == "import":
+                added, present = self.bot.accessmanager.import_group(group, path)
+                result = "Imported " + args[3] + " to " + group + ": " + str(added) + " added, " + \
+                         str(present) + " already present"
+            else:
+                count = self.bot.accessmanager.export_group(group, path)
+                result = "Exported " + str(count) + " members of " + group + " to " + args[3]
+        except OSError as e:
+            self.log.error("Error accessing " + path + ": " + str(e))
+            self.bot.send_message("Could not access " + args[3])
+            return
+
+        result += " (%.2f s)" % (time.perf_counter() - start)
+        self.log.info(result)
+        self.bot.send_message(result)
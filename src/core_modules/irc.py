@@ -1,4 +1,3 @@
-import re
 import logging
 
 class Irc:
@@ -18,21 +17,20 @@ class Irc:
         Called by modulemanager when starting up the module
         """
         self.bot = bot
-        self.bot.eventmanager.register_special(self)
+        self.bot.eventmanager.register_special(self, ["PING"])
         self.log.info("Init complete")
 
-    def handle_special(self, msg):
+    def handle_special(self, message):
         """
-        :param msg: the irc command/message
-        :type msg: str
+        :param message: the irc command/message
+        :type message: Message
 
         Handle special irc commands and responses to them like PING/PONG
         Called by eventlistener/dispatcher when a special message is received
         """
-        result = re.search("PING (.*)", msg)
-        if result is not None:
+        if message.verb == "PING":
             self.log.info("Ping received")
-            self.bot.send_data("PONG " + result.group(1))
+            self.bot.send_data("PONG :" + " ".join(message.params))    # Bypasses the rate limited send queue
 
     def dispose(self):
         """
@@ -1,4 +1,3 @@
-import tools
 import logging
 
 
@@ -21,7 +20,7 @@ class Modules:
         """
         self.bot = bot
         bot.accessmanager.register_acl(self.acl, default_groups=["%operators"])
-        bot.eventmanager.register_message(self)
+        bot.eventmanager.register_message(self, ["!modules"])
         self.log.info("Init complete")
 
     def dispose(self):
@@ -29,20 +28,19 @@ class Modules:
         Uninitialize the module when called by the eventmanager. Unregisters the messagelisteners
         when the module gets disabled.
         """
-        self.bot.eventmanager.unregister_special(self)
+        self.bot.eventmanager.unregister_message(self)
         self.log.info("Disposed")
 
-    def handle_message(self, data, user, msg):
+    def handle_message(self, message):
         """
-        :param data: full IRC command
-        :param user: user that sent the message
-        :param msg: the chat-message the user sent
+        :param message: the chat message
+        :type message: Message
 
         Look for any commands that the command-module should handle and handle any found commands.
         Called by the eventmanager/dispatcher when a message is received
         """
-        msg = tools.strip_name(msg)
-        args = msg.split()
+        user = message.nick
+        args = message.args
 
         if len(args) < 1:
             return
@@ -50,12 +48,12 @@ class Modules:
         if not args[0].lower() == "!modules":
             return
 
-        if not self.bot.accessmanager.is_in_acl(user, self.acl):
+        if not self.bot.accessmanager.is_in_acl(user, self.acl, message.roles):
             self.log.warning("User " + user + " tried to issue an module management command without permissions")
             return
 
         if len(args) == 1:
-            self.bot.send_message("Available commands for !modules are: list, enable, disable, reload")
+            self.bot.send_message("Available commands for !modules are: list, enable, disable, reload, rescan")
             return
 
         if args[1].lower() == "enable":
@@ -106,5 +104,11 @@ class Modules:
             if not self.bot.modulemanager.is_module_enabled(args[2]):
                 self.bot.send_message("Module " + args[2] + " does not exists or is not enabled")
                 return
-            self.bot.modulemanager.reload_module(args[2])
-            self.bot.send_message("Module " + args[2] + " reloaded")
\ No newline at end of file
+            if self.bot.modulemanager.reload_module(args[2]):
+                self.bot.send_message("Module " + args[2] + " reloaded")
+            else:
+                self.bot.send_message("Module " + args[2] + " could not be reloaded")
+
+        elif args[1].lower() == "rescan":
+            self.bot.modulemanager.rescan()
+            self.bot.send_message("Found " + str(len(self.bot.modulemanager.get_available_modules())) + " modules")
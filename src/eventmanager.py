@@ -1,26 +1,124 @@
-import re
 import logging
+import asyncio
+import threading
+
+from message import Message
+
 
 class EventManager:
 
     log = logging.getLogger("mustikkabot.eventmanager")
 
     message_registered = []
+    """ :type: list"""
+    message_routes = {}
+    """ :type: dict(str: list)"""
     special_registered = []
+    """ :type: list"""
+    special_routes = {}
+    """ :type: dict(str: list)"""
+
+    loop = None
+    """ :type: asyncio.AbstractEventLoop"""
+
+    workerpool = None
+    """ :type: workerpool.WorkerPool"""
+
+    blocking_limit = 2      # How many events a blocking module can be handling at the same time
+    blocking_backlog = 20   # How many more events of a blocking module can wait for those to finish
 
     def __init__(self):
         self.message_registered = list()
+        self.message_routes = dict()
+        self.message_prefixes = list()  # Routes ending with "*", without the "*"
         self.special_registered = list()
+        self.special_routes = dict()
+        self.blocking = list()          # Modules whose handlers are run in the worker pool
+        self.tasks = set()
+        self.lock = threading.RLock()   # Modules may register from several threads while they are initialized
+
+    def attach_loop(self, loop):
+        """
+        :param loop: the asyncio event loop the bot runs on
+        :type loop: asyncio.AbstractEventLoop
+
+        Run coroutine handlers as tasks on the loop instead of running them to completion one at a time
+        """
+        self.loop = loop
+
+    def call_handler(self, module, handler, *args):
+        """
+        :param module: module the handler belongs to, used for logging
+        :param handler: the handler method of the module
+        :type handler: function
+
+        Call a handler of a module. If the handler is a coroutine, it is scheduled as a task on the event loop if the
+        bot is running on one, and otherwise run to completion. Handlers of blocking modules are run in the worker pool,
+        and wait there if the module is already handling :attr:blocking_limit events
+        """
+        if module in self.blocking and self.workerpool is not None:
+            self.workerpool.submit(module, handler, args, limit=self.blocking_limit, backlog=self.blocking_backlog)
+            return
+
+        try:
+            result = handler(*args)
+            if asyncio.iscoroutine(result):
+                if self.loop is not None:
+                    task = self.loop.create_task(self.await_handler(module, result))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+                else:
+                    asyncio.run(result)
+        except:
+            self.log.exception("Error happened while module '" + str(module) + "' was handling an event")
+
+    async def await_handler(self, module, coroutine):
+        """
+        :param module: module the handler belongs to, used for logging
+        :param coroutine: the coroutine returned by the handler
+
+        Wait for a coroutine handler to finish and log any errors
+        """
+        try:
+            await coroutine
+        except:
+            self.log.exception("Error happened while module '" + str(module) + "' was handling an event")
 
-    def register_message(self, module):
+    def register_message(self, module, commands=None, blocking=False):
         """
         :param module: instance of the module that will handle the event
+        :param commands: optional list of command words (like "!time") the module handles. A word ending with "*"
+                         (like "mustikkabot*") matches all command words starting with the rest of it
+        :type commands: list(str)
+        :param blocking: does the module block (e.g. on network I/O) while handling events, in which case its handlers
+                         are run in the worker pool
+        :type blocking: bool
 
-        Registers a module to receive events on incoming messages
+        Registers a module to receive events on incoming messages. If commands are given, the module only receives
+        messages starting with one of them, otherwise it receives all messages
         """
-        self.log.info("Module " + str(module) + " registering for messages")
-        if module not in self.message_registered:
-            self.message_registered.append(module)
+        with self.lock:
+            if blocking and module not in self.blocking:
+                self.blocking.append(module)
+
+            if commands is None:
+                self.log.info("Module " + str(module) + " registering for messages")
+                if module not in self.message_registered:
+                    self.message_registered.append(module)
+                return
+
+            self.log.info("Module " + str(module) + " registering for messages starting with: " + ", ".join(commands))
+            for command in commands:
+                routed = self.message_routes.setdefault(command.lower(), [])
+                if module not in routed:
+                    routed.append(module)
+            self.update_prefixes()
+
+    def update_prefixes(self):
+        """
+        Update the list of prefixes from the routes, after routes have been added or removed
+        """
+        self.message_prefixes = [command[:-1] for command in self.message_routes if command.endswith("*")]
 
     def unregister_message(self, module):
         """
@@ -29,22 +127,54 @@ class EventManager:
         Unregister a module to stop it from receiving events on incoming messages
         """
         self.log.info("Module " + str(module) + " unregistering messages")
-        remove = None
-        for registered in self.message_registered:
-            if type(registered) == type(module):
-                remove = registered
-        if remove is not None:
-            self.message_registered.pop(self.message_registered.index(remove))
+        with self.lock:
+            remove = None
+            for registered in self.message_registered:
+                if type(registered) == type(module):
+                    remove = registered
+            if remove is not None:
+                self.message_registered.pop(self.message_registered.index(remove))
+
+            self.remove_routes(self.message_routes, module)
+            self.update_prefixes()
+            self.blocking = [registered for registered in self.blocking if type(registered) != type(module)]
 
-    def register_special(self, module):
+    def remove_routes(self, routes, module):
+        """
+        :param routes: routing table to remove the module from
+        :type routes: dict(str: list)
+        :param module: instance of the module
+
+        Remove a module from all the entries of a routing table
+        """
+        for key in list(routes.keys()):
+            routed = [registered for registered in routes[key] if type(registered) != type(module)]
+            if len(routed) > 0:
+                routes[key] = routed
+            else:
+                del routes[key]
+
+    def register_special(self, module, verbs=None):
         """
         :param module: instance of the module that will handle the event
+        :param verbs: optional list of IRC commands or numerics (like "PING", "JOIN" or "353") the module handles
+        :type verbs: list(str)
 
-        Registers a module to receive events on incoming "special" (non message) data
+        Registers a module to receive events on incoming "special" (non message) data. If verbs are given, the
+        module only receives lines with one of them, otherwise it receives all special data
         """
-        self.log.info("Module " + str(module) + " registering for special messages")
-        if module not in self.special_registered:
-            self.special_registered.append(module)
+        with self.lock:
+            if verbs is None:
+                self.log.info("Module " + str(module) + " registering for special messages")
+                if module not in self.special_registered:
+                    self.special_registered.append(module)
+                return
+
+            self.log.info("Module " + str(module) + " registering for special messages: " + ", ".join(verbs))
+            for verb in verbs:
+                routed = self.special_routes.setdefault(verb.upper(), [])
+                if module not in routed:
+                    routed.append(module)
 
     def unregister_special(self, module):
         """
@@ -53,12 +183,28 @@ class EventManager:
         Unregister a module to stop it from receiving events on incoming "special" (non message) data
         """
         self.log.info("Module " + str(module) + " unregistering special messages")
-        remove = None
-        for registered in self.special_registered:
-            if type(registered) == type(module):
-                remove = registered
-        if remove is not None:
-            self.special_registered.pop(self.special_registered.index(remove))
+        with self.lock:
+            remove = None
+            for registered in self.special_registered:
+                if type(registered) == type(module):
+                    remove = registered
+            if remove is not None:
+                self.special_registered.pop(self.special_registered.index(remove))
+
+            self.remove_routes(self.special_routes, module)
+
+    def handle_line(self, text):
+        """
+        :param text: full IRC line received from the server
+        :type text: str
+
+        Parse the line once and deliver it either as a text-message or as special data
+        """
+        message = Message(text)
+        if message.verb == "PRIVMSG":
+            self.dispatch_message(message)
+        else:
+            self.dispatch_special(message)
 
     def handle_message(self, text):
         """
@@ -67,23 +213,31 @@ class EventManager:
 
         Parse the IRC message and deliver it to registered modules
         """
-        result = re.search(":(.*?)!(.*) PRIVMSG (.*?) :(.*)", text)
+        self.dispatch_message(Message(text))
 
-        user = None
-        msg = None
+    def dispatch_message(self, message):
+        """
+        :param message: parsed IRC message
+        :type message: Message
 
-        if result is not None:
-            user = result.group(1)
-            msg = result.group(4)
-        else:
+        Deliver a message to the modules registered for its command word and to the modules receiving all messages
+        """
+        if not message.is_privmsg():
             self.log.warning("Received invalid message")
             return  # Invalid message
 
-        for module in self.message_registered:
-            try:
-                module.handle_message(text, user, msg)
-            except:
-                self.log.exception("Error happened while module '" + str(module) + "' was handling a message")
+        command = message.command.lower()
+        routed = tuple(self.message_routes.get(command, ()))
+        for prefix in self.message_prefixes:
+            if command.startswith(prefix):
+                routed += tuple(module for module in self.message_routes.get(prefix + "*", ()) if module not in routed)
+
+        for module in routed:
+            if module not in self.message_registered:
+                self.call_handler(module, module.handle_message, message)
+
+        for module in tuple(self.message_registered):
+            self.call_handler(module, module.handle_message, message)
 
     def handle_special(self, text):
         """
@@ -92,8 +246,20 @@ class EventManager:
 
         Parse the IRC data and deliver it to registered modules
         """
-        for module in self.special_registered:
-            try:
-                module.handle_special(text)
-            except:
-                self.log.exception("Error happened while module '" + module + "' was handling a special message")
+        self.dispatch_special(Message(text))
+
+    def dispatch_special(self, message):
+        """
+        :param message: parsed IRC line
+        :type message: Message
+
+        Deliver special data to the modules registered for its verb and to the modules receiving all special data
+        """
+        routed = self.special_routes.get(message.verb)
+        if routed is not None:
+            for module in tuple(routed):
+                if module not in self.special_registered:
+                    self.call_handler(module, module.handle_special, message)
+
+        for module in tuple(self.special_registered):
+            self.call_handler(module, module.handle_special, message)
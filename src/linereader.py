@@ -0,0 +1,111 @@
+#
+# Buffered line framing for the IRC connection
+#
+# Author: Esa Varemo
+#
+
+import errno
+import socket
+
+
+class LineReader:
+    """
+    Reads data from a socket into a preallocated buffer and splits it into complete lines. Partial lines are kept
+    in the buffer until the rest of the line has been received
+    """
+
+    def __init__(self, size=65536):
+        """
+        :param size: size of the receive buffer in bytes
+        :type size: int
+        """
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+
+    def clear(self):
+        """
+        Forget any buffered partial line, e.g. after reconnecting
+        """
+        self.length = 0
+
+    def read_from(self, sock):
+        """
+        :param sock: socket to read from
+        :type sock: socket.socket
+
+        :return: list of complete lines received, None if the connection was closed
+        :rtype: list(str)
+
+        Read as much data as is available from a non-blocking socket and return the complete lines
+        """
+        lines = []
+        while True:
+            if self.length == len(self.buffer):
+                # A single line does not fit in the buffer, pass on what we have to get rid of it
+                lines.append(self.buffer.decode("utf-8", "replace"))
+                self.length = 0
+
+            space = len(self.buffer) - self.length
+            try:
+                count = sock.recv_into(self.view[self.length:])
+            except socket.error as e:
+                if e.args[0] == errno.EAGAIN or e.args[0] == errno.EWOULDBLOCK:
+                    return lines    # No more data for now
+                return lines or None
+
+            if count == 0:
+                return lines or None    # Connection closed, report it on the next read if lines were received
+
+            lines += self.feed_count(count)
+
+            if count < space:
+                return lines        # Socket has been drained, don't waste a syscall on EAGAIN
+
+    def feed(self, data):
+        """
+        :param data: bytes received from the connection
+        :type data: bytes
+
+        :return: list of complete lines
+        :rtype: list(str)
+
+        Append data to the buffer and return the complete lines
+        """
+        lines = []
+        while len(data) > 0:
+            space = len(self.buffer) - self.length
+            if space == 0:
+                lines.append(self.buffer.decode("utf-8", "replace"))
+                self.length = 0
+                continue
+            chunk = data[:space]
+            self.buffer[self.length:self.length + len(chunk)] = chunk
+            data = data[len(chunk):]
+            lines += self.feed_count(len(chunk))
+        return lines
+
+    def feed_count(self, count):
+        """
+        :param count: number of bytes just written after the end of the buffered data
+        :type count: int
+
+        :return: list of complete lines
+        :rtype: list(str)
+
+        Split the buffered data into lines and move the unfinished line to the beginning of the buffer
+        """
+        start = self.length
+        self.length += count
+
+        end = self.buffer.rfind(b"\n", start, self.length)
+        if end == -1:
+            return []               # No complete lines yet
+
+        data = self.buffer[:end].decode("utf-8", "replace")
+
+        remaining = self.length - end - 1
+        self.buffer[:remaining] = self.buffer[end + 1:self.length]
+        self.length = remaining
+
+        return [line.rstrip("\r") for line in data.split("\n") if line.strip("\r")]
@@ -6,12 +6,11 @@
 #
 
 import socket
-import select
+import selectors
 import sys
 import platform
 import os
 import signal
-import errno
 from time import sleep
 import traceback
 import logging
@@ -21,10 +20,14 @@ import setup
 import logutils
 import tools
 
+from linereader import LineReader
+from sendqueue import SendQueue, PRIORITY_INTERACTIVE, PRIORITY_PROTOCOL
 from eventmanager import EventManager
 from modulemanager import ModuleManager
 from accessmanager import AccessManager
 from timemanager import TimeManager
+from clock import Clock
+from workerpool import WorkerPool
 
 
 class Bot:
@@ -45,19 +48,47 @@ class Bot:
         setup.do_migrations(self)
 
         self.ircsock = None
+        self.linereader = LineReader()
+        self.outbuf = bytearray()
         self.lastReceived = None
+        self.settings = None
+        self.options = dict()
+        """ :type: dict(str: str)"""
+
+        self.sendqueue = None
+        """ :type: SendQueue"""
+
+        self.selector = selectors.DefaultSelector()
+        """ :type: selectors.BaseSelector"""
+
+        # Self-pipe used to wake the main loop up from select(), e.g. when a signal is received
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(0)
+        self.wakeup_w.setblocking(0)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, self.handle_wakeup)
 
         self.user = None
         self.channel = None
 
+        self.clock = Clock()
+        """ :type: Clock"""
+
         self.eventmanager = EventManager()
         """ :type: EventManager"""
         self.modulemanager = ModuleManager()
         """ :type: ModuleManager"""
         self.accessmanager = AccessManager()
         """ :type: AccessManager"""
-        self.timemanager = TimeManager()
+        self.timemanager = TimeManager(self.clock)
         """ :type: TimeManager"""
+        self.workerpool = WorkerPool(clock=self.clock)
+        """ :type: WorkerPool"""
+
+        self.workerpool.wakeup = self.wakeup
+        self.eventmanager.workerpool = self.workerpool
+        self.timemanager.workerpool = self.workerpool
+
+        self.watchdog_timeout = datetime.timedelta(minutes=15)
 
         self.run = True
 
@@ -66,7 +97,8 @@ class Bot:
         :return: list of strings describing parameters
         :rtype: list(string, string, string, string)
 
-        Parse the config file, and read the different defined parameters. Return them as a list
+        Parse the config file, and read the different defined parameters. Return them as a list. Any optional
+        settings are stored in :attr:options
         """
         try:
             settings_f = open(os.path.join(self.confdir, "config.txt"))
@@ -91,6 +123,10 @@ class Bot:
                     password = ':'.join(line.split(":")[1:])
                 if line.find('chnl') != -1:
                     channel = line.split(":")[1]
+
+                key, sep, value = line.partition(":")     # Optional settings
+                if sep and key.strip() not in ("host", "user", "pass", "chnl"):
+                    self.options[key.strip()] = value.strip()
         except IndexError:
             self.log.error("Malformed config file, please fix")
             sys.exit()
@@ -115,41 +151,55 @@ class Bot:
         Try to connect to the IRC server using the provided parameters
         """
         try:
+            if self.ircsock is not None:
+                if self.ircsock in self.selector.get_map():
+                    self.selector.unregister(self.ircsock)    # Not registered if the previous connect failed
+                self.ircsock.close()
+
             self.ircsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.ircsock.settimeout(30)
 
             self.ircsock.connect((params[0], 6667))
 
             self.ircsock.setblocking(0)
+            self.linereader.clear()
+            self.outbuf.clear()
+            self.selector.register(self.ircsock, selectors.EVENT_READ, self.handle_irc)
 
-            self.send_data("PASS %s" % (params[2]), dontLog=True)
-            self.send_data("NICK %s" % (params[1]))
-            self.send_data("USER %s mustikkaBot 127.0.0.1 :mustikkaBot" % (params[1]))
-            self.send_data("JOIN %s" % (params[3]))
+            self.login(params)
+            self.flush()
         except Exception as e:
             traceback.print_exc()
 
             self.log.error("\n\nError connecting: %s" % e)
             sys.exit()
 
-    def get_data(self):
+    def login(self, params):
         """
-        :return: Data received from the socket
-        :rtype: str
+        :param params: A list of the params to be used to connect
+        :type params: list(string, string, string, string)
 
-        Return any data that has been received
+        Send the commands to log in to the server and join the channel. The Twitch capabilities are requested so
+        that messages carry the roles of their senders as tags
         """
+        self.send_data("CAP REQ :twitch.tv/tags twitch.tv/commands twitch.tv/membership")
+        self.send_data("PASS %s" % (params[2]), dontLog=True)
+        self.send_data("NICK %s" % (params[1]))
+        self.send_data("USER %s mustikkaBot 127.0.0.1 :mustikkaBot" % (params[1]))
+        self.send_data("JOIN %s" % (params[3]))
 
-        try:
-            data = self.ircsock.recv(1024)
-            data = data.decode("utf-8", "replace").strip('\r\n')
-            if not len(data) == 0:
-                self.log.debug("RECV: <>" + data + "<>")
-            return data
-        except socket.error as e:
-            err = e.args[0]
-            if err == errno.EAGAIN or err == errno.EWOULDBLOCK:
-                return ""  # no data
+    def get_data(self):
+        """
+        :return: Complete lines received from the socket, None if the connection was lost
+        :rtype: list(str)
+
+        Return any lines that have been received. Partial lines are buffered until they are complete
+        """
+        lines = self.linereader.read_from(self.ircsock)
+        if lines is not None:
+            for line in lines:
+                self.log.debug("RECV: <>" + line + "<>")
+        return lines
 
     def send_data(self, data, dontLog=False):
         """
@@ -158,21 +208,79 @@ class Bot:
         :param dontLog: Will the string be logged?
         :type dontLog: bool
 
-        Send data appended with a newline
+        Send data appended with a newline. The data is buffered and written when the socket is ready for it. If
+        called from the worker pool, the data is passed to the main loop thread to be sent
         """
+        if self.workerpool.in_worker():
+            self.workerpool.call_in_main(self.send_data, data, dontLog)
+            return
+
         if not (data is "" or data is None):
             if not dontLog:
                 self.log.debug("SEND: " + data)
-            self.ircsock.send(bytes(data + "\n", "UTF-8"))
+            self.outbuf += bytes(data + "\n", "UTF-8")
 
-    def send_message(self, msg):
+    def send_message(self, msg, priority=PRIORITY_INTERACTIVE):
         """
         :param msg: Message to be sent
         :type msg: str
+        :param priority: Priority class of the message, one of the PRIORITY_* constants in :mod:sendqueue
+        :type priority: int
+
+        Queue a message to be sent to the channel. Messages are sent as fast as the rate limits allow, in the order
+        of their priority. Chat messages always go through the rate limit: PRIORITY_PROTOCOL is only for protocol
+        traffic sent with :meth:send_data, and is treated as PRIORITY_INTERACTIVE here. If called from the worker pool,
+        the message is passed to the main loop thread to be queued
+        """
+        if self.workerpool.in_worker():
+            self.workerpool.call_in_main(self.send_message, msg, priority)
+            return
+
+        if priority == PRIORITY_PROTOCOL:
+            self.log.warning("Chat messages can not bypass the rate limit, sending as an interactive message")
+            priority = PRIORITY_INTERACTIVE
+        self.sendqueue.push("PRIVMSG " + self.channel + " :" + msg, priority)
+
+    def flush(self):
+        """
+        Move the messages allowed by the rate limit to the output buffer and write as much of it to the socket as
+        possible. Wait for the socket to become writable if everything could not be written. Nothing is done while
+        not connected, queued messages wait for the watchdog to reconnect
+        """
+        if self.ircsock is None or self.ircsock not in self.selector.get_map():
+            return
+
+        now = self.clock.monotonic()
+        while True:
+            line = self.sendqueue.pop(now)
+            if line is None:
+                break
+            self.send_data(line)
+
+        if len(self.outbuf) > 0:
+            try:
+                sent = self.ircsock.send(self.outbuf)
+                del self.outbuf[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass    # Socket buffer full, retry when it is writable
+            except socket.error as e:
+                self.log.error("Error sending data: %s" % e)
+
+        events = selectors.EVENT_READ
+        if len(self.outbuf) > 0:
+            events |= selectors.EVENT_WRITE
+        if self.selector.get_key(self.ircsock).events != events:
+            self.selector.modify(self.ircsock, events, self.handle_irc)
+
+    def sigterm(self, signal, frame):
+        """
+        :param signal: Signal received
+        :param frame: ...
 
-        Send a message to the channel
+        A signal handler to stop cleanly when terminated, so that the modules and managers get to save their data
         """
-        self.send_data("PRIVMSG " + self.channel + " :" + msg)
+        self.log.info("SIGTERM received, stopping")
+        self.run = False
 
     def sigint(self, signal, frame):
         """
@@ -184,72 +292,236 @@ class Bot:
         self.log.info("^C received, stopping")
         self.run = False
 
-    def main(self):
+    def reconnect(self):
         """
-        The startpoint of the bot
+        Drop the current connection and connect to the IRC server again
+        """
+        try:
+            self.connect(self.settings)
+            self.lastReceived = self.clock.now()
+        except:
+            self.log.error("Error connecting to IRC")
+            sleep(3)
+
+    def handle_irc(self, events):
         """
-        settings = self.parse_config()
+        :param events: selector events that are ready
+        :type events: int
 
-        self.user = settings[1]
-        self.channel = settings[3]
+        Selector callback, called when the IRC socket has data to be read or can be written to
+        """
+        if events & selectors.EVENT_WRITE:
+            self.flush()
+
+        if not events & selectors.EVENT_READ:
+            return
+
+        lines = self.get_data()
+
+        if lines is None:
+            self.log.warning("Connection closed by the server, trying to reconnect")
+            self.reconnect()
+            return
+
+        self.handle_lines(lines)
+
+    def handle_lines(self, lines):
+        """
+        :param lines: lines received from the server
+        :type lines: list(str)
+
+        Deliver received lines to the eventmanager
+        """
+        if len(lines) == 0:
+            return
+
+        self.lastReceived = self.clock.now()
+        for line in lines:
+            self.eventmanager.handle_line(line)
+
+    def handle_wakeup(self, events):
+        """
+        :param events: selector events that are ready
+        :type events: int
+
+        Selector callback, empties the wakeup-pipe. The main loop will then check if it should keep running
+        """
+        try:
+            while self.wakeup_r.recv(1024):
+                pass
+        except socket.error:
+            pass
+
+    def wakeup(self):
+        """
+        Wake the main loop up from waiting for input
+        """
+        try:
+            self.wakeup_w.send(b"\0")
+        except socket.error:
+            pass    # Pipe is full, the loop is going to wake up anyway
+
+    def add_reader(self, fileobj, callback):
+        """
+        :param fileobj: socket or file to watch
+        :type fileobj: socket.socket
+        :param callback: function called with the selector events when there is data to read
+        :type callback: function
+
+        Watch a socket for incoming data in the main loop, e.g. the connection to a module process
+        """
+        self.selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fileobj):
+        """
+        :param fileobj: socket or file watched with :meth:add_reader
+        :type fileobj: socket.socket
+
+        Stop watching a socket
+        """
+        self.selector.unregister(fileobj)
+
+    def handle_cli(self, events):
+        """
+        :param events: selector events that are ready
+        :type events: int
+
+        Selector callback, called when a line has been typed to the command line
+        """
+        data = sys.stdin.readline()
+        if len(data) == 0:
+            self.log.info("Command line closed")
+            self.selector.unregister(sys.stdin)
+            return
+
+        self.handle_cli_line(data)
+
+    def handle_cli_line(self, data):
+        """
+        :param data: line typed to the command line
+        :type data: str
+
+        Deliver a line typed to the command line as a chat message from the local user
+        """
+        data = data.strip()
+        if len(data) > 0:
+            self.eventmanager.handle_message(":cli!cli@localhost PRIVMSG " + self.channel + " :" + data)
+
+    def get_timeout(self):
+        """
+        :return: Seconds the main loop can sleep before it has something to do
+        :rtype: float
+
+        Calculate how long to wait for input: until the next timed event, rate limit, worker pool timeout or the
+        watchdog, whichever is first
+        """
+        now = self.clock.monotonic()
+
+        timeout = (self.lastReceived + self.watchdog_timeout - self.clock.now()).total_seconds()
+
+        next_event = self.timemanager.next_deadline()
+        if next_event is not None and next_event - now < timeout:
+            timeout = next_event - now
+
+        worker_deadline = self.workerpool.next_deadline()
+        if worker_deadline is not None and worker_deadline - now < timeout:
+            timeout = worker_deadline - now
+
+        send_delay = self.sendqueue.delay(now)
+        if send_delay is not None and send_delay < timeout:
+            timeout = send_delay
+
+        return max(timeout, 0)
+
+    def startup(self):
+        """
+        Read the configuration and initialize the managers and modules
+        """
+        self.settings = self.parse_config()
+
+        self.user = self.settings[1]
+        self.channel = self.settings[3]
+
+        self.sendqueue = SendQueue(self.options.get("acct", "normal"), clock=self.clock)
+
+        try:
+            self.workerpool.max_workers = int(self.options.get("workers", self.workerpool.max_workers))
+            self.workerpool.timeout = float(self.options.get("worker_timeout", self.workerpool.timeout))
+            self.eventmanager.blocking_limit = int(self.options.get("blocking_limit",
+                                                                    self.eventmanager.blocking_limit))
+            self.eventmanager.blocking_backlog = int(self.options.get("blocking_backlog",
+                                                                      self.eventmanager.blocking_backlog))
+        except ValueError:
+            self.log.error("Malformed worker pool settings, using the defaults")
+
+        if self.options.get("acls") == "sqlite":
+            from accessmanager_sqlite import SqliteAccessManager
+            self.accessmanager = SqliteAccessManager()
 
         self.accessmanager.init(self)
         self.modulemanager.init(self)
 
-        try:
-            self.connect(settings)
-            self.lastReceived = datetime.datetime.now()
-        except:
-            self.log.error("Error connecting to IRC")
-            sleep(3)
+    def shutdown(self):
+        """
+        Dispose the modules and managers
+        """
+        self.modulemanager.dispose()
+        self.accessmanager.dispose()
+        self.workerpool.shutdown()
+
+        stats = self.sendqueue.stats()
+        self.log.info("Messages sent: %d, dropped: %d, coalesced: %d, left in queue: %d" %
+                      (stats["sent"], stats["dropped"], stats["coalesced"], stats["queued"]))
+        self.log.info("Blocking actions queued: %d, skipped: %d, timed out: %d" %
+                      (self.workerpool.queued, self.workerpool.rejected, self.workerpool.timed_out))
+
+    def main(self):
+        """
+        The startpoint of the bot
+        """
+        self.startup()
+
+        self.lastReceived = self.clock.now()
+        self.reconnect()
 
         signal.signal(signal.SIGINT, self.sigint)
+        if platform.system() != "Windows":
+            signal.signal(signal.SIGTERM, self.sigterm)
+        signal.set_wakeup_fd(self.wakeup_w.fileno())
 
-        sleep(1)
+        if platform.system() != "Windows":
+            self.selector.register(sys.stdin, selectors.EVENT_READ, self.handle_cli)
+        # No cli on windows because you can't select stdin
 
         while self.run:
-            # Get new data
-            ircmsg = self.get_data()
-
-            # Process CLI
-            if platform.system() != "Windows":
-                cli = select.select([sys.stdin], [], [], 0)[0]
-            else:
-                cli = False         # No cli on windows because you can't select stdin
-            if cli:
-                data = sys.stdin.readline().strip()
-                if len(data) > 0:
-                    self.eventmanager.handle_message(":cli!cli@localhost PRIVMSG " + self.channel + " :" + data)
-
-            # Handle data if received
-            if not (ircmsg is None or len(ircmsg) == 0):
-                for line in ircmsg.split('\n'):
-                    self.lastReceived = datetime.datetime.now()
-                    if line.find(' PRIVMSG ') != -1:
-                        self.eventmanager.handle_message(line)
-                    else:
-                        self.eventmanager.handle_special(line)
-
-            # Provied timed events to timemanager
+            # Sleep until there is data or a timer is due, then handle it
+            for key, events in self.selector.select(self.get_timeout()):
+                key.data(events)
+
+            # Handle the results of blocking actions
+            self.workerpool.handle_results()
+
+            # Provide timed events to timemanager
             self.timemanager.handle_events()
 
-            # Check "watchdog"
-            if self.lastReceived and datetime.datetime.now() - self.lastReceived > datetime.timedelta(minutes=15):
-                self.log.warning("No messages received within 15 minutesr, trying to reconnect")
-                try:
-                    self.connect(settings)  # Reconnect
-                    self.lastReceived = datetime.datetime.now()
-                except:
-                    self.log.error("Error connecting to IRC")
-                    sleep(3)
+            # Send queued data
+            self.flush()
 
-            sleep(0.01)
+            # Check "watchdog"
+            if self.clock.now() - self.lastReceived > self.watchdog_timeout:
+                self.log.warning("No messages received within 15 minutes, trying to reconnect")
+                self.reconnect()
 
         # Shut down
-        self.modulemanager.dispose()
-        self.accessmanager.dispose()
+        self.shutdown()
+        signal.set_wakeup_fd(-1)
+        self.selector.close()
 
 
 if __name__ == "__main__":  # Do not start on import
-    b = Bot()
-    b.main()
\ No newline at end of file
+    if "--asyncio" in sys.argv[1:]:
+        from asyncbot import AsyncBot
+        b = AsyncBot()
+    else:
+        b = Bot()
+    b.main()
@@ -0,0 +1,159 @@
+#
+# Parsed representation of an IRC line
+#
+# Author: Esa Varemo
+#
+
+import tools
+
+
+class Message:
+    """
+    An IRC line parsed once into its parts, so that the modules don't have to parse the same text again.
+    For chat messages (PRIVMSG) the channel, text and the text split into words are filled in. IRCv3 tags are kept
+    as they were received and only the ones asked for with :meth:tag are looked up
+    """
+
+    __slots__ = ("raw", "tags", "prefix", "nick", "verb", "params", "channel", "text", "args", "command", "_roles")
+
+    fields = __slots__[:-1]     # The parsed parts, the roles are worked out again from the tags when needed
+
+    def __init__(self, raw):
+        """
+        :param raw: the full IRC line
+        :type raw: str
+        """
+        self.raw = raw
+        """ :type: str"""
+        self.tags = None
+        """ :type: str"""
+        self.prefix = None
+        """ :type: str"""
+        self.nick = None
+        """ :type: str"""
+        self.verb = None
+        """ :type: str"""
+        self.params = None
+        """ :type: list(str)"""
+
+        self.channel = None
+        """ :type: str"""
+        self.text = None
+        """ :type: str"""
+        self.args = None
+        """ :type: list(str)"""
+        self.command = None
+        """ :type: str"""
+        self._roles = None
+
+        rest = raw
+        if rest.startswith("@"):
+            self.tags, _, rest = rest[1:].partition(" ")
+        if rest.startswith(":"):
+            self.prefix, _, rest = rest[1:].partition(" ")
+            self.nick = self.prefix.partition("!")[0]
+
+        self.verb, _, rest = rest.partition(" ")
+
+        if rest.startswith(":"):
+            self.params = [rest[1:]]
+        else:
+            middle, separator, trailing = rest.partition(" :")
+            self.params = middle.split()
+            if separator:
+                self.params.append(trailing)
+
+        if self.verb == "PRIVMSG" and len(self.params) == 2:
+            self.channel = self.params[0]
+            self.text = self.params[1]
+            self.args = tools.strip_name(self.text).split()
+            self.command = self.args[0] if len(self.args) > 0 else ""
+
+    def to_tuple(self):
+        """
+        :return: the parsed parts of the message as plain values, e.g. for sending to a module process
+        :rtype: tuple
+        """
+        return tuple(getattr(self, field) for field in self.fields)
+
+    @classmethod
+    def from_tuple(cls, values):
+        """
+        :param values: parsed parts of a message from :meth:to_tuple
+        :type values: tuple
+
+        :return: the message, without parsing the line again
+        :rtype: Message
+        """
+        message = cls.__new__(cls)
+        for field, value in zip(cls.fields, values):
+            setattr(message, field, value)
+        message._roles = None
+        return message
+
+    def rest(self, count):
+        """
+        :param count: number of words to skip, e.g. 1 to skip the command word
+        :type count: int
+
+        :return: the text after the first words, with its whitespace as it was sent
+        :rtype: str
+        """
+        parts = tools.strip_name(self.text).split(None, count)
+        if len(parts) > count:
+            return parts[count]
+        return ""
+
+    def tag(self, key):
+        """
+        :param key: name of the tag, e.g. "badges"
+        :type key: str
+
+        :return: the value of the tag as it was received (not unescaped), None if the line does not have the tag
+        :rtype: str
+        """
+        if self.tags is None:
+            return None
+
+        needle = key + "="
+        start = 0
+        while True:
+            index = self.tags.find(needle, start)
+            if index == -1:
+                return None
+            if index == 0 or self.tags[index - 1] == ";":
+                end = self.tags.find(";", index)
+                if end == -1:
+                    end = len(self.tags)
+                return self.tags[index + len(needle):end]
+            start = index + 1
+
+    @property
+    def roles(self):
+        """
+        :return: the Twitch roles of the sender, like "broadcaster", "moderator", "subscriber" or "vip", from the
+                 badges, mod and subscriber tags
+        :rtype: frozenset(str)
+        """
+        if self._roles is None:
+            roles = set()
+            badges = self.tag("badges")
+            if badges:
+                for badge in badges.split(","):
+                    roles.add(badge.partition("/")[0])
+            if self.tag("mod") == "1":
+                roles.add("moderator")
+            if self.tag("subscriber") == "1":
+                roles.add("subscriber")
+            self._roles = frozenset(roles)
+        return self._roles
+
+    def is_privmsg(self):
+        """
+        :return: Is the line a valid chat message from a user
+        :rtype: bool
+        """
+        return self.text is not None and self.prefix is not None and "!" in self.prefix
+
+    def __repr__(self):
+        return "Message(" + repr(self.raw) + ")"
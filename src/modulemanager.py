@@ -1,14 +1,79 @@
-import imp
+import concurrent.futures
+import datetime
+import importlib.util
+import json
 import os
 import platform
 import re
 import sys
+import time
 import logging
 
 if platform.system() == "Windows":
     import ctypes
 
 import exceptions
+from moduleprocess import ProcessModule
+from modulewatcher import ModuleWatcher
+
+
+class _LazyModule:
+    """
+    Stands in for a module whose loading has been deferred. Registers for the commands and verbs the module
+    registered for the last time it was loaded, and loads the module when one of them is received
+    """
+
+    def __init__(self, manager, name, entry):
+        """
+        :param manager: the module manager
+        :type manager: ModuleManager
+        :param name: name of the module
+        :type name: str
+        :param entry: what the module registered for, from the manifest
+        :type entry: dict
+        """
+        self.manager = manager
+        self.name = name
+        self.entry = entry
+
+    def init(self, bot):
+        if len(self.entry["commands"]) > 0:
+            bot.eventmanager.register_message(self, self.entry["commands"])
+        if len(self.entry["verbs"]) > 0:
+            bot.eventmanager.register_special(self, self.entry["verbs"])
+
+    def dispose(self):
+        self.manager.bot.eventmanager.unregister_message(self)
+        self.manager.bot.eventmanager.unregister_special(self)
+
+    def handle_message(self, message):
+        module = self.manager.load_deferred(self.name)
+        self.manager.bot.eventmanager.call_handler(module, module.handle_message, message)
+
+    def handle_special(self, message):
+        module = self.manager.load_deferred(self.name)
+        self.manager.bot.eventmanager.call_handler(module, module.handle_special, message)
+
+    def __repr__(self):
+        return "<deferred module " + self.name + ">"
+
+
+class _CatalogueEntry:
+    """
+    A module file found in the module directories
+    """
+
+    __slots__ = ("name", "path", "core", "enabled", "mtime")
+
+    def __init__(self, name, path, core, enabled, mtime):
+        self.name = name
+        self.path = path            # The file the module is loaded from
+        self.core = core
+        self.enabled = enabled      # Enabled on disk, core modules always are
+        self.mtime = mtime          # Modification time of the file, of the target for the enabled symlinks
+
+    def __repr__(self):
+        return "<module " + self.name + " " + self.path + ">"
 
 
 class ModuleManager:
@@ -21,8 +86,22 @@ class ModuleManager:
     modules = {}
     bot = None
 
+    manifestname = "modules.json"
+    module_package = "mustikkabot.modules"      # Prefix of the names the modules are registered in sys.modules as
+
+    watch_interval = datetime.timedelta(seconds=0.25)   # How often the module files are polled without inotify
+
     def __init__(self):
         self.modules = dict()
+        self.deferred = dict()      # name: _LazyModule for modules that have not been loaded yet
+        self.manifest = dict()      # name: what the module registered for when it was last loaded
+        self.lazy = False
+        self.init_workers = 4       # Threads used for initializing modules, 1 to initialize them one at a time
+        self.init_times = dict()    # name: seconds the init() of the module took
+        self.catalogue = dict()     # name: _CatalogueEntry of every module file, so the directories are listed once
+        self.process_modules = set()    # Names of the modules that are run in processes of their own
+        self.watcher = None
+        """ :type: ModuleWatcher"""
 
     def init(self, bot):
         """
@@ -33,16 +112,52 @@ class ModuleManager:
         """
         self.bot = bot
 
-        self.coreModulesPath = os.path.join(self.bot.srcdir, "core_modules")
-        self.enabledModulesPath = os.path.join(self.bot.srcdir, "modules_enabled")
-        self.availableModulesPath = os.path.join(self.bot.srcdir, "modules")
+        self.set_paths(self.bot.srcdir)
+
+        self.manifestpath = os.path.join(self.bot.datadir, self.manifestname)
+        options = getattr(self.bot, "options", {})
+        self.lazy = options.get("lazy_modules", "no") == "yes"
+        self.init_workers = int(options.get("init_workers", self.init_workers))
+        self.process_modules = set(name.strip() for name in options.get("process_modules", "").split(",")
+                                   if name.strip())
+        if len(self.process_modules) > 0 and platform.system() == "Windows":
+            self.log.warning("Module processes are not supported on Windows, running all modules in the bot")
+            self.process_modules = set()
+        self.read_manifest()
 
         self.setup_modules()
         self.init_modules()
+        self.write_manifest()
+
+        if options.get("watch_modules", "no") == "yes":
+            self.watcher = ModuleWatcher([self.availableModulesPath, self.coreModulesPath])
+            self.watcher.start()
+            if self.watcher.fd is not None:
+                self.bot.add_reader(self.watcher.fd, self.check_changes)
+            else:
+                self.bot.timemanager.register_interval(self.check_changes, self.watch_interval)
 
         self.log.info("Init complete")
 
+    def set_paths(self, srcdir):
+        """
+        :param srcdir: the source directory of the bot
+        :type srcdir: str
+
+        Set the paths of the module directories
+        """
+        self.coreModulesPath = os.path.join(srcdir, "core_modules")
+        self.enabledModulesPath = os.path.join(srcdir, "modules_enabled")
+        self.availableModulesPath = os.path.join(srcdir, "modules")
+
     def dispose(self):
+        if self.watcher is not None:
+            if self.watcher.fd is not None:
+                self.bot.remove_reader(self.watcher.fd)
+            else:
+                self.bot.timemanager.unregister(self.check_changes)
+            self.watcher.stop()
+            self.watcher = None
         self.dispose_modules()
         self.log.info("Disposed")
 
@@ -54,14 +169,28 @@ class ModuleManager:
         :return: imported module
         :rtype: module
 
-        Load a single module from disk
+        Load a single module from disk. The module is executed again even if it has been loaded before. It is
+        registered in sys.modules as mustikkabot.modules.<name>, so that it can not clash with other modules of the
+        same name, like time from the standard library
         """
         fpath = os.path.abspath(file)
         dir, fname = os.path.split(fpath)
         mname, ext = os.path.splitext(fname)
+        qualname = self.module_package + "." + mname
 
-        (file, filename, data) = imp.find_module(mname, [dir])
-        return imp.load_module(mname, file, filename, data)
+        spec = importlib.util.spec_from_file_location(qualname, fpath)
+        existing = sys.modules.get(qualname)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[qualname] = module
+        try:
+            spec.loader.exec_module(module)
+        except:
+            if existing is not None:    # Keep the previous version of the module registered
+                sys.modules[qualname] = existing
+            else:
+                del sys.modules[qualname]
+            raise
+        return module
 
     def load_module(self, name, path=None):
         """
@@ -71,11 +200,18 @@ class ModuleManager:
         :type path: str
 
         Load a module given the filename. This does not initialize the module. Do not call directly, but use
-        :meth:enableModule
+        :meth:enableModule. Modules listed in the process_modules option are not loaded here, but started in
+        processes of their own when initialized
         """
         if path is None:
             path = self.enabledModulesPath
 
+        if name in self.process_modules:
+            # The eventmanager unregisters modules by type, so every placeholder needs a class of its own
+            placeholder_class = type("Process" + name.capitalize(), (ProcessModule,), {})
+            self.modules[name] = placeholder_class(self, name, os.path.abspath(os.path.join(path, name + ".py")))
+            return
+
         module = self.import_module(os.path.join(path, name + ".py"))
         self.modules[name] = getattr(module, name.capitalize())()
 
@@ -88,6 +224,7 @@ class ModuleManager:
         directly, but use :meth:disableModule!
         """
         self.modules.pop(name)
+        self.deferred.pop(name, None)
 
     def setup_modules(self):
         """
@@ -102,16 +239,63 @@ class ModuleManager:
                                + self.enabledModulesPath + ", exiting")
                 sys.exit()
 
-        files = os.listdir(self.enabledModulesPath)
-        for file in files:
-            result = re.search(r'(.*)\.py$', file)
-            if result is not None:
-                self.load_module(result.group(1))
-        corefiles = os.listdir(self.coreModulesPath)
-        for file in corefiles:
-            result = re.search(r'(.*)\.py$', file)
-            if result is not None:
-                self.load_module(result.group(1), self.coreModulesPath)
+        self.rescan()
+        for entry in sorted(self.catalogue.values(), key=lambda entry: (entry.core, entry.name)):
+            if not entry.enabled:
+                continue
+            if entry.core:
+                self.load_module(entry.name, self.coreModulesPath)
+            elif self.lazy and entry.name not in self.process_modules and self.can_defer(entry.name):
+                self.defer_module(entry.name)
+            else:
+                self.load_module(entry.name)
+
+    def list_modules(self, path):
+        """
+        :param path: a module directory
+        :type path: str
+
+        :return: name, path and modification time of the module files in the directory
+        :rtype: list(tuple(str, str, float))
+        """
+        modules = list()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    result = re.search(r'(.*)\.py$', entry.name)
+                    if result is not None:
+                        try:
+                            modules.append((result.group(1), entry.path, entry.stat().st_mtime))
+                        except OSError:
+                            self.log.warning("Could not read " + entry.path + ", a broken symlink?")
+        except FileNotFoundError:
+            pass
+        return modules
+
+    def rescan(self):
+        """
+        Build the catalogue of modules from the module directories. Done at startup, when the watcher sees the
+        directories change and with !modules rescan. The rest of the time the catalogue is used instead of listing
+        the directories
+        """
+        catalogue = dict()
+        for name, path, mtime in self.list_modules(self.availableModulesPath):
+            catalogue[name] = _CatalogueEntry(name, path, False, False, mtime)
+        for name, path, mtime in self.list_modules(self.enabledModulesPath):
+            catalogue[name] = _CatalogueEntry(name, path, False, True, mtime)
+        for name, path, mtime in self.list_modules(self.coreModulesPath):
+            catalogue[name] = _CatalogueEntry(name, path, True, True, mtime)
+        self.catalogue = catalogue
+
+    def refresh_module(self, name):
+        """
+        :param name: name of a module in the catalogue
+        :type name: str
+
+        Update the modification time of a module in the catalogue
+        """
+        entry = self.catalogue[name]
+        entry.mtime = os.path.getmtime(entry.path)
 
     def create_symlink(self, src, dst):
         """
@@ -147,8 +331,11 @@ class ModuleManager:
         if not name in modules:
             return
 
-        self.create_symlink(os.path.abspath(os.path.join(self.availableModulesPath, name + ".py")),
-                            os.path.abspath(os.path.join(self.enabledModulesPath, name + ".py")))
+        enabled = os.path.abspath(os.path.join(self.enabledModulesPath, name + ".py"))
+        self.create_symlink(os.path.abspath(os.path.join(self.availableModulesPath, name + ".py")), enabled)
+        entry = self.catalogue[name]
+        entry.path = enabled
+        entry.enabled = True
 
         self.load_module(name)
         self.init_module(name)
@@ -170,24 +357,160 @@ class ModuleManager:
         self.unload_module(name)
 
         os.remove(os.path.join(self.enabledModulesPath, name + ".py"))
+        available = os.path.join(self.availableModulesPath, name + ".py")
+        if os.path.isfile(available):
+            entry = self.catalogue[name]
+            entry.path = available
+            entry.enabled = False
+        else:
+            self.catalogue.pop(name, None)
 
     def reload_module(self, name):
         """
         :param name: name of the module
         :type name: str
 
-        Reload a module. Same as :meth:enableModule() && :meth:disableModule()
+        :return: was the module reloaded
+        :rtype: bool
+
+        Reload a module from its file without restarting the bot. The module is executed again and a new instance
+        replaces the old one. If the old instance has an export_state() method, what it returns is handed to the
+        import_state(state) method of the new instance before its init(), so that the data in memory is kept
+        without reading it again. If the new code fails to load, the old instance keeps running
         """
-        self.disable_module(name)
-        self.enable_module(name)
+        if name in self.deferred:
+            return True     # Not loaded yet, the current code is loaded when it is first needed
+        if isinstance(self.modules[name], ProcessModule):
+            self.modules[name].reload()
+            return True
+
+        old = self.modules[name]
+        try:
+            self.refresh_module(name)
+            module = self.import_module(self.module_path(name))
+            new = getattr(module, name.capitalize())()
+        except Exception:
+            self.log.exception("Could not reload module " + name + ", keeping the old version")
+            return False
+
+        state = None
+        if hasattr(old, "export_state"):
+            state = old.export_state()
+        self.dispose_module(name)
+
+        self.modules[name] = new
+        if state is not None and hasattr(new, "import_state"):
+            new.import_state(state)
+        self.init_module(name)
+        self.write_manifest()
+
+        self.log.info("Reloaded module " + name)
+        return True
+
+    def check_changes(self, events=None):
+        """
+        :param events: selector events that are ready, when called by the main loop for inotify events
+        :type events: int
+
+        Main loop or timer callback, reload the loaded modules whose files the watcher has seen change
+        """
+        changes = self.watcher.changes()
+        if len(changes) > 0:
+            self.rescan()
+        for path in sorted(changes):
+            name = os.path.splitext(os.path.basename(path))[0]
+            if name not in self.modules or not os.path.isfile(path):
+                continue
+            if os.path.realpath(path) != os.path.realpath(self.module_path(name)):
+                continue
+            self.log.info("Module " + name + " changed on disk, reloading")
+            try:
+                self.reload_module(name)
+            except Exception:
+                self.log.exception("Error happened while reloading module " + name)
 
     def init_modules(self):
         """
         Go through loaded modules initializing them. To be used for example when initially starting up the bot in order
         to allow the modules to do some preparations (like open files and load data), register callbacks and etc.
+
+        Modules that do not depend on each other are initialized concurrently on :attr:init_workers threads, so that
+        modules waiting for disk or network do not hold up the rest. A module can list the modules it needs to be
+        initialized before it in a ``dependencies`` class attribute. The managers of the bot, like accessmanager,
+        are always ready before the modules and can be listed as well
         """
-        for module in self.modules:
-            self.init_module(module)
+        start = time.perf_counter()
+        if self.init_workers > 1 and len(self.modules) > 1:
+            self.init_concurrently(list(self.modules))
+        else:
+            for module in list(self.modules):
+                self.init_module(module)
+        self.log_init_times(time.perf_counter() - start)
+
+    def get_dependencies(self, name):
+        """
+        :param name: name of a loaded module
+        :type name: str
+
+        :return: names of the loaded modules the module depends on
+        :rtype: list(str)
+        """
+        dependencies = []
+        for dependency in getattr(self.modules[name], "dependencies", ()):
+            if dependency in self.modules:
+                dependencies.append(dependency)
+            elif getattr(self.bot, dependency, None) is None:
+                self.log.warning("Module " + name + " depends on " + dependency + ", which is not loaded")
+        return dependencies
+
+    def init_concurrently(self, names):
+        """
+        :param names: names of the modules to initialize
+        :type names: list(str)
+
+        Initialize modules on a thread pool in dependency order: a module is started once all the modules it
+        depends on have been initialized. Modules with circular dependencies are initialized one at a time last
+        """
+        waiting = {name: set(self.get_dependencies(name)) for name in names}
+        dependents = dict()
+        for name, dependencies in waiting.items():
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(name)
+
+        running = dict()    # future: name
+        with concurrent.futures.ThreadPoolExecutor(self.init_workers, "mustikkabot-init") as executor:
+            def start_ready():
+                for name in [name for name, dependencies in waiting.items() if len(dependencies) == 0]:
+                    del waiting[name]
+                    running[executor.submit(self.init_module, name)] = name
+
+            start_ready()
+            while len(running) > 0:
+                done, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    future.result()     # Errors in init() stop the startup, like they do when initializing in order
+                    for dependent in dependents.get(name, ()):
+                        if dependent in waiting:
+                            waiting[dependent].discard(name)
+                start_ready()
+
+        if len(waiting) > 0:
+            self.log.warning("Circular dependencies between modules " + ", ".join(sorted(waiting)) +
+                             ", initializing them one at a time")
+            for name in waiting:
+                self.init_module(name)
+
+    def log_init_times(self, total):
+        """
+        :param total: seconds initializing all the modules took
+        :type total: float
+
+        Log how long initializing each module took, slowest first
+        """
+        times = sorted(self.init_times.items(), key=lambda item: item[1], reverse=True)
+        self.log.info("Modules initialized in %.3f s (%.3f s of work): " % (total, sum(self.init_times.values())) +
+                      ", ".join("%s %.3f s" % (name, seconds) for name, seconds in times))
 
     def dispose_modules(self):
         """
@@ -202,12 +525,18 @@ class ModuleManager:
         :param name: Name of module
         :type name: str
 
-        Call a module's init(), if it has it. Allows the module to do some preparations like register callbacks
+        Call a module's init(), if it has it. Allows the module to do some preparations like register callbacks.
+        Records how long the init took
         """
+        start = time.perf_counter()
         try:
             self.modules[name].init(self.bot)
         except AttributeError:
             pass # Only call init if it is implemented
+        self.init_times[name] = time.perf_counter() - start
+
+        if name not in self.deferred and not isinstance(self.modules[name], ProcessModule):
+            self.record_module(name)
 
     def dispose_module(self, name):
         """
@@ -230,8 +559,10 @@ class ModuleManager:
         :return: reference to the module
         :rtype: module
 
-        Return a reference to specified module
+        Return a reference to specified module. A deferred module is loaded first
         """
+        if name in self.deferred:
+            return self.load_deferred(name)
         return self.modules[name]
 
     def get_enabled_modules(self):
@@ -245,20 +576,12 @@ class ModuleManager:
 
     def get_available_modules(self):
         """
-        :return: dictionary of available modules and their filenames
-        :rtype: dictionary of strings
+        :return: names of the available modules
+        :rtype: list(str)
 
-        Get a list of modules available, whether they are enabled or not
+        Get a list of modules available, whether they are enabled or not. Read from the catalogue, see :meth:rescan
         """
-        modules = list()
-
-        files = os.listdir(self.availableModulesPath)
-        for file in files:
-            result = re.search(r'(.*)\.py$', file)
-            if result is not None:
-                modules.append(result.group(1))
-
-        return modules
+        return sorted(name for name, entry in self.catalogue.items() if not entry.core)
 
     def is_module_enabled(self, module):
         """
@@ -285,7 +608,115 @@ class ModuleManager:
 
         Checks if a module belongs to the unloadable core-modules
         """
-        if name + ".py" in os.listdir(self.coreModulesPath):
-            return True
-        else:
-            return False
\ No newline at end of file
+        entry = self.catalogue.get(name)
+        return entry is not None and entry.core
+
+    def module_path(self, name):
+        """
+        :param name: name of the module
+        :type name: str
+
+        :return: path of the source file of the module
+        :rtype: str
+        """
+        entry = self.catalogue.get(name)
+        if entry is not None:
+            return entry.path
+        return os.path.join(self.enabledModulesPath, name + ".py")
+
+    def read_manifest(self):
+        """
+        Read what the modules registered for when they were last loaded
+        """
+        self.manifest = dict()
+        if not os.path.isfile(self.manifestpath):
+            return
+        try:
+            with open(self.manifestpath, "r") as file:
+                self.manifest = json.load(file)
+        except ValueError:
+            self.log.warning("Module manifest malformed, loading all modules")
+
+    def write_manifest(self):
+        """
+        Save what the modules registered for, so that they can be deferred on the next start
+        """
+        temppath = self.manifestpath + ".tmp"
+        with open(temppath, "w") as file:
+            json.dump(self.manifest, file, sort_keys=True, indent=4, separators=(',', ': '))
+        os.replace(temppath, self.manifestpath)
+
+    def record_module(self, name):
+        """
+        :param name: name of an initialized module
+        :type name: str
+
+        Record in the manifest the commands, verbs and timers the module registered for
+        """
+        module = self.modules[name]
+        eventmanager = self.bot.eventmanager
+        timemanager = self.bot.timemanager
+        with eventmanager.lock, timemanager.lock:   # Other modules may be registering at the same time
+            self.manifest[name] = {
+                "mtime": self.catalogue[name].mtime,
+                "commands": sorted(command for command, routed in eventmanager.message_routes.items()
+                                   if module in routed),
+                "verbs": sorted(verb for verb, routed in eventmanager.special_routes.items() if module in routed),
+                "all_messages": module in eventmanager.message_registered,
+                "all_special": module in eventmanager.special_registered,
+                "timers": any(getattr(action, "__self__", None) is module for action in timemanager.actions)
+            }
+
+    def can_defer(self, name):
+        """
+        :param name: name of an enabled module
+        :type name: str
+
+        :return: can loading the module be deferred until it receives its first command
+        :rtype: bool
+
+        Modules are deferred only if they have been loaded before without changes since, and they only registered
+        for specific commands or verbs. Modules that receive all traffic or have timers are always loaded
+        """
+        entry = self.manifest.get(name)
+        if entry is None or entry["mtime"] != self.catalogue[name].mtime:
+            return False
+        if entry["all_messages"] or entry["all_special"] or entry["timers"]:
+            return False
+        return len(entry["commands"]) > 0 or len(entry["verbs"]) > 0
+
+    def defer_module(self, name):
+        """
+        :param name: name of the module
+        :type name: str
+
+        Put a placeholder in place of a module, that loads it when it is first needed
+        """
+        # The eventmanager unregisters modules by type, so every placeholder needs a class of its own
+        placeholder_class = type("Lazy" + name.capitalize(), (_LazyModule,), {})
+        placeholder = placeholder_class(self, name, self.manifest[name])
+        self.modules[name] = placeholder
+        self.deferred[name] = placeholder
+        self.log.info("Deferred loading module " + name + " until it receives one of: " +
+                      ", ".join(self.manifest[name]["commands"] + self.manifest[name]["verbs"]))
+
+    def load_deferred(self, name):
+        """
+        :param name: name of a deferred module
+        :type name: str
+
+        :return: the loaded module
+        :rtype: module
+
+        Load and initialize a deferred module in place of its placeholder
+        """
+        placeholder = self.deferred.pop(name, None)
+        if placeholder is None:
+            return self.modules[name]
+
+        placeholder.dispose()
+        self.log.info("Loading deferred module " + name)
+        self.load_module(name)
+        self.init_module(name)
+        self.write_manifest()
+        return self.modules[name]
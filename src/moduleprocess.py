@@ -0,0 +1,547 @@
+#
+# Running modules in processes of their own
+#
+# Author: Esa Varemo
+#
+
+import asyncio
+import collections
+import datetime
+import itertools
+import logging
+import marshal
+import os
+import select
+import socket
+import struct
+import subprocess
+import sys
+
+import logutils
+from clock import Clock
+from message import Message
+from sendqueue import PRIORITY_INTERACTIVE
+from timemanager import TimeManager
+
+frame_header = struct.Struct("!I")     # Length of the marshalled data that follows
+
+
+def encode_frame(value):
+    """
+    :param value: tuple of plain values (str, int, bool, None, lists, tuples, dicts, sets)
+    :type value: tuple
+
+    :return: the value as a frame for sending to the other process
+    :rtype: bytes
+    """
+    data = marshal.dumps(value)
+    return frame_header.pack(len(data)) + data
+
+
+class FrameReader:
+    """
+    Splits the data received from the other process into frames. Partial frames are kept until the rest of them
+    has been received
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        :param data: bytes received from the other process
+        :type data: bytes
+
+        :return: the values of the complete frames
+        :rtype: list(tuple)
+        """
+        self.buffer += data
+
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= frame_header.size:
+            length, = frame_header.unpack_from(self.buffer, offset)
+            end = offset + frame_header.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append(marshal.loads(self.buffer[offset + frame_header.size:end]))
+            offset = end
+
+        del self.buffer[:offset]
+        return frames
+
+
+class ProcessModule:
+    """
+    Stands in for a module that runs in a process of its own, so that it can use another processor core and can not
+    stop or crash the bot. The messages the module registers for are passed to the process, and the process calls
+    back to the bot to send messages and to use the accessmanager. The process is restarted if it exits or stops
+    answering
+    """
+
+    log = logging.getLogger("mustikkabot.moduleprocess")
+
+    ping_interval = datetime.timedelta(seconds=5)
+    ping_timeout = 30                   # Seconds without an answer after which the process is restarted
+    restart_delay = datetime.timedelta(seconds=1)
+    max_restart_delay = datetime.timedelta(seconds=60)
+    stop_timeout = 5                    # Seconds the process gets to dispose the module when the bot shuts down
+    max_outbuf = 1024 * 1024            # Unsent bytes after which the process is considered stuck
+
+    def __init__(self, manager, name, path):
+        """
+        :param manager: the module manager
+        :type manager: ModuleManager
+        :param name: name of the module
+        :type name: str
+        :param path: path of the source file of the module
+        :type path: str
+        """
+        self.manager = manager
+        self.name = name
+        self.path = path
+        self.bot = None
+
+        self.process = None
+        """ :type: subprocess.Popen"""
+        self.sock = None
+        """ :type: socket.socket"""
+        self.reader = FrameReader()
+        self.outbuf = bytearray()
+
+        self.last_pong = None
+        self.delay = self.restart_delay     # Doubled on every restart in a row, so a crashing module does not spin
+        self.restarts = 0
+        self.stopping = False               # The process is being stopped on purpose
+
+    def init(self, bot):
+        self.bot = bot
+        self.start()
+        bot.timemanager.register_interval(self.ping, self.ping_interval)
+
+    def dispose(self):
+        self.bot.timemanager.unregister(self.ping)
+        self.stop()
+
+    def reload(self):
+        """
+        Start the process again, so that it runs the current code of the module
+        """
+        self.stop()
+        self.start()
+
+    def start(self):
+        """
+        Start the process and tell it which module to run
+        """
+        self.stopping = False
+        parent, child = socket.socketpair()
+        command = [sys.executable, os.path.join(self.bot.srcdir, "moduleprocess.py"), str(child.fileno()),
+                   self.name, self.path]
+        self.process = subprocess.Popen(command, cwd=self.bot.srcdir, pass_fds=(child.fileno(),))
+        child.close()
+
+        parent.setblocking(False)
+        self.sock = parent
+        self.reader = FrameReader()
+        self.outbuf.clear()
+        self.last_pong = self.bot.clock.monotonic()
+
+        self.send(("start", self.bot.datadir, self.bot.srcdir, dict(getattr(self.bot, "options", {}))))
+        self.bot.add_reader(self.sock, self.handle_readable)
+        self.log.info("Started process " + str(self.process.pid) + " for module " + self.name)
+
+    def stop(self):
+        """
+        Ask the process to dispose the module and exit. Calls from the process are still answered while it does so.
+        The process is killed if it does not exit in :attr:stop_timeout seconds. A pending restart is cancelled
+        """
+        self.stopping = True
+        self.bot.timemanager.unregister(self.start)
+        if self.sock is not None:
+            self.bot.remove_reader(self.sock)
+            self.send(("dispose",))
+            end = self.bot.clock.monotonic() + self.stop_timeout
+            self.sock.setblocking(True)
+            try:
+                while self.sock is not None and self.bot.clock.monotonic() < end:
+                    if len(self.outbuf) > 0:
+                        del self.outbuf[:self.sock.send(self.outbuf)]
+                    self.sock.settimeout(end - self.bot.clock.monotonic())
+                    data = self.sock.recv(65536)
+                    if len(data) == 0:
+                        break
+                    for frame in self.reader.feed(data):
+                        self.handle_frame(frame)
+            except (OSError, ValueError):
+                pass    # Timed out or the process is gone
+            self.close()
+        self.unregister()
+
+    def close(self):
+        """
+        Close the connection and make sure the process is gone
+        """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.process is not None:
+            try:
+                self.process.wait(1)
+            except subprocess.TimeoutExpired:
+                self.log.warning("Process of module " + self.name + " did not exit, killing it")
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def unregister(self):
+        """
+        Remove the registrations the module made from the process
+        """
+        self.bot.eventmanager.unregister_message(self)
+        self.bot.eventmanager.unregister_special(self)
+
+    def restart(self, reason):
+        """
+        :param reason: what happened to the process, for logging
+        :type reason: str
+
+        Get rid of a process that has failed and start a new one after a delay
+        """
+        self.log.error("Process of module " + self.name + " " + reason + ", restarting in " +
+                       str(self.delay.total_seconds()) + " s")
+        if self.sock is not None:
+            self.bot.remove_reader(self.sock)
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+        self.close()
+        self.unregister()
+
+        self.restarts += 1
+        self.bot.timemanager.register_once(self.start, self.delay)
+        self.delay = min(self.delay * 2, self.max_restart_delay)
+
+    def send(self, value):
+        """
+        :param value: frame to send
+        :type value: tuple
+
+        Queue a frame for the process and send as much as the socket takes without blocking
+        """
+        if self.sock is None:
+            return
+        self.outbuf += encode_frame(value)
+        self.flush()
+
+    def flush(self):
+        """
+        Send queued frames to the process
+        """
+        try:
+            while len(self.outbuf) > 0:
+                del self.outbuf[:self.sock.send(self.outbuf)]
+        except BlockingIOError:
+            if len(self.outbuf) > self.max_outbuf and not self.stopping:
+                self.restart("is not reading its messages")
+        except OSError:
+            if not self.stopping:
+                self.restart("closed the connection")
+
+    def ping(self):
+        """
+        Timer callback, check that the process is still answering
+        """
+        if self.sock is None:
+            return
+        if self.bot.clock.monotonic() - self.last_pong > self.ping_timeout:
+            self.restart("stopped answering")
+            return
+        self.send(("ping",))
+
+    def handle_readable(self, events=None):
+        """
+        Main loop callback, handle the frames the process sent
+        """
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if len(data) == 0:
+            self.restart("exited")
+            return
+
+        for frame in self.reader.feed(data):
+            self.handle_frame(frame)
+            if self.sock is None:
+                return
+        self.flush()
+
+    def handle_frame(self, frame):
+        """
+        :param frame: a frame from the process
+        :type frame: tuple
+        """
+        kind = frame[0]
+        if kind == "call":
+            self.handle_call(*frame[1:])
+        elif kind == "register_message":
+            self.bot.eventmanager.register_message(self, frame[1])
+        elif kind == "register_special":
+            self.bot.eventmanager.register_special(self, frame[1])
+        elif kind == "unregister_message":
+            self.bot.eventmanager.unregister_message(self)
+        elif kind == "unregister_special":
+            self.bot.eventmanager.unregister_special(self)
+        elif kind == "pong":
+            self.last_pong = self.bot.clock.monotonic()
+        elif kind == "ready":
+            self.last_pong = self.bot.clock.monotonic()
+            self.delay = self.restart_delay
+            self.log.info("Module " + self.name + " running in process " + str(self.process.pid))
+
+    def handle_call(self, call_id, target, method, args, kwargs):
+        """
+        :param call_id: id to answer with, None if the process does not wait for an answer
+        :type call_id: int
+        :param target: "bot" or "accessmanager"
+        :type target: str
+        :param method: name of the method to call
+        :type method: str
+        :param args: positional arguments
+        :type args: tuple
+        :param kwargs: keyword arguments
+        :type kwargs: dict
+
+        Call the bot on behalf of the module and send back the result
+        """
+        try:
+            if target == "bot" and method in ("send_message", "send_data"):
+                function = getattr(self.bot, method)
+            elif target == "accessmanager" and not method.startswith("_"):
+                function = getattr(self.bot.accessmanager, method)
+            else:
+                raise Exception("Modules in processes can not call " + target + "." + method)
+            result = ("result", call_id, True, function(*args, **kwargs))
+        except Exception as e:
+            self.log.warning("Call to " + target + "." + method + " from module " + self.name + " failed: " + str(e))
+            result = ("result", call_id, False, str(e))
+
+        if call_id is None:
+            return
+        try:
+            self.send(result)
+        except ValueError:
+            self.send(("result", call_id, False, "The result of " + method + " can not be sent to a module process"))
+
+    def handle_message(self, message):
+        self.send(("message", message.to_tuple()))
+
+    def handle_special(self, message):
+        self.send(("special", message.to_tuple()))
+
+    def __repr__(self):
+        return "<module " + self.name + " in a process>"
+
+
+class _RemoteEventManager:
+    """
+    The eventmanager of the bot as seen from a module process. Registrations are passed on to the bot
+    """
+
+    def __init__(self, host):
+        self.host = host
+
+    def register_message(self, module, commands=None, blocking=False):
+        self.host.send(("register_message", list(commands) if commands is not None else None))
+
+    def unregister_message(self, module):
+        self.host.send(("unregister_message",))
+
+    def register_special(self, module, verbs=None):
+        self.host.send(("register_special", list(verbs) if verbs is not None else None))
+
+    def unregister_special(self, module):
+        self.host.send(("unregister_special",))
+
+
+class _RemoteManager:
+    """
+    A manager of the bot as seen from a module process. Method calls are made in the bot and the results returned
+    """
+
+    def __init__(self, host, target):
+        self.host = host
+        self.target = target
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            return self.host.call(self.target, method, args, kwargs)
+        return call
+
+
+class ModuleHost:
+    """
+    Runs a module in a module process. Looks like the bot to the module: messages, timers and the clock are
+    handled in the process, sending messages and permission checks are passed to the bot
+    """
+
+    log = logging.getLogger("mustikkabot.modulehost")
+
+    def __init__(self, sock, name, path):
+        """
+        :param sock: connection to the bot
+        :type sock: socket.socket
+        :param name: name of the module
+        :type name: str
+        :param path: path of the source file of the module
+        :type path: str
+        """
+        self.sock = sock
+        self.name = name
+        self.path = path
+
+        self.reader = FrameReader()
+        self.frames = collections.deque()   # Received frames not handled yet
+        self.call_ids = itertools.count(1)
+        self.running = True
+
+        self.datadir = None
+        self.srcdir = None
+        self.options = dict()
+        self.module = None
+
+        self.clock = Clock()
+        self.timemanager = TimeManager(self.clock)
+        self.eventmanager = _RemoteEventManager(self)
+        self.accessmanager = _RemoteManager(self, "accessmanager")
+
+    def send(self, value):
+        self.sock.sendall(encode_frame(value))
+
+    def send_message(self, msg, priority=PRIORITY_INTERACTIVE):
+        self.send(("call", None, "bot", "send_message", (msg, priority), {}))
+
+    def send_data(self, data, dontLog=False):
+        self.send(("call", None, "bot", "send_data", (data, dontLog), {}))
+
+    def call(self, target, method, args, kwargs):
+        """
+        Call a method in the bot and wait for the result. Frames received meanwhile are handled afterwards
+        """
+        call_id = next(self.call_ids)
+        self.send(("call", call_id, target, method, args, kwargs))
+
+        waiting = collections.deque()
+        try:
+            while True:
+                while len(self.frames) > 0:
+                    frame = self.frames.popleft()
+                    if frame[0] == "result" and frame[1] == call_id:
+                        if frame[2]:
+                            return frame[3]
+                        raise Exception(frame[3])
+                    waiting.append(frame)
+                if not self.receive(None):
+                    raise ConnectionError("Connection to the bot closed")
+        finally:
+            self.frames.extendleft(reversed(waiting))
+
+    def receive(self, timeout):
+        """
+        :param timeout: seconds to wait for data, None to wait until there is some
+        :type timeout: float
+
+        :return: False if the connection was closed
+        :rtype: bool
+        """
+        readable, writable, failed = select.select([self.sock], [], [], timeout)
+        if len(readable) == 0:
+            return True
+        data = self.sock.recv(65536)
+        if len(data) == 0:
+            return False
+        self.frames.extend(self.reader.feed(data))
+        return True
+
+    def start(self):
+        """
+        Load and initialize the module
+        """
+        while len(self.frames) == 0:
+            if not self.receive(None):
+                return False
+        kind, self.datadir, self.srcdir, self.options = self.frames.popleft()
+
+        from modulemanager import ModuleManager
+        manager = ModuleManager()
+        manager.set_paths(self.srcdir)
+        module = manager.import_module(self.path)
+        self.module = getattr(module, self.name.capitalize())()
+        if hasattr(self.module, "init"):
+            self.module.init(self)
+
+        self.send(("ready",))
+        return True
+
+    def run(self):
+        """
+        Handle the frames from the bot and the timers of the module until the bot tells to stop
+        """
+        if not self.start():
+            return
+
+        while self.running:
+            while self.running and len(self.frames) > 0:
+                self.handle_frame(self.frames.popleft())
+            if not self.running:
+                break
+
+            deadline = self.timemanager.next_deadline()
+            timeout = None if deadline is None else max(deadline - self.clock.monotonic(), 0)
+            if not self.receive(timeout):
+                self.log.info("Connection to the bot closed")
+                break
+            self.timemanager.handle_events()
+
+    def handle_frame(self, frame):
+        """
+        :param frame: a frame from the bot
+        :type frame: tuple
+        """
+        kind = frame[0]
+        if kind == "message":
+            self.call_handler("handle_message", Message.from_tuple(frame[1]))
+        elif kind == "special":
+            self.call_handler("handle_special", Message.from_tuple(frame[1]))
+        elif kind == "ping":
+            self.send(("pong",))
+        elif kind == "dispose":
+            if hasattr(self.module, "dispose"):
+                self.module.dispose()
+            self.running = False
+
+    def call_handler(self, name, message):
+        """
+        :param name: name of the handler method
+        :type name: str
+        :param message: the message
+        :type message: Message
+        """
+        try:
+            result = getattr(self.module, name)(message)
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+        except:
+            self.log.exception("Error happened while module " + self.name + " was handling a message")
+
+
+if __name__ == "__main__":  # Started by ProcessModule
+    logutils.setup_logging("mustikkabot")
+    host = ModuleHost(socket.socket(fileno=int(sys.argv[1])), sys.argv[2], sys.argv[3])
+    host.run()
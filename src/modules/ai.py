@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 from lib.chatter_bot_api import ChatterBotFactory, ChatterBotType
@@ -23,7 +24,7 @@ class Ai:
         :rtype: None
         """
         self.bot = bot
-        self.bot.eventmanager.register_message(self)
+        self.bot.eventmanager.register_message(self, ["mustikkabot*"])
         self.bot.accessmanager.register_acl(self.acl, default_groups="%all")
 
         factory = ChatterBotFactory()
@@ -39,20 +40,16 @@ class Ai:
         self.bot.eventmanager.unregister_message(self)
         self.log.info("Disposed")
 
-    def handle_message(self, data, user, msg):
+    async def handle_message(self, message):
         """
-        Handle an incoming message
-
-        :param data: Raw message
-        :type data: str
-        :param user: Name of the user sending the message
-        :type user: str
-        :param msg: Actual user message
-        :type msg: str
+        Handle an incoming message. The request to the AI is made in a thread so that it does not block other modules
+
+        :param message: The chat message
+        :type message: Message
         :rtype: None
         """
 
-        msg_split = msg.split()
-        if msg_split[0].lower().startswith("mustikkabot"):
-            out = self.ai.think(' '.join(msg_split[1:]))
-            self.bot.send_message(user + ": " + out)
\ No newline at end of file
+        if message.command.lower().startswith("mustikkabot"):
+            loop = asyncio.get_running_loop()
+            out = await loop.run_in_executor(None, self.ai.think, ' '.join(message.args[1:]))
+            self.bot.send_message(message.nick + ": " + out)
\ No newline at end of file
@@ -1,11 +1,15 @@
+import collections
+import heapq
+import itertools
 import json
 import logging
 import os
 import datetime
 import jsonpickle
 
-import tools
 import exceptions
+import sendqueue
+import tools
 
 
 class Command:
@@ -38,6 +42,14 @@ class Commands:
 
     acl = "!commands"
 
+    # Anti-spam budget: at most this many repeat messages are sent within the window. Can be changed with the
+    # repeat_budget and repeat_window (seconds) options
+    repeat_budget = 3
+    repeat_window = datetime.timedelta(seconds=60)
+
+    # Delay before a repeating command that has not been shown yet is shown for the first time
+    first_repeat_delay = datetime.timedelta(seconds=10)
+
     def __init__(self):
         # Logger instance for this module
         self.log = logging.getLogger("mustikkabot.commands")
@@ -51,14 +63,42 @@ class Commands:
         self.jsonpath = None
         ":type: str"
 
-        # Array of the commands loaded
+        # Array of the commands loaded, in the order they were added. Saved to the JSON
         self.commands = []
         ":type: list of Command"
 
+        # The commands by name, and by case-folded name for finding them from chat regardless of case. Commands that
+        # differ only by case share a case-folded name, in the order they were added
+        self.index = dict()
+        ":type: dict of (str, Command)"
+        self.aliases = dict()
+        ":type: dict of (str, list of Command)"
+
         # Message line counter for "execute every x lines"
         self.lines_received = 0
         ":type: int"
 
+        # Were the commands handed over from the previous instance when the module was reloaded
+        self.state_imported = False
+        ":type: bool"
+
+        # Repeat scheduling. A repeating command waits in the time queue until its repeat time has passed, then in the
+        # line queue until enough lines have been received, and then in the ready queue for its turn within the
+        # anti-spam budget. Entries whose number is no longer the current one of their command are skipped
+        self.time_queue = []
+        ":type: list of (float, int, Command)"
+        self.line_queue = []
+        ":type: list of (int, int, Command)"
+        self.ready = collections.deque()
+        ":type: collections.deque of (int, Command)"
+        self.repeating = dict()         # Command: number of its current entry
+        ":type: dict of (Command, int)"
+        self.repeat_ids = itertools.count()
+        self.shown = collections.deque()    # Clock times of the repeat messages sent within the window
+        ":type: collections.deque of float"
+        self.wakeup = None              # Clock time the repeat timer is set for
+        ":type: float"
+
         # Message to show when called without arguments
         self.helpMessage = "Usage: !commands list | add {cmd} [text] | remove {cmd} | set {cmd} {text} | " \
                            "regulars {cmd} {on|off} | setrepeat {cmd} {time} [lines]"
@@ -77,14 +117,22 @@ class Commands:
 
         self.jsonpath = os.path.join(self.bot.datadir, "commands.json")
 
-        self.read_JSON()
+        if not self.state_imported:
+            self.read_JSON()
 
         self.bot.accessmanager.register_acl(self.acl, default_groups=["%moderators"])
         for command in self.commands:
             bot.accessmanager.register_acl("commands.!" + command.name)
         bot.eventmanager.register_message(self)
-        bot.timemanager.register_interval(self.check_repeats,
-                                          datetime.timedelta(seconds=20), datetime.timedelta(seconds=10))
+
+        options = getattr(bot, "options", {})
+        try:
+            self.repeat_budget = int(options.get("repeat_budget", self.repeat_budget))
+            self.repeat_window = datetime.timedelta(seconds=float(options.get("repeat_window",
+                                                                              self.repeat_window.total_seconds())))
+        except ValueError:
+            self.log.error("Malformed repeat budget settings, using the defaults")
+        self.schedule_repeats()
 
         self.log.info("Init complete")
 
@@ -96,8 +144,74 @@ class Commands:
         :rtype: None
         """
         self.bot.eventmanager.unregister_message(self)
+        self.bot.timemanager.unregister(self.run_repeats)
+        self.wakeup = None
         self.log.info("Disposed")
 
+    def export_state(self):
+        """
+        Hand the commands to the new instance of the module when the module is reloaded. The repeat counters are
+        kept, so repeating commands are not shown again right after a reload
+
+        :return: the commands and the line counter
+        :rtype: dict
+        """
+        return {"commands": [vars(command) for command in self.commands], "lines_received": self.lines_received}
+
+    def import_state(self, state):
+        """
+        Take over the commands from the previous instance of the module. Called by the modulemanager before
+        :meth:init when the module is reloaded
+
+        :param state: what :meth:export_state of the previous instance returned
+        :type state: dict
+        :rtype: None
+        """
+        self.commands = []
+        for fields in state["commands"]:
+            command = Command()     # Instances of the reloaded class, so that the new code is used for them
+            command.__dict__.update(fields)
+            self.commands.append(command)
+        self.lines_received = state["lines_received"]
+        self.state_imported = True
+        self.index_commands()
+
+    def index_commands(self):
+        """
+        Build the indexes of the commands from the list, after the list has been loaded or replaced
+
+        :rtype: None
+        """
+        self.index = dict()
+        self.aliases = dict()
+        for command in self.commands:
+            self.index_command(command)
+
+    def index_command(self, command):
+        """
+        Add a command to the indexes. If commands differ only by case, the first one gets the case-folded name
+
+        :param command: The command to add
+        :type command: Command
+        :rtype: None
+        """
+        self.index[command.name] = command
+        self.aliases.setdefault(command.name.casefold(), []).append(command)
+
+    def unindex_command(self, command):
+        """
+        Remove a command from the indexes
+
+        :param command: The command to remove
+        :type command: Command
+        :rtype: None
+        """
+        del self.index[command.name]
+        folded = command.name.casefold()
+        self.aliases[folded].remove(command)
+        if len(self.aliases[folded]) == 0:
+            del self.aliases[folded]
+
     def does_command_exist(self, name):
         """
         Check if a command exists
@@ -107,98 +221,205 @@ class Commands:
         :return: does command exist true/false
         :rtype: bool
         """
-        for command in self.commands:
-            if command.name == name:
-                return True
-        return False
+        return name in self.index
 
     def get_command_by_name(self, name):
         """
-        Get a command from the array by name. Returns None if command doesn't exist
+        Get a command by name. Returns None if command doesn't exist
 
         :param name: Name of the command to get
         :type name: str
         :return: Command with the name
         :rtype: Command
         """
-        for command in self.commands:
-            if command.name == name:
-                return command
-        return None
+        return self.index.get(name)
 
-    def check_repeats(self):
+    def find_command(self, name):
         """
-        Timer callback that handles the repeating of commands. Checks line/time conditions
+        Find the command a word in chat refers to, ignoring case if there is no exact match. Returns None if there
+        is no such command
+
+        :param name: Name of the command, without the "!"
+        :type name: str
+        :return: The command
+        :rtype: Command
+        """
+        command = self.index.get(name)
+        if command is None:
+            matches = self.aliases.get(name.casefold())
+            if matches is not None:
+                command = matches[0]
+        return command
+
+    def schedule_repeats(self):
+        """
+        Queue all the repeating commands, e.g. after the commands have been loaded
 
         :rtype: None
         """
+        self.time_queue = []
+        self.line_queue = []
+        self.ready.clear()
+        self.repeating.clear()
         for command in self.commands:
             if command.repeat:
-                if command.lastshown_time is None:  # Message has not been shown, do so now
-                    self.bot.send_message(command.value)
-                    self.log.info("Showed message for command " + command.name + " on repeat")
-                    command.lastshown_time = datetime.datetime.now()
-                    command.lastshown_line = self.lines_received
-                    return                          # Send only one command/cycle to prevent spam
-
-                if command.repeat_minutes > 0:
-                    if (datetime.datetime.now() - command.lastshown_time) > \
-                            datetime.timedelta(minutes=command.repeat_minutes):
-                        timecondition = True
-                    else:
-                        timecondition = False
-                else:
-                    timecondition = True
-
-                if command.repeat_lines > 0:
-                    if (self.lines_received - command.lastshown_line) >= command.repeat_lines:
-                        linecondition = True
-                    else:
-                        linecondition = False
-                else:
-                    linecondition = True
-
-                if timecondition and linecondition:
-                    self.bot.send_message(command.value)
-                    self.log.info("Showed message for command " + command.name + " on repeat")
-                    command.lastshown_time = datetime.datetime.now()
-                    command.lastshown_line = self.lines_received
-                    return  # Send only one command/cycle to prevent spam
+                self.schedule_repeat(command)
+        self.rearm()
 
-    # noinspection PyUnusedLocal
-    def handle_message(self, data, user, msg):
+    def schedule_repeat(self, command):
         """
-        Callback that handles all incoming chat messages for this modules
+        Queue a repeating command for its next showing. Replaces the earlier entries of the command
 
-        :param data: Raw message (unused)
-        :type data: str
-        :param user: User sending the message
-        :type user: str
-        :param msg: Actual message content
-        :type msg: str
+        :param command: The command to queue
+        :type command: Command
         :rtype: None
         """
-        msg = tools.strip_name(msg)
-        args = msg.split()
+        number = next(self.repeat_ids)
+        self.repeating[command] = number
 
-        if args[0] == "!commands" or args[0] == "!comm":
-            self.setup_commands(user, args)
+        if command.lastshown_time is None:
+            delay = self.first_repeat_delay
+        elif command.repeat_minutes > 0:
+            delay = command.lastshown_time + datetime.timedelta(minutes=command.repeat_minutes) - self.bot.clock.now()
         else:
-            self.run_commands(user, args)
+            self.wait_lines(number, command)
+            return
+        heapq.heappush(self.time_queue, (self.bot.clock.monotonic() + delay.total_seconds(), number, command))
+
+    def cancel_repeat(self, command):
+        """
+        Stop repeating a command. Its entries are left in the queues and skipped when they come up
+
+        :param command: The command
+        :type command: Command
+        :rtype: None
+        """
+        self.repeating.pop(command, None)
+
+    def wait_lines(self, number, command):
+        """
+        Queue a command whose repeat time has passed to wait for enough lines to be received since it was shown
+
+        :param number: Number of the entry of the command
+        :type number: int
+        :param command: The command
+        :type command: Command
+        :rtype: None
+        """
+        if command.lastshown_line is not None and command.repeat_lines > 0:
+            line = command.lastshown_line + command.repeat_lines
+            if line > self.lines_received:
+                heapq.heappush(self.line_queue, (line, number, command))
+                return
+        self.ready.append((number, command))
+
+    def run_repeats(self):
+        """
+        Timer callback. Move the commands whose repeat time has passed forward in the queues and show the ones that
+        are ready
+
+        :rtype: None
+        """
+        self.wakeup = None
+        now = self.bot.clock.monotonic()
+        while len(self.time_queue) > 0 and self.time_queue[0][0] <= now:
+            due, number, command = heapq.heappop(self.time_queue)
+            if self.repeating.get(command) == number:
+                self.wait_lines(number, command)
+        self.show_ready()
+        self.rearm()
+
+    def check_lines(self):
+        """
+        Show the commands that were waiting for the line that was just received
+
+        :rtype: None
+        """
+        while len(self.line_queue) > 0 and self.line_queue[0][0] <= self.lines_received:
+            line, number, command = heapq.heappop(self.line_queue)
+            if self.repeating.get(command) == number:
+                self.ready.append((number, command))
+        self.show_ready()
+        self.rearm()
+
+    def show_ready(self):
+        """
+        Show the ready commands in turn, as many as fit in the anti-spam budget. A command that has been shown goes to
+        the back of the queues, so that every repeating command gets its turn
+
+        :rtype: None
+        """
+        now = self.bot.clock.monotonic()
+        window = self.repeat_window.total_seconds()
+        while len(self.shown) > 0 and self.shown[0] <= now - window:
+            self.shown.popleft()
+
+        while len(self.ready) > 0 and len(self.shown) < self.repeat_budget:
+            number, command = self.ready.popleft()
+            if self.repeating.get(command) != number:
+                continue
+            self.bot.send_message(command.value, sendqueue.PRIORITY_AUTOMATIC)
+            self.log.info("Showed message for command " + command.name + " on repeat")
+            command.lastshown_time = self.bot.clock.now()
+            command.lastshown_line = self.lines_received
+            self.shown.append(now)
+            self.schedule_repeat(command)
+
+    def rearm(self):
+        """
+        Set the repeat timer for when the next command is due, or when the budget allows sending the ready ones. No
+        timer is kept running when nothing is waiting for time
+
+        :rtype: None
+        """
+        wakeup = None
+        if len(self.time_queue) > 0:
+            wakeup = self.time_queue[0][0]
+        if len(self.ready) > 0 and len(self.shown) > 0:
+            release = self.shown[0] + self.repeat_window.total_seconds()
+            wakeup = release if wakeup is None else min(wakeup, release)
+
+        if wakeup == self.wakeup:
+            return
+        if self.wakeup is not None:
+            self.bot.timemanager.unregister(self.run_repeats)
+        self.wakeup = wakeup
+        if wakeup is not None:
+            delay = max(wakeup - self.bot.clock.monotonic(), 0)
+            self.bot.timemanager.register_once(self.run_repeats, datetime.timedelta(seconds=delay))
+
+    def handle_message(self, message):
+        """
+        Callback that handles all incoming chat messages for this modules
+
+        :param message: The chat message
+        :type message: Message
+        :rtype: None
+        """
+        args = message.args
+
+        if message.command == "!commands" or message.command == "!comm":
+            self.setup_commands(message.nick, args, message.roles)
+        elif len(args) > 0:
+            self.run_commands(message.nick, args, message.roles)
 
         self.lines_received += 1
+        if len(self.line_queue) > 0 and self.line_queue[0][0] <= self.lines_received:
+            self.check_lines()
 
     # noinspection PyUnusedLocal
-    def setup_commands(self, user, args):
+    def setup_commands(self, user, args, roles=None):
         """
         Hub for different management commands. Command creation/editing/removal
         :param user: Name of the user
         :type user: str
         :param args: Message split into words
         :type args: list of str
+        :param roles: Twitch roles of the user
+        :type roles: frozenset of str
         :rtype: None
         """
-        if not self.bot.accessmanager.is_in_acl(user, self.acl):
+        if not self.bot.accessmanager.is_in_acl(user, self.acl, roles):
             self.log.warning("User " + user + " tried to issue a command management command without permissions")
             return
 
@@ -223,16 +444,17 @@ class Commands:
 
             if args[1] == "load":
                 self.read_JSON()
+                self.schedule_repeats()
 
             if args[1] == "save":
                 self.write_JSON()
         else:
             self.bot.send_message(self.helpMessage)
 
-    def run_commands(self, user, args):
-        if self.does_command_exist(args[0][1:]):
-            command = self.get_command_by_name(args[0][1:])
-            if self.bot.accessmanager.is_in_acl(user, "commands.!" + command.name):
+    def run_commands(self, user, args, roles=None):
+        command = self.find_command(args[0][1:])
+        if command is not None:
+            if self.bot.accessmanager.is_in_acl(user, "commands.!" + command.name, roles):
                 self.bot.send_message(command.value)
                 self.log.info("Running command " + command.value + ": " + command.value)
 
@@ -257,10 +479,11 @@ class Commands:
             self.log.info("Commands JSON found in old format, migrating")
             self.migrate_JSON(jsondata)
         else:
-            self.commands = jsonpickle.decode(jsondata)
+            self.commands = jsonpickle.decode(jsondata, classes=tools.json_classes(Command))
             for command in self.commands:
                 command.lastshown_line = None
                 command.lastshown_time = None
+        self.index_commands()
 
     # noinspection PyPep8Naming
     def migrate_JSON(self, jsondata):
@@ -312,6 +535,7 @@ class Commands:
 
             command = Command(name=cmd, value=text)
             self.commands.append(command)
+            self.index_command(command)
 
             self.bot.accessmanager.register_acl("commands.!" + cmd)
             self.write_JSON()
@@ -349,7 +573,10 @@ class Commands:
         cmd = args[2]
 
         if self.does_command_exist(cmd):
-            self.commands.remove(self.get_command_by_name(cmd))
+            command = self.get_command_by_name(cmd)
+            self.cancel_repeat(command)
+            self.commands.remove(command)
+            self.unindex_command(command)
 
             self.bot.accessmanager.remove_acl("commands.!" + cmd)
             self.write_JSON()
@@ -423,6 +650,7 @@ class Commands:
 
         if time == 0 and lines == 0:
             self.get_command_by_name(cmd).repeat = False
+            self.cancel_repeat(self.get_command_by_name(cmd))
             self.bot.send_message("Repetition disabled for command " + cmd)
             self.write_JSON()
         else:
@@ -430,6 +658,8 @@ class Commands:
             command.repeat = True
             command.repeat_minutes = time
             command.repeat_lines = lines
+            self.schedule_repeat(command)
+            self.rearm()
             self.write_JSON()
 
             msg = "Repetition enabled for command " + cmd + " every "
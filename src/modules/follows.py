@@ -4,6 +4,8 @@ import datetime
 from TwitchAPI.Channel import Channel
 from urllib.error import HTTPError
 
+import sendqueue
+
 
 def _ts2dt(timestamp):
     return datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
@@ -21,6 +23,10 @@ class Follows:
     last_created_at = 0
 
     def check_followers(self):
+        """
+        Timer callback that thanks new followers. Run in the worker pool, so that calling the Twitch API does not
+        block other modules
+        """
         try:
             data = Channel("herramustikka").get_followers()
         except HTTPError:
@@ -35,7 +41,8 @@ class Follows:
 
             if _ts2dt(follow['created_at']) > self.last_created_at:
                 if follow['user']['display_name'] not in self.followed:
-                    self.bot.send_message("Kiitos followista / Thank you for the follow: " + follow['user']['display_name'])
+                    self.bot.send_message("Kiitos followista / Thank you for the follow: " + follow['user']['display_name'],
+                                          sendqueue.PRIORITY_AUTOMATIC)
                     self.followed.append(follow['user']['display_name'])
                     self.log.info("New follower: " + follow['user']['display_name'])
                 else:
@@ -49,7 +56,8 @@ class Follows:
         self.bot = bot
 
         interval = datetime.timedelta(seconds=5)
-        self.bot.timemanager.register_interval(interval=interval, action=self.check_followers)
+        self.bot.timemanager.register_interval(interval=interval, action=self.check_followers, blocking=True,
+                                               timeout=datetime.timedelta(seconds=30))
 
         self.log.info("Init complete")
 
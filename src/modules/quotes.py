@@ -2,6 +2,7 @@ import logging
 import os
 import jsonpickle
 import exceptions
+import tools
 import datetime
 import random
 
@@ -53,7 +54,7 @@ class Quotes:
         self.acl_admin = "!quotes.sdmin"
 
         self.bot.accessmanager.register_acl(self.acl_admin, default_groups=["%moderators"])
-        self.bot.eventmanager.register_message(self)
+        self.bot.eventmanager.register_message(self, ["!quotes", "!quote"])
         self.read_JSON()
 
         self.log.info("Init complete")
@@ -73,7 +74,7 @@ class Quotes:
             self.log.error("Could not open " + self.jsonpath)
             raise exceptions.FatalException("Could not open " + self.jsonpath)
 
-        self.quotes = jsonpickle.decode(jsondata)
+        self.quotes = jsonpickle.decode(jsondata, classes=tools.json_classes(Quote))
 
     def write_JSON(self):
         data = jsonpickle.encode(self.quotes)
@@ -106,11 +107,14 @@ class Quotes:
                 return quote
         return None
 
-    def command_admin(self, user, args):
+    def command_admin(self, message):
+        user = message.nick
+        args = message.args
+        roles = message.roles
         if len(args) < 2:
             return
         if args[1] == "add":
-            if not self.bot.accessmanager.is_in_acl(user, self.acl_admin):
+            if not self.bot.accessmanager.is_in_acl(user, self.acl_admin, roles):
                 return
             if len(args) < 4:
                 return
@@ -119,16 +123,16 @@ class Quotes:
                     return
                 date = datetime.datetime(int(args[3]), 1, 1)
                 user = args[4]
-                text = ' '.join(args[5:])
+                text = message.rest(5)
             else:
-                date = datetime.datetime.now()
+                date = self.bot.clock.now()
                 user = args[2]
-                text = ' '.join(args[3:])
+                text = message.rest(3)
             quote_id = self.quote_add(date, user, text)
             self.bot.send_message("Added quote with ID #" + str(quote_id))
 
         elif args[1] == "remove" or args[1] == "delete":
-            if not self.bot.accessmanager.is_in_acl(user, self.acl_admin):
+            if not self.bot.accessmanager.is_in_acl(user, self.acl_admin, roles):
                 return
             if len(args) < 3:
                 return
@@ -159,9 +163,8 @@ class Quotes:
         else:
             self.bot.send_message("Quote #" + str(id) + " does not exist")
 
-    def handle_message(self, data, user, msg):
-        args = msg.split(' ')
-        if args[0] == "!quotes":
-            self.command_admin(user, args)
-        elif args[0] == "!quote":
-            self.command_show(user, args)
+    def handle_message(self, message):
+        if message.command == "!quotes":
+            self.command_admin(message)
+        elif message.command == "!quote":
+            self.command_show(message.nick, message.args)
@@ -1,7 +1,6 @@
 import re
 
 import logging
-import tools
 
 
 class Raffle:
@@ -27,25 +26,23 @@ class Raffle:
         self.bot.eventmanager.unregister_message(self)
         self.log.info("Disposed")
 
-    def handle_message(self, data, user, msg):
-        msg = tools.stripPrefix(msg)
-
-        args = msg.split()
-        if not args[0] is "!raffle":
+    def handle_message(self, message):
+        args = message.args
+        if message.command != "!raffle":
             return
 
-        if len(args) is 1:
+        if len(args) == 1:
             if self.raffleName is not None:
                 self.bot.sendMessage("No ongoing raffles")
             else:
                 self.bot.sendMessage("Ongoing raffle: " + self.raffleName)
             return
 
-        if args[1] is "create":
+        if args[1] == "create":
             pass
 
-        if args[1] is "end":
+        if args[1] == "end":
             pass
 
-        if args[1] is "help":
+        if args[1] == "help":
             pass
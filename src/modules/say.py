@@ -1,8 +1,5 @@
-import re
 import logging
 
-import tools
-
 
 class Say:
 
@@ -20,7 +17,7 @@ class Say:
         :rtype: None
         """
         self.bot = bot
-        self.bot.eventmanager.register_message(self)
+        self.bot.eventmanager.register_message(self, ["!say"])
         self.bot.accessmanager.register_acl(self.acl)
         self.log.info("Init complete")
 
@@ -33,10 +30,7 @@ class Say:
         self.log.info("Disposed")
 
     # noinspection PyUnusedLocal
-    def handle_message(self, data, user, msg):
-        msg = tools.strip_name(msg)
-
-        result = re.search(r'^!say (.*)', msg)
-        if result is not None:
-            if self.bot.accessmanager.is_in_acl(user, self.acl):
-                self.bot.send_message(' '.join(result.groups(1)))
+    def handle_message(self, message):
+        if message.command == "!say" and len(message.args) > 1:
+            if self.bot.accessmanager.is_in_acl(message.nick, self.acl, message.roles):
+                self.bot.send_message(message.rest(1))
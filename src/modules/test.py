@@ -28,8 +28,8 @@ class Test:
         self.bot.eventmanager.unregister_special(self)
         self.log.info("Disposed")
 
-    def handle_message(self, data, user, msg):
-        self.log.debug(user + " said: " + msg)
+    def handle_message(self, message):
+        self.log.debug(message.nick + " said: " + message.text)
 
-    def handle_special(self, data):
-        self.log.debug("Received special: " + data)
+    def handle_special(self, message):
+        self.log.debug("Received special: " + message.raw)
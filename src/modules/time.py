@@ -1,12 +1,11 @@
 import jsonpickle
 import os
 import exceptions
+import tools
 import logging
 import datetime
 from math import floor
 
-import tools
-
 
 class TimerData:
     msg = ""
@@ -37,7 +36,7 @@ class Time:
 
         bot.accessmanager.register_acl("!time.print")
         bot.accessmanager.register_acl("!time.set")
-        bot.eventmanager.register_message(self)
+        bot.eventmanager.register_message(self, ["!time"])
 
         self.log.info("Init complete")
 
@@ -71,7 +70,7 @@ class Time:
             self.log.error("Could not open " + self.jsonpath)
             raise exceptions.FatalException("Could not open " + self.jsonpath)
 
-        self.data = jsonpickle.decode(jsondata)
+        self.data = jsonpickle.decode(jsondata, classes=tools.json_classes(TimerData))
 
     # noinspection PyPep8Naming
     def write_JSON(self):
@@ -84,11 +83,10 @@ class Time:
             data = jsonpickle.encode(self.data)
             file.write(data)
 
-    def handle_message(self, data, user, msg):
-        msg = tools.strip_name(msg)
-        args = msg.split()
+    def handle_message(self, message):
+        args = message.args
 
-        if args[0] == "!time":
+        if message.command == "!time":
             if len(args) > 1:
                 self.time_set(args)
             else:
@@ -97,7 +95,7 @@ class Time:
             pass
 
     def time_set(self, args):
-        now = datetime.datetime.now()
+        now = self.bot.clock.now()
         year = now.year
         month = now.month
         day = now.day
@@ -132,7 +130,7 @@ class Time:
 
     def time_print(self):
 
-            now = datetime.datetime.now()
+            now = self.bot.clock.now()
             target = self.data.target
             delta = target - now
             hours = floor(delta.seconds / 3600)
@@ -31,7 +31,7 @@ class Tj:
         self.log = logging.getLogger("mustikkabot.tj")
 
         self.bot.accessmanager.register_acl(self.acl)
-        self.bot.eventmanager.register_message(self)
+        self.bot.eventmanager.register_message(self, ["!tj"])
 
         self.log.info("Init complete")
 
@@ -39,10 +39,10 @@ class Tj:
         self.bot.eventmanager.unregister_message(self)
         self.log.info("Disposed")
 
-    def handle_message(self, data, user, msg):
-        args = msg.split(' ')
+    def handle_message(self, message):
+        args = message.args
 
-        if args[0] != "!tj":
+        if message.command != "!tj":
             return
 
         if len(args) == 1:
@@ -51,7 +51,7 @@ class Tj:
             group = args[1]
 
         try:
-            now = datetime.datetime.now()
+            now = self.bot.clock.now()
             delta = self.release[group] - datetime.datetime(now.year, now.month, now.day)
             if delta.days > 0:
                 self.bot.send_message("TJ" + str(delta.days))
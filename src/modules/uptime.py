@@ -1,12 +1,11 @@
 import jsonpickle
 import exceptions
+import tools
 import os
 import logging
 import datetime
 from math import floor
 
-import tools
-
 
 class TimerData:
     msg = ""
@@ -38,7 +37,7 @@ class Uptime:
 
         bot.accessmanager.register_acl("!uptime.print")
         bot.accessmanager.register_acl("!uptime.set")
-        bot.eventmanager.register_message(self)
+        bot.eventmanager.register_message(self, ["!uptime"])
 
         self.log.info("Init complete")
 
@@ -72,7 +71,7 @@ class Uptime:
             self.log.error("Could not open " + self.jsonpath)
             raise exceptions.FatalException("Could not open " + self.jsonpath)
 
-        self.data = jsonpickle.decode(jsondata)
+        self.data = jsonpickle.decode(jsondata, classes=tools.json_classes(TimerData))
 
     # noinspection PyPep8Naming
     def write_JSON(self):
@@ -85,11 +84,10 @@ class Uptime:
             data = jsonpickle.encode(self.data)
             file.write(data)
 
-    def handle_message(self, data, user, msg):
-        msg = tools.strip_name(msg)
-        args = msg.split()
+    def handle_message(self, message):
+        args = message.args
 
-        if args[0] == "!uptime":
+        if message.command == "!uptime":
             if len(args) > 1:
                 if args[1] == "reset":
                     self.uptime_reset(args)
@@ -102,7 +100,7 @@ class Uptime:
 
     def uptime_reset(self, args):
 
-        now = datetime.datetime.now()
+        now = self.bot.clock.now()
 
         self.data.target = datetime.datetime(year=now.year, month=now.month, day=now.day, hour=now.hour, minute=now.minute, second=now.second)
         self.write_JSON()
@@ -111,7 +109,7 @@ class Uptime:
 
     def uptime_print(self):
 
-            uptime_now = datetime.datetime.now()
+            uptime_now = self.bot.clock.now()
             uptime_target = self.data.target
             uptime_delta = uptime_now - uptime_target
             delta_hours = floor(uptime_delta.seconds / 3600)
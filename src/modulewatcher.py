@@ -0,0 +1,152 @@
+#
+# Watching the module directories for changes
+#
+# Author: Esa Varemo
+#
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import platform
+import struct
+
+
+class ModuleWatcher:
+    """
+    Watches the module directories for changed module files. Uses inotify on Linux, and falls back to comparing the
+    modification times of the files on other platforms or if inotify can not be used
+    """
+
+    log = logging.getLogger("mustikkabot.modulewatcher")
+
+    # From <sys/inotify.h>. Only finished writes are watched: a file is complete when it has been closed after
+    # writing or moved in place
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+
+    event_header = struct.Struct("iIII")    # wd, mask, cookie, len, followed by len bytes of name
+
+    def __init__(self, paths):
+        """
+        :param paths: directories to watch
+        :type paths: list(str)
+        """
+        self.paths = [os.path.abspath(path) for path in paths]
+
+        self.fd = None              # inotify file descriptor, None when polling
+        self.watches = dict()       # watch descriptor: directory
+
+        self.mtimes = dict()        # path: modification time, when polling
+        self.changed = set()        # files the previous poll found changed
+
+    def start(self):
+        """
+        Start watching. inotify is used if it is available, otherwise the files are polled
+        """
+        if platform.system() == "Linux":
+            try:
+                self.start_inotify()
+                self.log.info("Watching " + ", ".join(self.paths) + " with inotify")
+                return
+            except OSError as e:
+                self.log.warning("Could not use inotify (" + str(e) + "), polling for changes instead")
+
+        self.mtimes = self.scan()
+        self.log.info("Polling " + ", ".join(self.paths) + " for changes")
+
+    def start_inotify(self):
+        """
+        Set up inotify watches for the directories
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        for path in self.paths:
+            wd = libc.inotify_add_watch(fd, os.fsencode(path), self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+            if wd < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                self.watches.clear()
+                raise OSError(error, os.strerror(error), path)
+            self.watches[wd] = path
+
+        self.fd = fd
+
+    def stop(self):
+        """
+        Stop watching
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.watches.clear()
+
+    def scan(self):
+        """
+        :return: modification times of the module files in the directories
+        :rtype: dict(str: int)
+        """
+        mtimes = dict()
+        for path in self.paths:
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(".py"):
+                            mtimes[entry.path] = entry.stat().st_mtime_ns
+            except OSError:
+                pass    # The directory or the file disappeared, it is reported as changed
+        return mtimes
+
+    def read_events(self):
+        """
+        :return: module files written since the previous call
+        :rtype: set(str)
+
+        Read the queued inotify events without blocking
+        """
+        files = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.event_header.unpack_from(data, offset)
+                offset += self.event_header.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if wd in self.watches and name.endswith(b".py"):
+                    files.add(os.path.join(self.watches[wd], os.fsdecode(name)))
+        return files
+
+    def poll(self):
+        """
+        :return: module files that changed before the previous poll and have not changed since
+        :rtype: set(str)
+
+        Compare the modification times of the files to the previous poll. Editors may write a file in several
+        steps, so a file is reported only once a poll finds it unchanged
+        """
+        mtimes = self.scan()
+        files = set(path for path in set(mtimes) | set(self.mtimes) if mtimes.get(path) != self.mtimes.get(path))
+        self.mtimes = mtimes
+
+        settled = self.changed - files
+        self.changed = files
+        return settled
+
+    def changes(self):
+        """
+        :return: paths of the module files that have changed since the previous call
+        :rtype: set(str)
+        """
+        if self.fd is not None:
+            return self.read_events()
+        return self.poll()
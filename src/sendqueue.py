@@ -0,0 +1,234 @@
+#
+# Rate limited queue for outgoing chat messages
+#
+# Author: Esa Varemo
+#
+
+import collections
+import logging
+
+from clock import Clock
+
+# Priority classes for outgoing messages
+PRIORITY_PROTOCOL = 0       # Protocol traffic like PONG sent with Bot.send_data, bypasses the queue and the rate limit
+PRIORITY_INTERACTIVE = 1    # Replies to users
+PRIORITY_AUTOMATIC = 2      # Periodic and automatic messages, can be coalesced or dropped under pressure
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter: allows bursts of up to *rate* messages, refilling at *rate* tokens per *per* seconds
+    """
+
+    def __init__(self, rate, per, clock=None):
+        """
+        :param rate: number of messages allowed within the period
+        :type rate: int
+        :param per: length of the period in seconds
+        :type per: float
+        :param clock: clock the times passed to the bucket come from, defaults to the real clock
+        :type clock: clock.Clock
+        """
+        if clock is None:
+            clock = Clock()
+
+        self.rate = rate
+        self.per = per
+
+        self.tokens = float(rate)
+        self.updated = clock.monotonic()
+
+    def refill(self, now):
+        """
+        :param now: current time from clock.monotonic()
+        :type now: float
+
+        Add the tokens accumulated since the last update
+        """
+        if now > self.updated:
+            self.tokens = min(float(self.rate), self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    def consume(self, now, reserve=0):
+        """
+        :param now: current time from clock.monotonic()
+        :type now: float
+        :param reserve: number of tokens that must be left in the bucket after taking one
+        :type reserve: int
+
+        :return: was a token available
+        :rtype: bool
+
+        Try to take a token from the bucket
+        """
+        self.refill(now)
+        if self.tokens >= 1 + reserve:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self, now, reserve=0):
+        """
+        :param now: current time from clock.monotonic()
+        :type now: float
+        :param reserve: number of tokens that must be left in the bucket after taking one
+        :type reserve: int
+
+        :return: seconds until the next token is available
+        :rtype: float
+        """
+        self.refill(now)
+        if self.tokens >= 1 + reserve:
+            return 0
+        return (1 + reserve - self.tokens) * self.per / self.rate
+
+
+class SendQueue:
+    """
+    Queue for outgoing chat messages. Messages are let through at the rate allowed by the server for the
+    type of the account. Interactive messages always go before automatic ones, and automatic messages may only use
+    the rate limit left over after a reserve kept for interactive messages
+    """
+
+    log = logging.getLogger("mustikkabot.sendqueue")
+
+    # Twitch message limits for different kinds of accounts: (messages, seconds)
+    rates = {
+        "normal": (20, 30),
+        "moderator": (100, 30),
+        "known": (50, 30),
+        "verified": (7500, 30),
+    }
+
+    def __init__(self, account="normal", maxlen=100, automatic_maxlen=10, clock=None):
+        """
+        :param account: type of the bot's account, one of the keys in :attr:rates
+        :type account: str
+        :param maxlen: maximum number of messages waiting to be sent, further messages are dropped
+        :type maxlen: int
+        :param automatic_maxlen: maximum number of automatic messages waiting to be sent
+        :type automatic_maxlen: int
+        :param clock: clock used for the rate limit, defaults to the real clock
+        :type clock: clock.Clock
+        """
+        if account not in self.rates:
+            self.log.warning("Unknown account type '" + str(account) + "', using normal rate limits")
+            account = "normal"
+        self.account = account
+
+        rate, per = self.rates[account]
+        self.bucket = TokenBucket(rate, per, clock)
+        self.reserve = rate // 4        # Tokens that automatic messages can't use
+
+        self.maxlen = maxlen
+        self.automatic_maxlen = automatic_maxlen
+        self.interactive = collections.deque()
+        self.automatic = collections.deque()
+        self.automatic_lines = collections.Counter()
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.interactive) + len(self.automatic)
+
+    def drop(self, reason):
+        """
+        :param reason: description of why the message was dropped
+        :type reason: str
+
+        Count and log a dropped message
+        """
+        self.dropped += 1
+        self.log.warning(reason + ", dropped a message. " + str(len(self)) + " messages in queue, " +
+                         str(self.dropped) + " dropped in total")
+
+    def push(self, line, priority=PRIORITY_INTERACTIVE):
+        """
+        :param line: IRC line to be sent
+        :type line: str
+        :param priority: priority class of the line, PRIORITY_INTERACTIVE or PRIORITY_AUTOMATIC
+        :type priority: int
+
+        :return: was the line queued
+        :rtype: bool
+
+        Queue a line to be sent. An automatic line is dropped if the same line is already waiting or if the queue is
+        under pressure. When the queue is full, an interactive line replaces the oldest automatic one
+        """
+        if priority == PRIORITY_AUTOMATIC:
+            if self.automatic_lines[line] > 0:
+                self.coalesced += 1
+                return False
+            if len(self.automatic) >= self.automatic_maxlen or len(self) >= self.maxlen:
+                self.drop("Send queue under pressure")
+                return False
+            self.automatic.append(line)
+            self.automatic_lines[line] += 1
+            return True
+
+        if len(self) >= self.maxlen:
+            if len(self.automatic) == 0:
+                self.drop("Send queue full")
+                return False
+            self.pop_automatic()
+            self.drop("Send queue full, replaced an automatic message")
+        self.interactive.append(line)
+        return True
+
+    def pop_automatic(self):
+        """
+        :return: the oldest automatic line
+        :rtype: str
+
+        Remove the oldest automatic line from the queue
+        """
+        line = self.automatic.popleft()
+        self.automatic_lines[line] -= 1
+        if self.automatic_lines[line] == 0:
+            del self.automatic_lines[line]
+        return line
+
+    def pop(self, now):
+        """
+        :param now: current time from clock.monotonic()
+        :type now: float
+
+        :return: the next line to send, None if the queue is empty or the rate limit has been reached
+        :rtype: str
+        """
+        if len(self.interactive) > 0:
+            if not self.bucket.consume(now):
+                return None
+            self.sent += 1
+            return self.interactive.popleft()
+
+        if len(self.automatic) > 0:
+            if not self.bucket.consume(now, self.reserve):
+                return None
+            self.sent += 1
+            return self.pop_automatic()
+
+        return None
+
+    def delay(self, now):
+        """
+        :param now: current time from clock.monotonic()
+        :type now: float
+
+        :return: seconds until the next line can be sent, None if there is nothing to send
+        :rtype: float
+        """
+        if len(self.interactive) > 0:
+            return self.bucket.delay(now)
+        if len(self.automatic) > 0:
+            return self.bucket.delay(now, self.reserve)
+        return None
+
+    def stats(self):
+        """
+        :return: number of queued, sent, dropped and coalesced messages
+        :rtype: dict(str: int)
+        """
+        return {"queued": len(self), "sent": self.sent, "dropped": self.dropped, "coalesced": self.coalesced}
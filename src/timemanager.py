@@ -1,5 +1,11 @@
 import logging
 import datetime
+import asyncio
+import heapq
+import itertools
+import threading
+
+from clock import Clock
 
 
 class _TimeEvent:
@@ -13,23 +19,125 @@ class _TimeEvent:
     """ :type: datetime.timedelta"""
 
     next = None
-    """ :type: datetime.datetime"""
+    """ :type: float"""
 
     action = None
     """ :type: method"""
 
+    catchup = None  # "coalesce", "skip" or "burst"
+    """ :type: str"""
+
+    missed = 0
+    """ :type: int"""
+
+    cancelled = False
+    """ :type: bool"""
+
+    seq = 0
+    """ :type: int"""
+
+    blocking = False    # Run the action in the worker pool
+    """ :type: bool"""
+
+    timeout = None
+    """ :type: datetime.timedelta"""
+
+    def __lt__(self, other):
+        return (self.next, self.seq) < (other.next, other.seq)
+
 
 class TimeManager:
     """
-    Class to manage timed events
+    Class to manage timed events. The events are kept in a heap ordered by the time they are due, measured with
+    the monotonic time of a clock so that changes to the wall clock do not affect them. With a
+    :class:clock.SimulatedClock, hours of timed events can be run in an instant with :meth:run_for
     """
 
     log = logging.getLogger("mustikkabot.timemanager")
 
+    catchup_policies = ("coalesce", "skip", "burst")
+
     time_events = []
     """ :type: list of _TimeEvent"""
 
-    def register_once(self, action, delay):
+    loop = None
+    """ :type: asyncio.AbstractEventLoop"""
+
+    handle = None
+    """ :type: asyncio.TimerHandle"""
+
+    workerpool = None
+    """ :type: workerpool.WorkerPool"""
+
+    def __init__(self, clock=None):
+        """
+        :param clock: clock used for timing the events, defaults to the real clock
+        :type clock: clock.Clock
+        """
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+
+        self.time_events = list()       # Heap of events
+        self.actions = dict()           # Events by action, for unregistering
+        self.cancelled = 0              # Number of cancelled events still in the heap
+        self.counter = itertools.count()
+        self.tasks = set()
+        self.lock = threading.RLock()   # Modules may register events from several threads while they are initialized
+        self.loop_thread = None
+
+    def attach_loop(self, loop):
+        """
+        :param loop: the asyncio event loop the bot runs on
+        :type loop: asyncio.AbstractEventLoop
+
+        Schedule the timed events with the timers of the event loop instead of being called from the main loop
+        """
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.rearm()
+
+    def rearm(self):
+        """
+        Set the event loop timer to fire when the next event is due
+        """
+        if self.loop is None:
+            return
+        if threading.get_ident() != self.loop_thread:   # Loop timers may only be touched from the loop thread
+            self.loop.call_soon_threadsafe(self.rearm)
+            return
+
+        deadline = self.next_deadline()
+        if self.handle is not None:
+            if self.handle.when() == deadline:
+                return
+            self.handle.cancel()
+            self.handle = None
+
+        if deadline is not None:
+            self.handle = self.loop.call_at(deadline, self.handle_loop_events)
+
+    def handle_loop_events(self):
+        """
+        Event loop timer callback
+        """
+        self.handle = None
+        self.handle_events()
+
+    def add_event(self, t):
+        """
+        :param t: event to be added
+        :type t: _TimeEvent
+
+        Add an event to the heap
+        """
+        with self.lock:
+            t.seq = next(self.counter)
+            heapq.heappush(self.time_events, t)
+            self.actions.setdefault(t.action, []).append(t)
+        self.rearm()
+
+    def register_once(self, action, delay, blocking=False, timeout=None):
         """
         :param action: function to be executed
         :type action: function
@@ -37,42 +145,72 @@ class TimeManager:
         :param delay: Delay until action
         :type delay: datetime.timedelta
 
+        :param blocking: Does the action block (e.g. on network I/O), in which case it is run in the worker pool
+        :type blocking: bool
+
+        :param timeout: Time after which the results of a blocking action are discarded, defaults to the timeout
+                        of the worker pool
+        :type timeout: datetime.timedelta
+
         Register an event to be executed once
         """
         t = _TimeEvent()
 
         t.type = "once"
-        t.next = datetime.datetime.now() + delay
+        t.next = self.clock.monotonic() + delay.total_seconds()
 
         t.action = action
+        t.blocking = blocking
+        t.timeout = timeout
 
-        self.time_events.append(t)
+        self.add_event(t)
 
-    def register_interval(self, action, interval, delay=None):
+    def register_interval(self, action, interval, delay=None, catchup="coalesce", blocking=False, timeout=None):
         """
         :param action: function to be executed
         :type action: function
 
-        :param interval: Delay between actions
+        :param interval: Delay between actions, must be positive
         :type interval: datetime.timedelta
 
         :param delay: Initial delay before first action
         :type delay: datetime.timedelta
 
+        :param catchup: What to do with ticks missed while the bot was stalled: "coalesce" runs the action once for
+                        all of them, "skip" drops them and waits for the next tick, "burst" runs the action once
+                        for each of them
+        :type catchup: str
+
+        :param blocking: Does the action block (e.g. on network I/O), in which case it is run in the worker pool.
+                         A new run is skipped while the previous one is still going
+        :type blocking: bool
+
+        :param timeout: Time after which the results of a blocking action are discarded, defaults to the timeout
+                        of the worker pool
+        :type timeout: datetime.timedelta
+
         Register an event to be executed at regular intervals
         """
+        if catchup not in self.catchup_policies:
+            raise ValueError("Unknown catch-up policy: " + str(catchup))
+        if interval.total_seconds() <= 0:
+            raise ValueError("Interval of a periodic event must be positive, got " + str(interval))
+
         t = _TimeEvent()
         t.type = "periodic"
+        t.catchup = catchup
 
         if delay:
-            t.next = datetime.datetime.now() + delay
+            t.next = self.clock.monotonic() + delay.total_seconds()
         else:
-            t.next = datetime.datetime.now() + interval
+            t.next = self.clock.monotonic() + interval.total_seconds()
         t.interval = interval
 
         t.action = action
+        t.blocking = blocking
+        t.timeout = timeout
 
-        self.time_events.append(t)
+        self.add_event(t)
 
     def unregister(self, action):
         """
@@ -81,29 +219,176 @@ class TimeManager:
 
         Unregister a timed event to stop it from being executed
         """
-        for_removal = []
-        for te in self.time_events:
-            if te.action == action:
-                for_removal.append(te)
-        for item in for_removal:
-            self.time_events.remove(item)
+        with self.lock:
+            for event in self.actions.pop(action, []):
+                event.cancelled = True
+                self.cancelled += 1
+
+            if self.cancelled > len(self.time_events) // 2:   # Get rid of the cancelled events once they pile up
+                self.time_events = [event for event in self.time_events if not event.cancelled]
+                heapq.heapify(self.time_events)
+                self.cancelled = 0
+
+        self.rearm()
+
+    def next_deadline(self):
+        """
+        :return: Time of the next event to be executed in the monotonic time of the clock, None if there are no
+                 events
+        :rtype: float
+
+        Find out when the next timed event is due, so that the main loop knows how long it can sleep
+        """
+        with self.lock:
+            while len(self.time_events) > 0 and self.time_events[0].cancelled:
+                heapq.heappop(self.time_events)
+                self.cancelled -= 1
+
+            if len(self.time_events) == 0:
+                return None
+            return self.time_events[0].next
 
     def handle_events(self):
         """
         An function to be fired from the main loop at regular intervals
         """
-        for_removal = []
+        now = self.clock.monotonic()
 
-        for event in self.time_events:
-            if event.next < datetime.datetime.now():
+        due = []
+        runs = []
+        with self.lock:
+            while len(self.time_events) > 0 and self.time_events[0].next <= now:
+                event = heapq.heappop(self.time_events)
+                if event.cancelled:
+                    self.cancelled -= 1
+                else:
+                    due.append(event)
+
+            for event in due:
                 if event.type == "periodic":
-                    event.next += event.interval
+                    runs.append((event, self.reschedule(event, now)))
+                else:
+                    self.forget(event)
+                    runs.append((event, 1))
+
+        for event, count in runs:
+            for i in range(count):
+                if event.cancelled:
+                    break
+                if event.blocking and self.workerpool is not None:
+                    self.run_blocking(event)
+                else:
+                    self.run_action(event.action)
+
+        self.rearm()
+
+    def run_for(self, duration):
+        """
+        :param duration: time to advance the clock by
+        :type duration: datetime.timedelta
+
+        Advance a simulated clock event by event, executing every event that becomes due on the way at its
+        exact time. Only usable with a :class:clock.SimulatedClock
+        """
+        end = self.clock.monotonic() + duration.total_seconds()
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > end:
+                break
+            self.clock.advance_to(deadline)
+            self.handle_events()
+        self.clock.advance_to(end)
+
+    def reschedule(self, event, now):
+        """
+        :param event: periodic event that is due
+        :type event: _TimeEvent
+        :param now: current monotonic time of the clock
+        :type now: float
+
+        :return: how many times the action should be run now
+        :rtype: int
+
+        Move a periodic event to its next tick after now and apply its catch-up policy to the ticks that were missed
+        """
+        interval = event.interval.total_seconds()
+        missed = int((now - event.next) // interval)
+
+        event.next += (missed + 1) * interval
+        heapq.heappush(self.time_events, event)
+
+        if missed == 0:
+            return 1
+
+        event.missed += missed
+        self.log.warning("Timed event " + str(event.action) + " missed " + str(missed) + " ticks, catch-up policy: " +
+                         event.catchup)
+        if event.catchup == "burst":
+            return missed + 1
+        elif event.catchup == "skip":
+            return 0
+        return 1
+
+    def missed_ticks(self, action):
+        """
+        :param action: A timed function
+        :type action: function
+
+        :return: number of ticks the periodic events of the action have missed
+        :rtype: int
+        """
+        return sum(event.missed for event in self.actions.get(action, []))
+
+    def forget(self, event):
+        """
+        :param event: event that has been removed from the heap
+        :type event: _TimeEvent
+
+        Remove an event from the events of its action
+        """
+        events = self.actions.get(event.action)
+        if events is not None:
+            events.remove(event)
+            if len(events) == 0:
+                del self.actions[event.action]
+
+    def run_blocking(self, event):
+        """
+        :param event: event with a blocking action
+        :type event: _TimeEvent
+
+        Run the action of a timed event in the worker pool, so that it does not stop the main loop
+        """
+        timeout = event.timeout.total_seconds() if event.timeout is not None else None
+        self.workerpool.submit(event.action, event.action, timeout=timeout)
+
+    def run_action(self, action):
+        """
+        :param action: function to be executed
+        :type action: function
+
+        Execute the action of a timed event. If the action is a coroutine, it is scheduled as a task on the event
+        loop if there is one, and otherwise run to completion
+        """
+        try:
+            result = action()
+            if asyncio.iscoroutine(result):
+                if self.loop is not None:
+                    task = self.loop.create_task(self.await_action(result))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
                 else:
-                    for_removal.append(event)
-                try:
-                    event.action()
-                except:
-                    self.log.exception("Error happened in a timed event")
-
-        for item in for_removal:
-            self.time_events.remove(item)
+                    asyncio.run(result)
+        except:
+            self.log.exception("Error happened in a timed event")
+
+    async def await_action(self, coroutine):
+        """
+        :param coroutine: the coroutine returned by the action
+
+        Wait for a coroutine action to finish and log any errors
+        """
+        try:
+            await coroutine
+        except:
+            self.log.exception("Error happened in a timed event")
@@ -1,6 +1,8 @@
 import os
 import re
 
+_name_re = re.compile(r'![Mm]ustikka[Bb]ot (.*)')
+
 
 def find_basepath():
     """
@@ -22,5 +24,25 @@ def strip_name(text):
     :return: passed text without the name
     :rtype: str
     """
-    text = re.sub(r'![Mm]ustikka[Bb]ot (.*)', r'!\1', text)
-    return text
\ No newline at end of file
+    if "ustikka" not in text:
+        return text     # Fast path for the common case
+    text = _name_re.sub(r'!\1', text)
+    return text
+
+
+def json_classes(*classes):
+    """
+    The modules are imported as mustikkabot.modules.<name>, but data saved by older versions refers to their
+    classes by the bare module name. Map both names to the classes for jsonpickle.decode()
+
+    :param classes: classes stored in the data
+    :type classes: type
+
+    :return: class names mapped to the classes
+    :rtype: dict(str: type)
+    """
+    names = dict()
+    for cls in classes:
+        names[cls.__module__ + "." + cls.__qualname__] = cls
+        names[cls.__module__.rsplit(".", 1)[-1] + "." + cls.__qualname__] = cls
+    return names
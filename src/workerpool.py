@@ -0,0 +1,280 @@
+#
+# Thread pool for running blocking actions outside the main loop
+#
+# Author: Esa Varemo
+#
+
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import queue
+import threading
+
+from clock import Clock
+
+
+class _Job:
+    """
+    Class to represent an action running in the pool
+    """
+
+    key = None
+    """ :type: object"""
+
+    deadline = None
+    """ :type: float"""
+
+    timed_out = False
+    """ :type: bool"""
+
+
+class WorkerPool:
+    """
+    Runs blocking actions (like HTTP requests) on a bounded pool of threads. Anything the actions want to do in the
+    bot, like sending messages, is passed back to the main loop thread through a queue
+    """
+
+    log = logging.getLogger("mustikkabot.workerpool")
+
+    def __init__(self, max_workers=4, max_in_flight=16, timeout=30, clock=None):
+        """
+        :param max_workers: number of threads in the pool
+        :type max_workers: int
+        :param max_in_flight: maximum number of actions running or waiting for a thread at the same time
+        :type max_in_flight: int
+        :param timeout: default number of seconds after which the results of an action are discarded
+        :type timeout: float
+        :param clock: clock used for the timeouts, defaults to the real clock
+        :type clock: clock.Clock
+        """
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+
+        self.executor = None
+        """ :type: concurrent.futures.ThreadPoolExecutor"""
+
+        self.results = queue.SimpleQueue()      # Calls to be made in the main loop thread
+        self.in_flight = dict()                 # key: list of running jobs
+        self.count = 0                          # Total number of running jobs
+        self.waiting = dict()                   # key: deque of (action, args, limit, timeout) waiting for a slot
+        self.local = threading.local()
+
+        self.loop = None
+        """ :type: asyncio.AbstractEventLoop"""
+
+        self.wakeup = None
+        """ :type: function"""
+
+        self.rejected = 0
+        self.queued = 0
+        self.timed_out = 0
+
+    def attach_loop(self, loop):
+        """
+        :param loop: the asyncio event loop the bot runs on
+        :type loop: asyncio.AbstractEventLoop
+
+        Pass the results to the main thread and check the timeouts with the event loop
+        """
+        self.loop = loop
+        self.wakeup = lambda: loop.call_soon_threadsafe(self.handle_results)
+
+    def submit(self, key, action, args=(), limit=1, timeout=None, backlog=0):
+        """
+        :param key: identifies the action for the in-flight limit, e.g. the action itself or the module
+        :param action: function to be executed in the pool
+        :type action: function
+        :param args: arguments for the action
+        :type args: tuple
+        :param limit: maximum number of jobs with the same key running at the same time
+        :type limit: int
+        :param timeout: seconds after which the results of the action are discarded, defaults to :attr:timeout
+        :type timeout: float
+        :param backlog: how many actions with the same key may wait for the running ones to finish, instead of
+                        being skipped
+        :type backlog: int
+
+        :return: was the action started or queued
+        :rtype: bool
+
+        Run an action in the pool. If too many actions are already running, the action waits in the backlog of its
+        key, or is skipped if the backlog is full
+        """
+        waiting = self.waiting.get(key)
+        if waiting is not None or len(self.in_flight.get(key, [])) >= limit or self.count >= self.max_in_flight:
+            if waiting is None:
+                waiting = self.waiting[key] = collections.deque()
+            if len(waiting) < backlog:
+                waiting.append((action, args, limit, timeout))
+                self.queued += 1
+                return True
+            if len(waiting) == 0:
+                del self.waiting[key]
+
+            self.rejected += 1
+            if len(self.in_flight.get(key, [])) >= limit:
+                self.log.warning("Blocking action " + str(action) + " is still running, skipped")
+            else:
+                self.log.warning("Too many blocking actions running, skipped " + str(action))
+            return False
+
+        self.start(key, action, args, timeout)
+        return True
+
+    def start(self, key, action, args, timeout):
+        """
+        :param key: identifies the action for the in-flight limit
+        :param action: function to be executed in the pool
+        :type action: function
+        :param args: arguments for the action
+        :type args: tuple
+        :param timeout: seconds after which the results of the action are discarded, defaults to :attr:timeout
+        :type timeout: float
+
+        Start running an action in the pool
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers,
+                                                                  thread_name_prefix="mustikkabot-worker")
+
+        job = _Job()
+        job.key = key
+        job.deadline = self.clock.monotonic() + (timeout if timeout is not None else self.timeout)
+
+        self.in_flight.setdefault(key, []).append(job)
+        self.count += 1
+
+        self.executor.submit(self.run_job, job, action, args)
+
+        if self.loop is not None:
+            self.loop.call_at(job.deadline, self.check_timeouts)
+
+    def run_job(self, job, action, args):
+        """
+        :param job: the job being run
+        :type job: _Job
+        :param action: function to be executed
+        :type action: function
+        :param args: arguments for the action
+        :type args: tuple
+
+        Run an action in a worker thread. Called by the thread pool
+        """
+        self.local.job = job
+        try:
+            result = action(*args)
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+        except:
+            self.log.exception("Error happened in blocking action " + str(action))
+        finally:
+            self.local.job = None
+            self.results.put((None, self.finish, (job,)))
+            if self.wakeup is not None:
+                self.wakeup()
+
+    def finish(self, job):
+        """
+        :param job: the job that has finished
+        :type job: _Job
+
+        Forget a finished job. Called in the main loop thread
+        """
+        running = self.in_flight.get(job.key)
+        if running is not None and job in running:
+            running.remove(job)
+            self.count -= 1
+            if len(running) == 0:
+                del self.in_flight[job.key]
+            self.start_waiting()
+
+    def start_waiting(self):
+        """
+        Start the actions waiting in the backlogs that fit within the limits, in the order of their keys
+        """
+        for key in list(self.waiting):
+            waiting = self.waiting[key]
+            while len(waiting) > 0 and self.count < self.max_in_flight:
+                action, args, limit, timeout = waiting[0]
+                if len(self.in_flight.get(key, [])) >= limit:
+                    break
+                waiting.popleft()
+                self.start(key, action, args, timeout)
+            if len(waiting) == 0:
+                del self.waiting[key]
+
+    def in_worker(self):
+        """
+        :return: Is the current thread running an action of the pool
+        :rtype: bool
+        """
+        return getattr(self.local, "job", None) is not None
+
+    def call_in_main(self, function, *args):
+        """
+        :param function: function to be called in the main loop thread
+        :type function: function
+
+        Pass a call from a worker thread to be made in the main loop thread. The call is dropped if the action making
+        it has timed out
+        """
+        self.results.put((self.local.job, function, args))
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def handle_results(self):
+        """
+        Make the calls passed from the worker threads. Called in the main loop thread
+        """
+        self.check_timeouts()
+        while True:
+            try:
+                job, function, args = self.results.get_nowait()
+            except queue.Empty:
+                return
+
+            if job is not None and job.timed_out:
+                self.log.debug("Dropped a call from a blocking action that timed out")
+                continue
+            try:
+                function(*args)
+            except:
+                self.log.exception("Error happened while handling the results of a blocking action")
+
+    def check_timeouts(self):
+        """
+        Mark the actions running past their deadline as timed out. The threads can't be stopped, but their results
+        are discarded and they keep counting against the in-flight limits until they finish
+        """
+        now = self.clock.monotonic()
+        for running in self.in_flight.values():
+            for job in running:
+                if not job.timed_out and job.deadline <= now:
+                    job.timed_out = True
+                    self.timed_out += 1
+                    self.log.warning("Blocking action " + str(job.key) + " timed out")
+
+    def next_deadline(self):
+        """
+        :return: monotonic time of the clock of the next timeout, None if nothing is running
+        :rtype: float
+        """
+        deadlines = [job.deadline for running in self.in_flight.values() for job in running if not job.timed_out]
+        if len(deadlines) == 0:
+            return None
+        return min(deadlines)
+
+    def shutdown(self):
+        """
+        Stop the pool without waiting for running actions to finish
+        """
+        self.waiting.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
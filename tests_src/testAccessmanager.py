@@ -1,6 +1,9 @@
+import json
 import os
 
 from accessmanager import AccessManager
+from clock import SimulatedClock
+from timemanager import TimeManager
 import tools
 
 
@@ -20,6 +23,12 @@ class DummyBot:
             os.mkdir(self.datadir)
 
 
+class TimedDummyBot(DummyBot):
+    def __init__(self):
+        super().__init__()
+        self.timemanager = TimeManager(SimulatedClock())
+
+
 class TestAccessmanager():
 
     am = None
@@ -123,6 +132,13 @@ class TestAccessmanager():
         assert self.am.get_group("g1").get_members() == ["b"]
         assert self.am.get_group("g2").get_members() == ["a"]
 
+        for change in [self.am.add_to_group, self.am.remove_from_group]:
+            try:
+                change("g3", "a")
+                assert False
+            except Exception as e:
+                assert str(e) == "Group does not exist"
+
     def test_accessmanager_createacl(self):
         self.am.create_acl("a.b.c.*")
 
@@ -203,7 +219,179 @@ class TestAccessmanager():
         assert self.am.expand_groups(["test", "%operators"]).sort() == ["test", "%operators", "%owner"].sort()
 
     def test_accessmanager_isinacl(self):
-        pass #TODO: Write access tests
+        self.am.add_to_group("%owner", "Owner")
+        self.am.add_to_group("%operators", "op")
+        self.am.add_group("regulars", ["regular%d" % i for i in range(1000)])
+
+        self.am.register_acl("acl1")
+        self.am.register_acl("acl2", ["regulars"], ["User"])
+        self.am.register_acl("acl3", ["%all%"])
+
+        assert self.am.is_in_acl("owner", "acl1")
+        assert self.am.is_in_acl("OP", "acl1")
+        assert self.am.is_in_acl("cli", "acl1")
+        assert not self.am.is_in_acl("regular1", "acl1")
+
+        assert self.am.is_in_acl("user", "acl2")
+        assert self.am.is_in_acl("regular999", "acl2")
+        assert not self.am.is_in_acl("op", "acl2")
+
+        assert self.am.is_in_acl("anyone", "acl3")
+
+        try:
+            self.am.is_in_acl("owner", "nonexistent")
+            assert False
+        except Exception as e:
+            assert str(e) == "ACL does not exist"
 
+    def test_accessmanager_isinacl_changes(self):
+        self.am.add_group("regulars", ["a"])
+        self.am.register_acl("acl", ["regulars"], [])
+        assert self.am.is_in_acl("a", "acl")
 
+        self.am.add_to_group("regulars", "b")
+        self.am.remove_from_group("regulars", "a")
+        assert self.am.is_in_acl("b", "acl")
+        assert not self.am.is_in_acl("a", "acl")
 
+        self.am.add_user_to_acl("acl", "c")
+        self.am.remove_group_from_acl("acl", "regulars")
+        assert self.am.is_in_acl("c", "acl")
+        assert not self.am.is_in_acl("b", "acl")
+
+        self.am.add_group_to_acl("acl", "%moderators")
+        self.am.add_to_group("%moderators", "mod")
+        assert self.am.is_in_acl("mod", "acl")
+
+        self.am.groups = {"%moderators": {"members": []}}        # Replaced as a whole
+        assert not self.am.is_in_acl("mod", "acl")
+
+
+
+
+    def test_accessmanager_writebehind(self):
+        bot = TimedDummyBot()
+        am = AccessManager()
+        am.init(bot)
+        bot.timemanager.run_for(am.flush_delay)
+
+        writes = []
+        write_JSON = am.write_JSON
+
+        def counting_write():
+            writes.append(1)
+            write_JSON()
+        am.write_JSON = counting_write
+
+        for i in range(500):
+            am.register_acl("commands.!" + str(i))
+        am.add_to_group("%moderators", "mod")
+
+        assert len(writes) == 0
+        assert am.dirty
+
+        bot.timemanager.run_for(am.flush_delay)
+
+        assert len(writes) == 1
+        assert not am.dirty
+        assert not os.path.exists(am.jsonpath + ".tmp")
+        with open(am.jsonpath) as file:
+            data = json.load(file)
+        assert len(data["acls"]) == 500
+        assert data["groups"]["%moderators"]["members"] == ["mod"]
+
+        am.remove_acl("commands.!0")
+        am.dispose()                            # Flushes pending changes
+
+        assert len(writes) == 2
+        assert bot.timemanager.next_deadline() is None
+
+    def test_accessmanager_hierarchy(self):
+        self.am.add_group("%vip", ["vip"])
+        self.am.add_group("%subscribers", ["sub"])
+        self.am.add_to_group("%moderators", "mod")
+        self.am.register_acl("subonly", ["%subscribers"], [])
+        assert not self.am.is_in_acl("mod", "subonly")
+
+        self.am.add_group_above("%subscribers", "%vip")
+        self.am.add_group_above("%vip", "%moderators")
+
+        assert self.am.is_in_acl("sub", "subonly")
+        assert self.am.is_in_acl("vip", "subonly")
+        assert self.am.is_in_acl("mod", "subonly")
+        assert self.am.expand_groups("%subscribers") == ["%subscribers", "%moderators", "%operators", "%owner",
+                                                          "%vip"]
+
+        try:
+            self.am.add_group_above("%owner", "%subscribers")
+            assert False
+        except Exception as e:
+            assert "cycle" in str(e)
+        assert self.am.get_groups_above("%owner") == []
+
+        self.am.remove_group_above("%vip", "%moderators")
+        assert not self.am.is_in_acl("mod", "subonly")
+        assert self.am.is_in_acl("vip", "subonly")
+
+    def test_accessmanager_hierarchy_json(self):
+        self.am.add_group_above("%vip", "%moderators")
+        self.am.flush()
+
+        am = AccessManager()
+        # noinspection PyTypeChecker
+        am.init(DummyBot())
+        assert am.hierarchy["%vip"] == ["%moderators"]
+        assert am.hierarchy["%moderators"] == ["%operators"]
+
+        with open(am.jsonpath) as file:
+            data = json.load(file)
+        del data["hierarchy"]
+        with open(am.jsonpath, "w") as file:
+            json.dump(data, file)
+
+        am.read_JSON()
+        assert am.hierarchy == AccessManager.default_hierarchy
+
+        am.hierarchy = {"a": ["b"], "b": ["a"]}
+        assert am.expand_groups("%moderators") == ["%moderators", "%operators", "%owner"]
+        assert am.hierarchy == AccessManager.default_hierarchy
+
+    def test_accessmanager_roles(self):
+        self.am.add_group("%subscribers")
+        self.am.register_acl("modonly")
+        self.am.register_acl("subonly", ["%subscribers"], [])
+
+        assert not self.am.is_in_acl("user", "modonly")
+        assert self.am.is_in_acl("user", "modonly", frozenset(["moderator"]))
+        assert not self.am.is_in_acl("user", "modonly", frozenset(["subscriber"]))
+        assert self.am.is_in_acl("user", "subonly", frozenset(["subscriber", "premium"]))
+        assert self.am.is_in_acl("user", "subonly", frozenset(["broadcaster"]))
+        assert not self.am.is_in_acl("user", "subonly", frozenset())
+        assert "user" not in self.am.user_groups
+
+    def test_accessmanager_bulk(self):
+        self.am.add_group("regulars", ["existing"])
+        self.am.register_acl("acl", ["regulars"], [])
+        assert not self.am.is_in_acl("user4999", "acl")
+
+        path = os.path.join(DummyBot.datadir, "regulars.txt")
+        with open(path, "w") as file:
+            file.write("Existing\n\n")
+            for i in range(5000):
+                file.write("user" + str(i) + "\n")
+            file.write("user0\n")
+
+        assert self.am.import_group("regulars", path) == (5000, 2)
+        assert self.am.is_in_acl("user4999", "acl")
+        assert len(self.am.get_group("regulars").get_members()) == 5001
+
+        assert self.am.export_group("regulars", path) == 5001
+        with open(path) as file:
+            assert file.readline() == "existing\n"
+        os.remove(path)
+
+        try:
+            self.am.add_many_to_group("nonexistent", ["a"])
+            assert False
+        except Exception as e:
+            assert str(e) == "Group does not exist"
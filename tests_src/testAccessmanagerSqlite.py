@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+
+from accessmanager_sqlite import SqliteAccessManager
+from clock import SimulatedClock
+from timemanager import TimeManager
+import tools
+
+
+class DummyBot:
+    basedir = tools.find_basepath()
+    srcdir = os.path.join(basedir, "src")
+
+    datadir = os.path.join(basedir, "data_test")
+
+    def __init__(self):
+        if not os.path.isdir(self.datadir):
+            os.mkdir(self.datadir)
+
+
+class TestSqliteAccessmanager():
+
+    am = None
+
+    def remove_files(self):
+        for name in ["acls.sqlite", "acls.sqlite-wal", "acls.sqlite-shm", "acls.json", "acls.json.migrated"]:
+            path = os.path.join(DummyBot.datadir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def setup(self):
+        self.remove_files()
+        self.am = SqliteAccessManager()
+        # noinspection PyTypeChecker
+        self.am.init(DummyBot())
+
+    def teardown(self):
+        self.am.dispose()
+        self.remove_files()
+
+    def test_sqlite_defaults(self):
+        assert self.am.exists_group("%owner")
+        assert self.am.exists_group("%all%")
+        assert self.am.get_groups_above("%moderators") == ["%operators"]
+
+    def test_sqlite_groups(self):
+        self.am.add_group("g1", ["A", "b"])
+        self.am.add_to_group("g1", "c")
+        self.am.add_to_group("g1", "a")
+        self.am.remove_from_group("g1", "b")
+
+        assert self.am.get_group("g1").get_members() == ["a", "c"]
+        assert self.am.get_group("g2") is None
+        assert self.am.groups["g1"] == {"members": ["a", "c"]}
+
+        for change in [self.am.add_to_group, self.am.remove_from_group]:
+            try:
+                change("g2", "a")
+                assert False
+            except Exception as e:
+                assert str(e) == "Group does not exist"
+        try:
+            self.am.remove_from_group("g1", "b")
+            assert False
+        except ValueError:
+            pass
+        assert "g2" not in self.am.groups
+
+        self.am.remove_group("g1")
+        assert not self.am.exists_group("g1")
+
+    def test_sqlite_isinacl(self):
+        self.am.add_to_group("%owner", "owner")
+        self.am.add_to_group("%operators", "op")
+        self.am.add_group("regulars", ["regular%d" % i for i in range(10000)])
+
+        self.am.register_acl("acl1")
+        self.am.register_acl("acl2", ["regulars"], ["User"])
+        self.am.register_acl("acl3", ["%all%"])
+
+        assert self.am.is_in_acl("owner", "acl1")
+        assert self.am.is_in_acl("op", "acl1")
+        assert not self.am.is_in_acl("regular1", "acl1")
+        assert self.am.is_in_acl("mod", "acl1", frozenset(["moderator"]))
+
+        assert self.am.is_in_acl("user", "acl2")
+        assert self.am.is_in_acl("regular9999", "acl2")
+        assert not self.am.is_in_acl("op", "acl2")
+
+        assert self.am.is_in_acl("anyone", "acl3")
+
+        self.am.remove_group_from_acl("acl2", "regulars")
+        self.am.remove_user_from_acl("acl2", "user")
+        assert not self.am.is_in_acl("regular1", "acl2")
+        assert not self.am.is_in_acl("user", "acl2")
+
+        self.am.remove_acl("acl2")
+        assert not self.am.exists_acl("acl2")
+
+    def test_sqlite_hierarchy(self):
+        self.am.add_group("%vip", ["vip"])
+        self.am.register_acl("viponly", ["%vip"], [])
+        assert not self.am.is_in_acl("mod", "viponly", frozenset(["moderator"]))
+
+        self.am.add_group_above("%vip", "%moderators")
+        assert self.am.is_in_acl("mod", "viponly", frozenset(["moderator"]))
+
+        try:
+            self.am.add_group_above("%owner", "%vip")
+            assert False
+        except Exception as e:
+            assert "cycle" in str(e)
+
+    def test_sqlite_bulk(self):
+        self.am.add_group("regulars", ["existing"])
+        self.am.register_acl("acl", ["regulars"], [])
+
+        path = os.path.join(DummyBot.datadir, "regulars.txt")
+        with open(path, "w") as file:
+            file.write("Existing\n\n")
+            for i in range(5000):
+                file.write("user" + str(i) + "\n")
+            file.write("user0\n")
+
+        assert self.am.import_group("regulars", path) == (5000, 2)
+        assert self.am.is_in_acl("user4999", "acl")
+
+        assert self.am.export_group("regulars", path) == 5001
+        with open(path) as file:
+            assert file.readline() == "existing\n"
+        os.remove(path)
+
+    def test_sqlite_batching(self):
+        self.am.dispose()
+        bot = DummyBot()
+        bot.timemanager = TimeManager(SimulatedClock())
+        self.am = SqliteAccessManager()
+        # noinspection PyTypeChecker
+        self.am.init(bot)
+        bot.timemanager.run_for(self.am.flush_delay)
+
+        for i in range(100):
+            self.am.add_group("group" + str(i), ["a", "b"])
+
+        other = sqlite3.connect(self.am.dbpath)
+        assert other.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 4      # Not committed yet
+
+        bot.timemanager.run_for(self.am.flush_delay)
+        assert other.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 104
+        other.close()
+
+    def test_sqlite_migrate(self):
+        self.am.dispose()
+        self.remove_files()
+
+        data = {"groups": {"%owner": {"members": ["Owner"]}, "regulars": {"members": ["a", "b"]}},
+                "acls": {"acl": {"groups": ["regulars"], "members": ["c"]}},
+                "hierarchy": {"regulars": ["%owner"]}}
+        with open(os.path.join(DummyBot.datadir, "acls.json"), "w") as file:
+            json.dump(data, file)
+
+        self.am = SqliteAccessManager()
+        # noinspection PyTypeChecker
+        self.am.init(DummyBot())
+
+        assert not os.path.exists(os.path.join(DummyBot.datadir, "acls.json"))
+        assert os.path.exists(os.path.join(DummyBot.datadir, "acls.json.migrated"))
+        assert self.am.get_group("regulars").get_members() == ["a", "b"]
+        assert self.am.is_in_acl("a", "acl")
+        assert self.am.is_in_acl("c", "acl")
+        assert self.am.is_in_acl("owner", "acl")
+        assert not self.am.is_in_acl("d", "acl")
+        assert self.am.hierarchy == {"regulars": ["%owner"]}
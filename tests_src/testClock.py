@@ -0,0 +1,70 @@
+import datetime
+
+from clock import Clock, SimulatedClock
+from timemanager import TimeManager
+from modules.commands import Commands, Command
+
+
+class DummyBot:
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent = []
+
+    def send_message(self, msg, priority=None):
+        self.sent.append((self.clock.now(), msg))
+
+
+class TestClock():
+
+    def test_clock_real(self):
+        clock = Clock()
+
+        assert clock.monotonic() <= clock.monotonic()
+        assert abs(clock.now() - datetime.datetime.now()) < datetime.timedelta(seconds=1)
+
+    def test_clock_simulated(self):
+        start = datetime.datetime(2015, 6, 18, 12, 0)
+        clock = SimulatedClock(start)
+
+        assert clock.now() == start
+        clock.advance(datetime.timedelta(hours=2))
+        assert clock.monotonic() == 7200
+        assert clock.now() == datetime.datetime(2015, 6, 18, 14, 0)
+
+        clock.advance_to(0)                         # Never moves backwards
+        assert clock.monotonic() == 7200
+
+    def test_timemanager_run_for(self):
+        clock = SimulatedClock()
+        tm = TimeManager(clock)
+        ticks = []
+
+        def tick():
+            ticks.append(clock.monotonic())
+
+        tm.register_interval(tick, datetime.timedelta(minutes=1))
+        tm.register_once(lambda: ticks.append("once"), datetime.timedelta(seconds=90))
+        tm.run_for(datetime.timedelta(hours=10))
+
+        assert len(ticks) == 601
+        assert ticks[:3] == [60, "once", 120]
+        assert ticks[-1] == 36000
+        assert tm.missed_ticks(tick) == 0
+        assert clock.monotonic() == 36000
+
+    def test_commands_repeat_simulated(self):
+        clock = SimulatedClock(datetime.datetime(2015, 6, 18, 12, 0))
+        bot = DummyBot(clock)
+        tm = TimeManager(clock)
+
+        bot.timemanager = tm
+
+        commands = Commands()
+        commands.bot = bot
+        commands.commands = [Command("hello", "Hello!", repeat=True, repeat_minutes=30)]
+        commands.schedule_repeats()
+
+        tm.run_for(datetime.timedelta(hours=2))
+
+        times = [sent[0].strftime("%H:%M:%S") for sent in bot.sent]
+        assert times == ["12:00:10", "12:30:10", "13:00:10", "13:30:10"]
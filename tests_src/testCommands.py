@@ -0,0 +1,146 @@
+import datetime
+import os
+import shutil
+
+from clock import SimulatedClock
+from eventmanager import EventManager
+from timemanager import TimeManager
+from modules.commands import Commands
+import tools
+
+
+class DummyAccessManager:
+    def register_acl(self, acl, default_groups=None, default_members=None):
+        pass
+
+    def remove_acl(self, acl):
+        pass
+
+    def is_in_acl(self, user, acl, roles=None):
+        return True
+
+
+class DummyBot:
+    basedir = tools.find_basepath()
+    datadir = os.path.join(basedir, "data_test")
+
+    def __init__(self):
+        self.clock = SimulatedClock(datetime.datetime(2015, 6, 18, 12, 0))
+        self.eventmanager = EventManager()
+        self.timemanager = TimeManager(self.clock)
+        self.accessmanager = DummyAccessManager()
+        self.sent = []
+        self.sent_at = []
+
+    def send_message(self, msg, priority=None):
+        self.sent.append(msg)
+        self.sent_at.append((self.clock.now().strftime("%H:%M:%S"), msg))
+
+
+class TestCommands():
+
+    def setup(self):
+        if os.path.exists(DummyBot.datadir):
+            shutil.rmtree(DummyBot.datadir)
+        os.makedirs(DummyBot.datadir)
+        self.bot = DummyBot()
+        self.commands = Commands()
+        # noinspection PyTypeChecker
+        self.commands.init(self.bot)
+
+    def teardown(self):
+        self.commands.dispose()
+        shutil.rmtree(DummyBot.datadir)
+
+    def say(self, text):
+        self.bot.eventmanager.handle_message(":user!user@host PRIVMSG #channel :" + text)
+
+    def test_commands_index(self):
+        for i in range(30):
+            self.say("!commands add cmd" + str(i) + " text " + str(i))
+        self.say("!commands add Hello Hello!")
+        self.bot.sent.clear()
+
+        self.say("!cmd29")
+        self.say("!hello")
+        self.say("!HELLO")
+        self.say("!nothing")
+        assert self.bot.sent == ["text 29", "Hello!", "Hello!"]
+        assert [command.name for command in self.commands.commands[:2]] == ["cmd0", "cmd1"]
+
+        self.say("!commands add hello lower")
+        self.bot.sent.clear()
+        self.say("!hello")
+        self.say("!HeLLo")
+        assert self.bot.sent == ["lower", "Hello!"]     # Exact match first, then the first one added
+
+        self.say("!commands remove Hello")
+        self.bot.sent.clear()
+        self.say("!HeLLo")
+        assert self.bot.sent == ["lower"]
+        assert not self.commands.does_command_exist("Hello")
+        assert self.commands.aliases["hello"] == [self.commands.get_command_by_name("hello")]
+
+        self.say("!commands remove hello")
+        assert self.commands.find_command("HELLO") is None
+        assert "hello" not in self.commands.aliases
+
+    def test_commands_index_load(self):
+        self.say("!commands add hello Hello!")
+        self.commands.commands = []
+        self.commands.index_commands()
+        assert self.commands.find_command("hello") is None
+
+        self.say("!commands load")
+        assert self.commands.find_command("HELLO").value == "Hello!"
+
+    def test_commands_repeat_time(self):
+        for name in ["a", "b", "c"]:
+            self.say("!commands add " + name + " " + name.upper())
+            self.say("!commands setrepeat " + name + " 7")
+        self.bot.sent_at.clear()
+
+        self.bot.timemanager.run_for(datetime.timedelta(minutes=15))
+        assert self.bot.sent_at == [("12:00:10", "A"), ("12:00:10", "B"), ("12:00:10", "C"),
+                                    ("12:07:10", "A"), ("12:07:10", "B"), ("12:07:10", "C"),
+                                    ("12:14:10", "A"), ("12:14:10", "B"), ("12:14:10", "C")]
+
+        self.say("!commands setrepeat b 0")
+        self.say("!commands remove c")
+        self.bot.sent_at.clear()
+        self.bot.timemanager.run_for(datetime.timedelta(minutes=10))
+        assert self.bot.sent_at == [("12:21:10", "A")]
+
+    def test_commands_repeat_lines(self):
+        self.say("!commands add a A")
+        self.say("!commands setrepeat a 0 5")
+        self.bot.timemanager.run_for(datetime.timedelta(seconds=10))
+        self.bot.sent.clear()
+
+        for i in range(4):
+            self.say("line")
+        self.bot.timemanager.run_for(datetime.timedelta(minutes=30))
+        assert self.bot.sent == []
+        self.say("line")
+        assert self.bot.sent == ["A"]       # Shown right away on the line
+        assert self.bot.timemanager.next_deadline() is None     # Nothing runs while waiting for lines
+
+        self.say("!commands setrepeat a 2 3")
+        self.bot.sent.clear()
+        for i in range(3):
+            self.say("line")
+        assert self.bot.sent == []          # Enough lines, but not enough time
+        self.bot.timemanager.run_for(datetime.timedelta(minutes=2))
+        assert self.bot.sent == ["A"]
+
+    def test_commands_repeat_budget(self):
+        for i in range(5):
+            self.say("!commands add c" + str(i) + " C" + str(i))
+            self.say("!commands setrepeat c" + str(i) + " 1")
+        self.bot.sent_at.clear()
+
+        self.bot.timemanager.run_for(datetime.timedelta(minutes=3))
+        # 3 messages a minute, the commands take turns
+        assert self.bot.sent_at == [("12:00:10", "C0"), ("12:00:10", "C1"), ("12:00:10", "C2"),
+                                    ("12:01:10", "C3"), ("12:01:10", "C4"), ("12:01:10", "C0"),
+                                    ("12:02:10", "C1"), ("12:02:10", "C2"), ("12:02:10", "C3")]
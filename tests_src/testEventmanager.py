@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+from eventmanager import EventManager
+from workerpool import WorkerPool
+
+
+class DummyModule:
+    def __init__(self):
+        self.received = []
+
+    def handle_message(self, message):
+        self.received.append((message.nick, message.text))
+
+
+class SpecialDummyModule:
+    def __init__(self):
+        self.received = []
+
+    def handle_special(self, message):
+        self.received.append((message.verb, message.params))
+
+
+class AsyncDummyModule(DummyModule):
+    async def handle_message(self, message):
+        await asyncio.sleep(0)
+        self.received.append((message.nick, message.text))
+
+
+class TestEventmanager():
+
+    def setup(self):
+        self.em = EventManager()
+
+    def test_eventmanager_message(self):
+        module = DummyModule()
+        self.em.register_message(module)
+
+        self.em.handle_message(":user!user@host PRIVMSG #channel :!test message")
+        self.em.handle_message("invalid")
+
+        assert module.received == [("user", "!test message")]
+
+        self.em.unregister_message(module)
+        self.em.handle_message(":user!user@host PRIVMSG #channel :!test message")
+
+        assert len(module.received) == 1
+
+    def test_eventmanager_routing(self):
+        routed = DummyModule()
+        everything = DummyModule()
+        self.em.register_message(routed, ["!time", "!Quote"])
+        self.em.register_message(everything)
+
+        self.em.handle_message(":user!user@host PRIVMSG #channel :!time now")
+        self.em.handle_message(":user!user@host PRIVMSG #channel :!quote 1")
+        self.em.handle_message(":user!user@host PRIVMSG #channel :just chatting")
+        self.em.handle_message(":user!user@host PRIVMSG #channel :!mustikkabot time")
+
+        assert routed.received == [("user", "!time now"), ("user", "!quote 1"), ("user", "!mustikkabot time")]
+        assert len(everything.received) == 4
+
+        self.em.unregister_message(routed)
+        self.em.handle_message(":user!user@host PRIVMSG #channel :!time now")
+
+        assert len(routed.received) == 3
+        assert self.em.message_routes == {}
+
+    def test_eventmanager_routing_no_duplicates(self):
+        module = DummyModule()
+        self.em.register_message(module, ["!time"])
+        self.em.register_message(module)
+
+        self.em.handle_message(":user!user@host PRIVMSG #channel :!time")
+
+        assert len(module.received) == 1
+
+    def test_eventmanager_prefix_routing(self):
+        prefixed = DummyModule()
+        self.em.register_message(prefixed, ["mustikkabot*", "mustikkabot:"])
+
+        for text in ["mustikkabot hi", "MustikkaBot! hi", "mustikkabot? hi", "mustikkabot: hi", "mustikka hi"]:
+            self.em.handle_message(":user!user@host PRIVMSG #channel :" + text)
+
+        assert [text for nick, text in prefixed.received] == ["mustikkabot hi", "MustikkaBot! hi", "mustikkabot? hi",
+                                                              "mustikkabot: hi"]
+
+        self.em.unregister_message(prefixed)
+        assert self.em.message_prefixes == []
+
+    def test_eventmanager_special_routing(self):
+        ping = SpecialDummyModule()
+        membership = SpecialDummyModule()
+        everything = SpecialDummyModule()
+        self.em.register_special(ping, ["PING"])
+        self.em.register_special(membership, ["join", "PART", "353"])
+        self.em.register_special(everything)
+
+        self.em.handle_line("PING :tmi.twitch.tv")
+        self.em.handle_line(":a!a@a.tmi.twitch.tv JOIN #channel")
+        self.em.handle_line(":bot.tmi.twitch.tv 353 bot = #channel :a b c")
+        self.em.handle_line(":tmi.twitch.tv CLEARCHAT #channel :a")
+
+        assert ping.received == [("PING", ["tmi.twitch.tv"])]
+        assert membership.received == [("JOIN", ["#channel"]), ("353", ["bot", "=", "#channel", "a b c"])]
+        assert len(everything.received) == 4
+
+        self.em.unregister_special(membership)
+        self.em.handle_line(":a!a@a.tmi.twitch.tv PART #channel")
+
+        assert len(membership.received) == 2
+        assert "PART" not in self.em.special_routes
+
+    def test_eventmanager_handle_line(self):
+        messages = DummyModule()
+        specials = SpecialDummyModule()
+        self.em.register_message(messages)
+        self.em.register_special(specials)
+
+        self.em.handle_line(":user!user@host PRIVMSG #channel :hello")
+        self.em.handle_line("PING :tmi.twitch.tv")
+
+        assert messages.received == [("user", "hello")]
+        assert specials.received == [("PING", ["tmi.twitch.tv"])]
+
+    def test_eventmanager_coroutine_sync(self):
+        module = AsyncDummyModule()
+        self.em.register_message(module)
+
+        self.em.handle_message(":user!user@host PRIVMSG #channel :hello")
+
+        assert module.received == [("user", "hello")]
+
+    def test_eventmanager_coroutine_loop(self):
+        slow = AsyncDummyModule()
+        fast = DummyModule()
+        self.em.register_message(slow)
+        self.em.register_message(fast)
+
+        async def run():
+            self.em.attach_loop(asyncio.get_running_loop())
+            self.em.handle_message(":user!user@host PRIVMSG #channel :hello")
+
+            assert slow.received == []          # Scheduled as a task, did not block the other module
+            assert fast.received == [("user", "hello")]
+
+            await asyncio.gather(*self.em.tasks)
+
+        asyncio.run(run())
+
+        assert slow.received == [("user", "hello")]
+
+    def test_eventmanager_blocking(self):
+        self.em.workerpool = WorkerPool()
+        module = DummyModule()
+        self.em.register_message(module, ["!slow"], blocking=True)
+
+        self.em.handle_message(":user!user@host PRIVMSG #channel :!slow request")
+        for i in range(200):
+            if self.em.workerpool.count == 0:
+                break
+            time.sleep(0.01)
+            self.em.workerpool.handle_results()
+
+        assert module.received == [("user", "!slow request")]
+
+        self.em.unregister_message(module)
+        assert self.em.blocking == []
+        self.em.workerpool.shutdown()
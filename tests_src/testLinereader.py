@@ -0,0 +1,52 @@
+import socket
+
+from linereader import LineReader
+
+
+class TestLinereader():
+
+    def test_linereader_complete_lines(self):
+        reader = LineReader()
+
+        assert reader.feed(b"PING :tmi.twitch.tv\r\n:a!a@a PRIVMSG #b :c\r\n") == ["PING :tmi.twitch.tv",
+                                                                                 ":a!a@a PRIVMSG #b :c"]
+        assert reader.length == 0
+
+    def test_linereader_partial_lines(self):
+        reader = LineReader()
+
+        assert reader.feed(b":a!a@a PRIVMSG #b :hel") == []
+        assert reader.feed(b"lo\r") == []
+        assert reader.feed(b"\n:a!a@a PRIVMSG #b :wor") == [":a!a@a PRIVMSG #b :hello"]
+        assert reader.feed(b"ld\r\n") == [":a!a@a PRIVMSG #b :world"]
+
+    def test_linereader_split_utf8(self):
+        reader = LineReader()
+        data = "PRIVMSG #b :mäkitupa\r\n".encode("utf-8")
+        split = data.index(b"\xa4")      # Split in the middle of the two-byte character
+
+        assert reader.feed(data[:split]) == []
+        assert reader.feed(data[split:]) == ["PRIVMSG #b :mäkitupa"]
+
+    def test_linereader_small_buffer(self):
+        reader = LineReader(size=16)
+
+        assert reader.feed(b"aaaa\r\nbbbb\r\ncccc\r\ndddd\r\n") == ["aaaa", "bbbb", "cccc", "dddd"]
+
+    def test_linereader_socket(self):
+        a, b = socket.socketpair()
+        b.setblocking(0)
+        reader = LineReader(size=64)
+
+        assert reader.read_from(b) == []
+
+        lines = ["line number " + str(i) for i in range(100)]
+        a.sendall(("\r\n".join(lines) + "\r\nunfinished").encode("utf-8"))
+        assert reader.read_from(b) == lines
+
+        a.sendall(b" line\r\n")
+        a.close()
+        assert reader.read_from(b) == ["unfinished line"]
+        assert reader.read_from(b) is None
+
+        b.close()
@@ -0,0 +1,85 @@
+import marshal
+
+from message import Message
+
+
+class TestMessage():
+
+    def test_message_privmsg(self):
+        message = Message(":user!user@user.tmi.twitch.tv PRIVMSG #channel :!quote add  some text")
+
+        assert message.is_privmsg()
+        assert message.prefix == "user!user@user.tmi.twitch.tv"
+        assert message.nick == "user"
+        assert message.verb == "PRIVMSG"
+        assert message.channel == "#channel"
+        assert message.text == "!quote add  some text"
+        assert message.args == ["!quote", "add", "some", "text"]
+        assert message.command == "!quote"
+
+    def test_message_strip_name(self):
+        message = Message(":user!user@host PRIVMSG #channel :!MustikkaBot time")
+
+        assert message.text == "!MustikkaBot time"
+        assert message.args == ["!time"]
+        assert message.command == "!time"
+
+    def test_message_rest(self):
+        message = Message(":user!user@host PRIVMSG #channel :!MustikkaBot say  two  spaces   kept ")
+
+        assert message.rest(1) == "two  spaces   kept "
+        assert message.rest(3) == "kept "
+        assert message.rest(4) == ""
+
+    def test_message_empty_text(self):
+        message = Message(":user!user@host PRIVMSG #channel :")
+
+        assert message.is_privmsg()
+        assert message.args == []
+        assert message.command == ""
+
+    def test_message_special(self):
+        ping = Message("PING :tmi.twitch.tv")
+        names = Message(":bot.tmi.twitch.tv 353 bot = #channel :a b c")
+
+        assert ping.verb == "PING"
+        assert ping.params == ["tmi.twitch.tv"]
+        assert not ping.is_privmsg()
+
+        assert names.nick == "bot.tmi.twitch.tv"
+        assert names.verb == "353"
+        assert names.params == ["bot", "=", "#channel", "a b c"]
+        assert names.text is None
+
+    def test_message_invalid(self):
+        assert not Message("invalid").is_privmsg()
+        assert not Message("tmi.twitch.tv PRIVMSG #channel :text").is_privmsg()
+
+    def test_message_tags(self):
+        message = Message("@badge-info=subscriber/8;badges=moderator/1,subscriber/6;color=#FF0000;display-name=User;"
+                          "mod=1;submod=0;subscriber=1 :user!user@user.tmi.twitch.tv PRIVMSG #channel :!time")
+
+        assert message.is_privmsg()
+        assert message.command == "!time"
+        assert message.tag("badges") == "moderator/1,subscriber/6"
+        assert message.tag("display-name") == "User"
+        assert message.tag("mod") == "1"
+        assert message.tag("subscriber") == "1"
+        assert message.tag("info") is None
+        assert message.tag("turbo") is None
+        assert message.roles == {"moderator", "subscriber"}
+
+    def test_message_roles(self):
+        assert Message("@badges=broadcaster/1 :u!u@h PRIVMSG #c :hi").roles == {"broadcaster"}
+        assert Message("@badges=;mod=1 :u!u@h PRIVMSG #c :hi").roles == {"moderator"}
+        assert Message("@badges=;mod=0;subscriber=0 :u!u@h PRIVMSG #c :hi").roles == set()
+        assert Message(":u!u@h PRIVMSG #c :hi").roles == set()
+
+    def test_message_tuple(self):
+        message = Message("@badges=vip/1 :user!user@host PRIVMSG #channel :!quote 12")
+        values = message.to_tuple()
+        copy = Message.from_tuple(marshal.loads(marshal.dumps(values)))
+        assert copy.to_tuple() == values
+        assert copy.args == ["!quote", "12"]
+        assert copy.command == "!quote"
+        assert copy.roles == {"vip"}
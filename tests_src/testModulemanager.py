@@ -0,0 +1,296 @@
+import os
+import shutil
+import sys
+import time
+
+from eventmanager import EventManager
+from modulemanager import ModuleManager
+from timemanager import TimeManager
+import tools
+
+
+MODULE = '''
+class Lazytest:
+    received = []
+
+    def init(self, bot):
+        self.bot = bot
+        bot.eventmanager.register_message(self, ["!lazy"])
+
+    def dispose(self):
+        self.bot.eventmanager.unregister_message(self)
+
+    def handle_message(self, message):
+        self.received.append(message.text)
+'''
+
+ORDERED = '''
+import time
+
+
+class {name}:
+    dependencies = {dependencies}
+
+    def init(self, bot):
+        time.sleep({delay})
+        bot.initialized.append("{module}")
+'''
+
+STATEFUL = '''
+class Statetest:
+    version = {version}
+
+    def __init__(self):
+        self.counter = 0
+        self.loaded_from_disk = False
+
+    def init(self, bot):
+        self.bot = bot
+        if self.counter == 0:
+            self.loaded_from_disk = True
+        bot.eventmanager.register_message(self, ["!state"])
+
+    def dispose(self):
+        self.bot.eventmanager.unregister_message(self)
+
+    def export_state(self):
+        return self.counter
+
+    def import_state(self, state):
+        self.counter = state
+
+    def handle_message(self, message):
+        self.counter += self.version
+'''
+
+
+class DummyBot:
+    basedir = tools.find_basepath()
+    datadir = os.path.join(basedir, "data_test")
+    srcdir = os.path.join(datadir, "src")
+
+    def __init__(self, lazy):
+        self.options = {"lazy_modules": "yes" if lazy else "no"}
+        self.eventmanager = EventManager()
+        self.timemanager = TimeManager()
+        self.initialized = []
+        self.readers = dict()
+
+    def add_reader(self, fileobj, callback):
+        self.readers[fileobj] = callback
+
+    def remove_reader(self, fileobj):
+        del self.readers[fileobj]
+
+
+class TestModulemanager():
+
+    def setup(self):
+        if os.path.exists(DummyBot.datadir):
+            shutil.rmtree(DummyBot.datadir)
+        for directory in ["core_modules", "modules", "modules_enabled"]:
+            os.makedirs(os.path.join(DummyBot.srcdir, directory))
+        with open(os.path.join(DummyBot.srcdir, "modules_enabled", "lazytest.py"), "w") as file:
+            file.write(MODULE)
+
+    def write_ordered(self, module, dependencies, delay=0):
+        with open(os.path.join(DummyBot.srcdir, "modules_enabled", module + ".py"), "w") as file:
+            file.write(ORDERED.format(name=module.capitalize(), module=module, dependencies=dependencies,
+                                      delay=delay))
+
+    def teardown(self):
+        for module in ["lazytest", "slowa", "slowb", "after", "cyclea", "cycleb", "statetest", "avail", "time"]:
+            sys.modules.pop(ModuleManager.module_package + "." + module, None)
+        shutil.rmtree(DummyBot.datadir)
+
+    def test_modulemanager_load(self):
+        bot = DummyBot(lazy=False)
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(bot)
+
+        assert type(mm.get_module("lazytest")).__name__ == "Lazytest"
+        assert mm.manifest["lazytest"]["commands"] == ["!lazy"]
+        assert not mm.manifest["lazytest"]["timers"]
+
+        bot.eventmanager.handle_message(":user!user@host PRIVMSG #channel :!lazy one")
+        assert mm.get_module("lazytest").received == ["!lazy one"]
+        mm.dispose()
+
+    def test_modulemanager_lazy(self):
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(DummyBot(lazy=True))      # Not in the manifest yet, loaded normally
+        mm.dispose()
+        sys.modules.pop(ModuleManager.module_package + ".lazytest")
+
+        bot = DummyBot(lazy=True)
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(bot)
+
+        assert "lazytest" in mm.deferred
+        assert ModuleManager.module_package + ".lazytest" not in sys.modules
+        assert mm.is_module_enabled("lazytest")
+
+        bot.eventmanager.handle_message(":user!user@host PRIVMSG #channel :!other")
+        assert ModuleManager.module_package + ".lazytest" not in sys.modules
+
+        bot.eventmanager.handle_message(":user!user@host PRIVMSG #channel :!lazy two")
+        module = mm.modules["lazytest"]
+        assert mm.deferred == {}
+        assert module.received == ["!lazy two"]
+
+        bot.eventmanager.handle_message(":user!user@host PRIVMSG #channel :!lazy three")
+        assert module.received == ["!lazy two", "!lazy three"]
+        assert bot.eventmanager.message_routes["!lazy"] == [module]
+        mm.dispose()
+
+    def test_modulemanager_lazy_changed(self):
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(DummyBot(lazy=True))
+        mm.dispose()
+
+        mm.manifest["lazytest"]["mtime"] -= 1      # Module changed since it was recorded
+        mm.write_manifest()
+
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(DummyBot(lazy=True))
+        assert mm.deferred == {}
+        mm.dispose()
+
+    def test_modulemanager_dependencies(self):
+        self.write_ordered("slowa", "()", delay=0.3)
+        self.write_ordered("slowb", "('eventmanager',)", delay=0.3)
+        self.write_ordered("after", "('slowa', 'slowb')")
+
+        bot = DummyBot(lazy=False)
+        mm = ModuleManager()
+        start = time.perf_counter()
+        # noinspection PyTypeChecker
+        mm.init(bot)
+
+        assert time.perf_counter() - start < 0.55     # The slow modules were initialized at the same time
+        assert sorted(bot.initialized[:2]) == ["slowa", "slowb"]
+        assert bot.initialized[2] == "after"
+        assert mm.init_times["slowa"] >= 0.3
+        mm.dispose()
+
+    def test_modulemanager_dependencies_cycle(self):
+        self.write_ordered("cyclea", "('cycleb',)")
+        self.write_ordered("cycleb", "('cyclea',)")
+
+        bot = DummyBot(lazy=False)
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(bot)
+
+        assert sorted(bot.initialized) == ["cyclea", "cycleb"]
+        assert len(mm.init_times) == 3
+        mm.dispose()
+
+    def write_stateful(self, version):
+        with open(os.path.join(DummyBot.srcdir, "modules_enabled", "statetest.py"), "w") as file:
+            file.write(STATEFUL.format(version=version))
+
+    def test_modulemanager_reload(self):
+        self.write_stateful(1)
+        bot = DummyBot(lazy=False)
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(bot)
+
+        bot.eventmanager.handle_message(":user!user@host PRIVMSG #channel :!state")
+        old = mm.get_module("statetest")
+        assert old.counter == 1
+
+        self.write_stateful(10)
+        assert mm.reload_module("statetest")
+        new = mm.get_module("statetest")
+        assert new is not old
+        assert new.counter == 1
+        assert not new.loaded_from_disk
+
+        bot.eventmanager.handle_message(":user!user@host PRIVMSG #channel :!state")
+        assert new.counter == 11
+        assert old.counter == 1
+        assert bot.eventmanager.message_routes["!state"] == [new]
+
+        with open(os.path.join(DummyBot.srcdir, "modules_enabled", "statetest.py"), "w") as file:
+            file.write("class Statetest(:\n")
+        assert not mm.reload_module("statetest")       # Broken code, the old version keeps running
+        assert mm.get_module("statetest") is new
+        mm.dispose()
+
+    def test_modulemanager_catalogue(self):
+        with open(os.path.join(DummyBot.srcdir, "core_modules", "core.py"), "w") as file:
+            file.write("class Core:\n    pass\n")
+        bot = DummyBot(lazy=False)
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(bot)
+
+        assert mm.get_available_modules() == ["lazytest"]
+        assert mm.catalogue["lazytest"].enabled
+        assert mm.is_core_module("core")
+        assert not mm.is_core_module("lazytest")
+
+        with open(os.path.join(DummyBot.srcdir, "modules", "avail.py"), "w") as file:
+            file.write("class Avail:\n    pass\n")
+        assert mm.get_available_modules() == ["lazytest"]      # Not seen until the directories are scanned again
+        mm.rescan()
+        assert mm.get_available_modules() == ["avail", "lazytest"]
+        assert not mm.catalogue["avail"].enabled
+
+        mm.enable_module("avail")
+        assert mm.catalogue["avail"].enabled
+        assert mm.module_path("avail") == os.path.join(DummyBot.srcdir, "modules_enabled", "avail.py")
+        mm.disable_module("avail")
+        assert not mm.catalogue["avail"].enabled
+        assert mm.module_path("avail") == os.path.join(DummyBot.srcdir, "modules", "avail.py")
+        mm.dispose()
+
+    def test_modulemanager_watch(self):
+        path = os.path.join(DummyBot.srcdir, "modules", "statetest.py")
+        with open(path, "w") as file:
+            file.write(STATEFUL.format(version=1))
+        os.symlink(path, os.path.join(DummyBot.srcdir, "modules_enabled", "statetest.py"))
+        bot = DummyBot(lazy=False)
+        bot.options["watch_modules"] = "yes"
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(bot)
+
+        if mm.watcher.fd is None:
+            mm.dispose()
+            return      # No inotify here, the polling is covered by testModulewatcher
+
+        assert list(bot.readers) == [mm.watcher.fd]
+        assert bot.timemanager.next_deadline() is None      # Nothing to poll, the bot can sleep
+        old = mm.get_module("statetest")
+
+        with open(path, "w") as file:
+            file.write(STATEFUL.format(version=10))
+        bot.readers[mm.watcher.fd](None)
+        assert mm.get_module("statetest") is not old
+        assert mm.get_module("statetest").version == 10
+
+        mm.dispose()
+        assert bot.readers == {}
+
+    def test_modulemanager_stdlib_name(self):
+        with open(os.path.join(DummyBot.srcdir, "modules_enabled", "time.py"), "w") as file:
+            file.write("class Time:\n    pass\n")
+        bot = DummyBot(lazy=False)
+        mm = ModuleManager()
+        # noinspection PyTypeChecker
+        mm.init(bot)
+
+        assert type(mm.get_module("time")).__module__ == "mustikkabot.modules.time"
+        assert sys.modules["time"] is time      # The standard library module is left alone
+        assert not hasattr(time, "Time")
+        assert mm.reload_module("time")
+        assert not hasattr(time, "Time")
+        mm.dispose()
@@ -0,0 +1,130 @@
+import os
+import select
+import shutil
+import time
+
+from clock import Clock
+from eventmanager import EventManager
+from moduleprocess import FrameReader, ProcessModule, encode_frame
+from timemanager import TimeManager
+import tools
+
+
+MODULE = '''
+import os
+
+
+class Echo:
+    def init(self, bot):
+        self.bot = bot
+        bot.accessmanager.register_acl("!echo", default_groups=["%moderators"])
+        bot.eventmanager.register_message(self, ["!echo", "!exit"])
+
+    def handle_message(self, message):
+        if message.command == "!exit":
+            os._exit(1)
+        allowed = self.bot.accessmanager.is_in_acl(message.nick, "!echo", message.roles)
+        self.bot.send_message(" ".join(message.args[1:]) + " " + str(allowed))
+'''
+
+
+class DummyAccessManager:
+    def __init__(self):
+        self.acls = dict()
+
+    def register_acl(self, acl, default_groups=None):
+        self.acls[acl] = default_groups
+
+    def is_in_acl(self, user, acl, roles=None):
+        return "moderator" in roles
+
+
+class DummyBot:
+    basedir = tools.find_basepath()
+    datadir = os.path.join(basedir, "data_test")
+    srcdir = os.path.join(basedir, "src")
+
+    def __init__(self):
+        self.options = dict()
+        self.clock = Clock()
+        self.eventmanager = EventManager()
+        self.timemanager = TimeManager(self.clock)
+        self.accessmanager = DummyAccessManager()
+        self.readers = dict()
+        self.sent = []
+
+    def add_reader(self, fileobj, callback):
+        self.readers[fileobj] = callback
+
+    def remove_reader(self, fileobj):
+        del self.readers[fileobj]
+
+    def send_message(self, msg, priority=None):
+        self.sent.append(msg)
+
+    def run_until(self, condition, timeout=10):
+        end = time.monotonic() + timeout
+        while not condition() and time.monotonic() < end:
+            readable, writable, failed = select.select(list(self.readers), [], [], 0.05)
+            for fileobj in readable:
+                self.readers[fileobj]()
+            self.timemanager.handle_events()
+        return condition()
+
+
+class TestModuleprocess():
+
+    def setup(self):
+        if os.path.exists(DummyBot.datadir):
+            shutil.rmtree(DummyBot.datadir)
+        os.makedirs(DummyBot.datadir)
+        self.path = os.path.join(DummyBot.datadir, "echo.py")
+        with open(self.path, "w") as file:
+            file.write(MODULE)
+
+    def teardown(self):
+        shutil.rmtree(DummyBot.datadir)
+
+    def test_moduleprocess_frames(self):
+        data = encode_frame(("message", ("raw", None, ["a", "b"]))) + encode_frame(("ping",))
+        reader = FrameReader()
+        assert reader.feed(data[:3]) == []
+        assert reader.feed(data[3:10]) == []
+        assert reader.feed(data[10:]) == [("message", ("raw", None, ["a", "b"])), ("ping",)]
+        assert reader.buffer == bytearray()
+
+    def test_moduleprocess(self):
+        bot = DummyBot()
+        module = type("ProcessEcho", (ProcessModule,), {})(None, "echo", self.path)
+        module.restart_delay = module.delay = module.restart_delay / 10
+        # noinspection PyTypeChecker
+        module.init(bot)
+
+        assert bot.run_until(lambda: "!echo" in bot.eventmanager.message_routes)
+        assert bot.accessmanager.acls == {"!echo": ["%moderators"]}
+        pid = module.process.pid
+
+        bot.eventmanager.handle_message("@mod=1 :user!user@host PRIVMSG #channel :!echo hello")
+        bot.eventmanager.handle_message(":other!other@host PRIVMSG #channel :!echo world")
+        assert bot.run_until(lambda: len(bot.sent) == 2)
+        assert bot.sent == ["hello True", "world False"]
+
+        bot.eventmanager.handle_message(":user!user@host PRIVMSG #channel :!exit")
+        assert bot.run_until(lambda: module.restarts == 1 and "!echo" in bot.eventmanager.message_routes)
+        assert module.process.pid != pid
+
+        bot.eventmanager.handle_message("@mod=1 :user!user@host PRIVMSG #channel :!echo again")
+        assert bot.run_until(lambda: len(bot.sent) == 3)
+        assert bot.sent[2] == "again True"
+
+        bot.eventmanager.handle_message(":user!user@host PRIVMSG #channel :!exit")
+        assert bot.run_until(lambda: module.process is None)      # Waiting to be restarted
+        module.reload()
+        pid = module.process.pid
+        bot.run_until(lambda: False, timeout=module.delay.total_seconds() * 3)
+        assert module.process.pid == pid        # The pending restart was cancelled
+        assert len(bot.readers) == 1
+
+        module.dispose()
+        assert module.process is None
+        assert "!echo" not in bot.eventmanager.message_routes
@@ -0,0 +1,50 @@
+import os
+import shutil
+
+from modulewatcher import ModuleWatcher
+import tools
+
+
+class TestModulewatcher():
+
+    def setup(self):
+        self.path = os.path.join(tools.find_basepath(), "data_test")
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        self.write("old.py")
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name):
+        with open(os.path.join(self.path, name), "w") as file:
+            file.write("pass\n")
+
+    def test_modulewatcher_inotify(self):
+        watcher = ModuleWatcher([self.path])
+        watcher.start()
+        if watcher.fd is None:
+            return      # No inotify on this platform
+
+        assert watcher.changes() == set()
+        self.write("new.py")
+        self.write("notes.txt")
+        assert watcher.changes() == {os.path.join(self.path, "new.py")}
+        assert watcher.changes() == set()
+        watcher.stop()
+
+    def test_modulewatcher_poll(self):
+        watcher = ModuleWatcher([self.path])
+        watcher.mtimes = watcher.scan()     # Poll instead of using inotify
+
+        assert watcher.changes() == set()
+        self.write("new.py")
+        self.write("notes.txt")
+        assert watcher.changes() == set()   # Reported once the file has stayed the same for a poll
+        assert watcher.changes() == {os.path.join(self.path, "new.py")}
+        assert watcher.changes() == set()
+
+        os.remove(os.path.join(self.path, "old.py"))
+        watcher.changes()
+        assert watcher.changes() == {os.path.join(self.path, "old.py")}
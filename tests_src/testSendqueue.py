@@ -0,0 +1,112 @@
+import datetime
+
+from clock import SimulatedClock
+from sendqueue import SendQueue, TokenBucket, PRIORITY_AUTOMATIC
+
+
+class TestSendqueue():
+
+    def test_tokenbucket_burst_and_refill(self):
+        bucket = TokenBucket(2, 10)
+        bucket.updated = 0
+
+        assert bucket.consume(0)
+        assert bucket.consume(0)
+        assert not bucket.consume(0)
+        assert bucket.delay(0) == 5
+
+        assert not bucket.consume(4)
+        assert bucket.consume(5)
+        assert bucket.delay(100) == 0
+
+    def test_sendqueue_ratelimit(self):
+        queue = SendQueue("normal")
+        queue.bucket.updated = 0
+
+        for i in range(25):
+            queue.push(str(i))
+
+        sent = []
+        while True:
+            line = queue.pop(0)
+            if line is None:
+                break
+            sent.append(line)
+
+        assert sent == [str(i) for i in range(20)]
+        assert len(queue) == 5
+        assert queue.delay(0) == 1.5
+        assert queue.pop(1.5) == "20"
+
+    def test_sendqueue_drop(self):
+        queue = SendQueue("moderator", maxlen=2)
+
+        assert queue.push("a")
+        assert queue.push("b")
+        assert not queue.push("c")
+
+        assert queue.stats() == {"queued": 2, "sent": 0, "dropped": 1, "coalesced": 0}
+
+    def test_sendqueue_priorities(self):
+        queue = SendQueue("normal")
+        queue.bucket.updated = 0
+
+        queue.push("repeat", PRIORITY_AUTOMATIC)
+        queue.push("reply")
+
+        assert queue.pop(0) == "reply"
+        assert queue.pop(0) == "repeat"
+
+    def test_sendqueue_automatic_reserve(self):
+        queue = SendQueue("normal")
+        queue.bucket.updated = 0
+
+        for i in range(20):
+            queue.push("automatic " + str(i), PRIORITY_AUTOMATIC)
+        sent = 0
+        while queue.pop(0) is not None:
+            sent += 1
+
+        assert sent == 10                           # Only the first ten fit in the queue
+        queue.push("reply")
+        assert queue.pop(0) == "reply"              # Automatic messages left a reserve for replies
+
+    def test_sendqueue_coalesce(self):
+        queue = SendQueue("normal")
+
+        assert queue.push("repeat", PRIORITY_AUTOMATIC)
+        assert not queue.push("repeat", PRIORITY_AUTOMATIC)
+        assert len(queue) == 1
+        assert queue.stats()["coalesced"] == 1
+
+    def test_sendqueue_replace_automatic(self):
+        queue = SendQueue("normal", maxlen=2)
+
+        queue.push("automatic", PRIORITY_AUTOMATIC)
+        queue.push("reply 1")
+        assert queue.push("reply 2")
+
+        assert list(queue.interactive) == ["reply 1", "reply 2"]
+        assert len(queue.automatic) == 0
+        assert queue.stats()["dropped"] == 1
+
+    def test_sendqueue_empty(self):
+        queue = SendQueue("unknown")
+
+        assert queue.account == "normal"
+        assert queue.pop(0) is None
+        assert queue.delay(0) is None
+
+    def test_sendqueue_clock(self):
+        clock = SimulatedClock()
+        clock.advance(datetime.timedelta(hours=1))
+        queue = SendQueue("normal", clock=clock)
+
+        for i in range(21):
+            queue.push(str(i))
+        for i in range(20):
+            assert queue.pop(clock.monotonic()) == str(i)
+        assert queue.pop(clock.monotonic()) is None
+
+        clock.advance(datetime.timedelta(seconds=1.5))
+        assert queue.pop(clock.monotonic()) == "20"
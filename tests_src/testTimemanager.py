@@ -0,0 +1,122 @@
+import datetime
+import time
+
+from timemanager import TimeManager
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def action(self, name):
+        def callback():
+            self.calls.append(name)
+        return callback
+
+
+class TestTimemanager():
+
+    def setup(self):
+        self.tm = TimeManager()
+        self.rec = Recorder()
+
+    def test_timemanager_once(self):
+        action = self.rec.action("once")
+
+        self.tm.register_once(action, datetime.timedelta(seconds=-1))
+        self.tm.handle_events()
+        self.tm.handle_events()
+
+        assert self.rec.calls == ["once"]
+        assert self.tm.next_deadline() is None
+        assert self.tm.actions == {}
+
+    def test_timemanager_order(self):
+        for i in [3, 1, 4, 5, 2]:
+            self.tm.register_once(self.rec.action(i), datetime.timedelta(seconds=-i))
+        self.tm.register_once(self.rec.action("later"), datetime.timedelta(hours=1))
+        self.tm.handle_events()
+
+        assert self.rec.calls == [5, 4, 3, 2, 1]
+        assert self.tm.next_deadline() is not None
+
+    def test_timemanager_interval(self):
+        action = self.rec.action("interval")
+
+        self.tm.register_interval(action, datetime.timedelta(hours=1), datetime.timedelta(seconds=-1))
+        deadline = self.tm.next_deadline()
+        self.tm.handle_events()
+
+        assert self.rec.calls == ["interval"]
+        assert self.tm.next_deadline() == deadline + 3600
+
+    def test_timemanager_unregister(self):
+        keep = self.rec.action("keep")
+        remove = self.rec.action("remove")
+
+        self.tm.register_interval(remove, datetime.timedelta(hours=1), datetime.timedelta(seconds=-2))
+        self.tm.register_once(remove, datetime.timedelta(seconds=-1))
+        self.tm.register_once(keep, datetime.timedelta(seconds=-1))
+
+        self.tm.unregister(remove)
+        self.tm.handle_events()
+
+        assert self.rec.calls == ["keep"]
+        assert self.tm.next_deadline() is None
+
+    def test_timemanager_many_cancelled(self):
+        actions = [self.rec.action(i) for i in range(1000)]
+
+        for i, action in enumerate(actions):
+            self.tm.register_once(action, datetime.timedelta(seconds=i))
+        for action in actions[:900]:
+            self.tm.unregister(action)
+
+        assert len(self.tm.time_events) < 1000       # Cancelled events have been compacted away
+        assert len(self.tm.actions) == 100
+
+    def test_timemanager_catchup_coalesce(self):
+        action = self.rec.action("coalesce")
+
+        self.tm.register_interval(action, datetime.timedelta(hours=1), datetime.timedelta(hours=-3.5))
+        self.tm.handle_events()
+        self.tm.handle_events()
+
+        assert self.rec.calls == ["coalesce"]
+        assert self.tm.missed_ticks(action) == 3
+        assert time.monotonic() < self.tm.next_deadline() < time.monotonic() + 3600
+
+    def test_timemanager_catchup_skip(self):
+        action = self.rec.action("skip")
+
+        self.tm.register_interval(action, datetime.timedelta(hours=1), datetime.timedelta(hours=-2.5), catchup="skip")
+        self.tm.handle_events()
+
+        assert self.rec.calls == []
+        assert self.tm.missed_ticks(action) == 2
+
+    def test_timemanager_catchup_burst(self):
+        action = self.rec.action("burst")
+
+        self.tm.register_interval(action, datetime.timedelta(hours=1), datetime.timedelta(hours=-2.5), catchup="burst")
+        self.tm.handle_events()
+        self.tm.handle_events()
+
+        assert self.rec.calls == ["burst"] * 3
+        assert self.tm.missed_ticks(action) == 2
+
+    def test_timemanager_catchup_invalid(self):
+        try:
+            self.tm.register_interval(lambda: None, datetime.timedelta(hours=1), catchup="invalid")
+            assert False
+        except ValueError:
+            pass
+
+    def test_timemanager_interval_invalid(self):
+        for interval in [datetime.timedelta(0), datetime.timedelta(seconds=-1)]:
+            try:
+                self.tm.register_interval(lambda: None, interval)
+                assert False
+            except ValueError:
+                pass
+        assert self.tm.next_deadline() is None
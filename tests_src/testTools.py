@@ -1,3 +1,4 @@
+import jsonpickle
 import tools
 import os
 
@@ -30,4 +31,17 @@ def test_find_basepath():
     os.chdir(os.path.join(real_base, "src"))
     assert os.path.abspath(tools.find_basepath()) == os.path.abspath(real_base)
 
-    os.chdir(os.path.dirname(__file__))
\ No newline at end of file
+    os.chdir(os.path.dirname(__file__))
+
+
+def test_json_classes():
+    class Data:
+        pass
+    Data.__module__ = "mustikkabot.modules.test"
+    Data.__qualname__ = "Data"
+
+    classes = tools.json_classes(Data)
+    assert classes == {"mustikkabot.modules.test.Data": Data, "test.Data": Data}
+
+    old = jsonpickle.decode('{"py/object": "test.Data", "value": 1}', classes=classes)
+    assert type(old) is Data and old.value == 1
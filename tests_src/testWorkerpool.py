@@ -0,0 +1,134 @@
+import datetime
+import threading
+import time
+
+from clock import SimulatedClock
+from workerpool import WorkerPool
+from timemanager import TimeManager
+
+
+def wait_for(pool, count=1):
+    for i in range(200):
+        if pool.count < count:
+            return
+        time.sleep(0.01)
+        pool.handle_results()
+    raise AssertionError("Blocking actions did not finish")
+
+
+class TestWorkerpool():
+
+    def test_workerpool_results_in_main_thread(self):
+        pool = WorkerPool()
+        threads = []
+
+        def action():
+            assert pool.in_worker()
+            pool.call_in_main(lambda: threads.append(threading.current_thread()))
+
+        assert pool.submit(action, action)
+        wait_for(pool)
+
+        assert threads == [threading.current_thread()]
+        assert not pool.in_worker()
+        assert pool.in_flight == {}
+        pool.shutdown()
+
+    def test_workerpool_in_flight_limit(self):
+        pool = WorkerPool(max_in_flight=2)
+        release = threading.Event()
+
+        def action():
+            release.wait(1)
+
+        assert pool.submit("a", action)
+        assert not pool.submit("a", action)       # Previous run is still going
+        assert pool.submit("b", action)
+        assert not pool.submit("c", action)       # Pool is full
+        assert pool.rejected == 2
+
+        release.set()
+        wait_for(pool)
+        assert pool.submit("a", action)
+        wait_for(pool)
+        pool.shutdown()
+
+    def test_workerpool_backlog(self):
+        pool = WorkerPool(max_in_flight=2)
+        release = threading.Event()
+        handled = []
+
+        def action(name):
+            release.wait(1)
+            pool.call_in_main(handled.append, name)
+
+        assert pool.submit("a", action, ("a1",), backlog=2)
+        assert pool.submit("a", action, ("a2",), backlog=2)     # Waits for a1
+        assert pool.submit("b", action, ("b1",), backlog=2)
+        assert pool.submit("c", action, ("c1",), backlog=2)     # Waits for a free slot in the pool
+        assert pool.submit("a", action, ("a3",), backlog=2)
+        assert not pool.submit("a", action, ("a4",), backlog=2)     # Backlog of a is full
+        assert pool.queued == 3
+        assert pool.rejected == 1
+
+        release.set()
+        wait_for(pool)
+        assert sorted(handled) == ["a1", "a2", "a3", "b1", "c1"]
+        assert handled.index("a1") < handled.index("a2") < handled.index("a3")
+        assert pool.waiting == {}
+        pool.shutdown()
+
+    def test_workerpool_timeout(self):
+        pool = WorkerPool()
+        release = threading.Event()
+        sent = []
+
+        def action():
+            release.wait(1)
+            pool.call_in_main(sent.append, "late")
+
+        assert pool.submit(action, action, timeout=0)
+        pool.check_timeouts()
+        assert pool.timed_out == 1
+        assert pool.next_deadline() is None
+
+        release.set()
+        wait_for(pool)
+        assert sent == []                           # Results of a timed out action are dropped
+        pool.shutdown()
+
+    def test_workerpool_timeout_clock(self):
+        clock = SimulatedClock()
+        pool = WorkerPool(timeout=30, clock=clock)
+        release = threading.Event()
+
+        assert pool.submit("a", release.wait, (1,))
+        assert pool.next_deadline() == 30
+
+        clock.advance(datetime.timedelta(seconds=29))
+        pool.check_timeouts()
+        assert pool.timed_out == 0
+
+        clock.advance(datetime.timedelta(seconds=1))
+        pool.check_timeouts()
+        assert pool.timed_out == 1
+
+        release.set()
+        wait_for(pool)
+        pool.shutdown()
+
+    def test_timemanager_blocking_action(self):
+        tm = TimeManager()
+        tm.workerpool = WorkerPool()
+        threads = []
+
+        def action():
+            threads.append(threading.current_thread())
+
+        tm.register_once(action, datetime.timedelta(seconds=-1), blocking=True)
+        tm.handle_events()
+        wait_for(tm.workerpool)
+
+        assert len(threads) == 1
+        assert threads[0] is not threading.current_thread()
+        tm.workerpool.shutdown()